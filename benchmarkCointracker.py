@@ -0,0 +1,360 @@
+import argparse
+import contextlib
+import io
+import json
+import shutil
+import tempfile
+import time
+import tracemalloc
+import openpyxl
+from pathlib import Path
+
+import formatCointracker as fc
+from generateReports import generateReport, REPORT_TYPES, FUND_AND_WITHDRAW, QUICK_TRADE, TRANSACTIONS
+
+# Default number of rows of the benchmarked reports
+DEFAULT_ROW_COUNTS = [1000, 100000]
+
+# Default number of transactions already in the Master Ledgers that are updated
+DEFAULT_LEDGER_SIZES = [1000, 10000, 100000]
+
+# Number of transactions added to each Master Ledger, half of which are duplicates of the ledger's
+LEDGER_UPDATE_SIZE = 2000
+
+# Master Ledger backends that are benchmarked
+LEDGER_EXTS = ['.xlsx', '.db']
+
+# Number of quick trades the vectorized fee and cost basis calculations are benchmarked on
+QUICK_TRADE_COLUMN_ROWS = 1000000
+
+# Bytes in a MiB, the unit of the reported peak memory
+BYTES_PER_MIB = 1024 * 1024
+
+# (amount, currency) columns of each report type, whose amounts are parsed by the amount parsing benchmarks
+AMOUNT_COLUMNS = {
+    FUND_AND_WITHDRAW: [('amount', 'currency')],
+    QUICK_TRADE: [('from_amount', 'from_currency'), ('to_amount', 'to_currency')],
+    TRANSACTIONS: [('amount', 'product')]
+}
+
+
+# Times a function over fresh arguments from setup, then runs it once more under tracemalloc for its peak memory
+def measure(name, num_rows, setup, func, repeat=1, trace_memory=True):
+    timings = []
+    for _ in range(repeat):
+        args = setup()
+        with contextlib.redirect_stdout(io.StringIO()):
+            start = time.perf_counter()
+            func(*args)
+            timings.append(time.perf_counter() - start)
+
+    peak_mib = None
+    if trace_memory:
+        args = setup()
+        tracemalloc.start()
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                func(*args)
+            peak_mib = tracemalloc.get_traced_memory()[1] / BYTES_PER_MIB
+        finally:
+            tracemalloc.stop()
+
+    seconds = min(timings)
+    result = {
+        'name': name,
+        'rows': num_rows,
+        'seconds': round(seconds, 6),
+        'rows_per_second': round(num_rows / seconds) if seconds else None,
+        'peak_mib': round(peak_mib, 2) if peak_mib is not None else None
+    }
+    printResult(result)
+    return result
+
+
+# Prints a benchmark result as a row of the results table
+def printResult(result):
+    peak = f'{result["peak_mib"]:>9.2f}' if result['peak_mib'] is not None else f'{"-":>9}'
+    print(f'{result["name"]:<44}{result["rows"]:>9}{result["seconds"]:>11.4f}{result["rows_per_second"] or 0:>12}{peak}')
+
+
+# Returns a new empty directory inside the work directory
+def makeRunDir(work_dir):
+    return Path(tempfile.mkdtemp(dir=work_dir))
+
+
+# Returns the rows (after the header row) and detection of a report, ready for its formatter
+def openReport(report_path):
+    raw_rows = fc.readReportRows(report_path)
+    detection = fc.detectReport(next(raw_rows))
+    return raw_rows, detection
+
+
+# Runs a report's formatter over its rows, writing the formatted results to result_path
+def runFormatter(data, raw_rows, detection, result_path, formatter=None):
+    exchange, report_type, columns = detection
+    write_row, close_result_file = fc.openResultWriter(result_path)
+    write_row(fc.COINTRACKER_HEADER)
+    (formatter or fc.REPORT_FORMATTERS[report_type])(data, columns, raw_rows, write_row, {})
+    close_result_file()
+    raw_rows.close()
+
+
+# Returns the transactions formatted from a report
+def loadTransactions(report_path, work_dir):
+    data = []
+    raw_rows, detection = openReport(report_path)
+    with contextlib.redirect_stdout(io.StringIO()):
+        runFormatter(data, raw_rows, detection, makeRunDir(work_dir) / 'formatted.csv')
+    return data
+
+
+# Creates a Master Ledger holding the given transactions, along with its balance index
+def buildLedger(ledger_path, data):
+    with contextlib.redirect_stdout(io.StringIO()):
+        if fc.isSQLiteLedger(ledger_path):
+            fc.createMasterLedger(ledger_path)
+            fc.updateMasterLedger(list(data), ledger_path)
+            return
+
+        # Stream the transactions to the ledger instead of writing them cell by cell
+        ledger_workbook = openpyxl.Workbook(write_only=True)
+        ledger_sheet = ledger_workbook.create_sheet(title="Transactions")
+        ledger_sheet.append(fc.COINTRACKER_HEADER + fc.LEDGER_EXTRA_HEADER)
+        for tx in data:
+            row = tx.toRow()
+            # Skip the 'Tag' column, the same as updateMasterLedger
+            ledger_sheet.append(row[:7] + (None,) + row[7:])
+        ledger_workbook.save(ledger_path)
+        fc.updateBalanceIndex(None, [], ledger_path)
+
+
+# Copies a Master Ledger and its balance index into dest_dir, keeping the ledger's mtime so the index stays current
+def copyLedger(ledger_path, dest_dir):
+    dest_path = dest_dir / ledger_path.name
+    shutil.copy2(ledger_path, dest_path)
+    shutil.copy2(fc.getBalancesPath(ledger_path), fc.getBalancesPath(dest_path))
+    return dest_path
+
+
+# Benchmarks converting each .csv report to .xlsx
+def benchmarkCSVToXlsx(report_paths, work_dir, repeat, trace_memory):
+    results = []
+    for report_type, num_rows, report_path in report_paths:
+        def setup():
+            csv_path = makeRunDir(work_dir) / report_path.name
+            shutil.copy(report_path, csv_path)
+            return (csv_path,)
+        results.append(measure(f'csvToXlsx[{report_type}]', num_rows, setup, fc.csvToXlsx, repeat, trace_memory))
+    return results
+
+
+# Benchmarks detecting the exchange of each report from its header row
+def benchmarkGetExchangeName(report_paths, repeat, trace_memory):
+    results = []
+    for report_type, num_rows, report_path in report_paths:
+        name = f'getExchangeName[{report_type}{report_path.suffix}]'
+        results.append(measure(name, num_rows, lambda: (report_path,), fc.getExchangeName, repeat, trace_memory))
+    return results
+
+
+# Benchmarks the formatter of each report, including writing its formatted results
+def benchmarkFormatters(report_paths, work_dir, repeat, trace_memory):
+    results = []
+    for report_type, num_rows, report_path in report_paths:
+        def setup():
+            raw_rows, detection = openReport(report_path)
+            return [], raw_rows, detection, makeRunDir(work_dir) / ('formatted' + report_path.suffix)
+        name = f'format[{report_type}{report_path.suffix}]'
+        results.append(measure(name, num_rows, setup, runFormatter, repeat, trace_memory))
+    return results
+
+
+# Returns the (amount, currency) pairs of a report's amount columns, as text read from the report
+def readAmounts(report_type, report_path):
+    raw_rows = fc.readReportRows(report_path)
+    header = next(raw_rows)
+    columns = [(header.index(amount), header.index(currency)) for amount, currency in AMOUNT_COLUMNS[report_type]]
+    amounts = [(row[amount_col], row[currency_col]) for row in raw_rows for amount_col, currency_col in columns]
+    raw_rows.close()
+    return amounts
+
+
+# Parses amounts into floats, the same as the formatters did before they used fixed-point amounts
+def parseFloatAmounts(amounts):
+    for text, currency in amounts:
+        fc.extractFloatFromText(text)
+
+
+# Parses amounts into fixed-point integers of their currency's smallest units
+def parseFixedPointAmounts(amounts):
+    for text, currency in amounts:
+        fc.parseAmount(text, currency)
+
+
+# Benchmarks parsing the amounts of each report into floats against parsing them into fixed-point integers
+def benchmarkAmountParsing(report_paths, repeat, trace_memory):
+    results = []
+    for report_type, num_rows, report_path in report_paths:
+        amounts = readAmounts(report_type, report_path)
+        for name, func in [('parseFloatAmounts', parseFloatAmounts), ('parseFixedPointAmounts', parseFixedPointAmounts)]:
+            results.append(measure(f'{name}[{report_type}]', len(amounts), lambda: (amounts,), func,
+                repeat, trace_memory))
+    return results
+
+
+# Returns the (to_amounts, to_currencies, from_amounts, from_currencies) of a quick trade report, as fixed-point
+# amounts, split into chunks the size the formatter calculates together
+def readQuickTradeChunks(report_path):
+    raw_rows, (exchange, report_type, columns) = openReport(report_path)
+    rows = list(raw_rows)
+    chunks = []
+    for start in range(0, len(rows), fc.QUICK_TRADE_CHUNK_SIZE):
+        chunk = rows[start:start + fc.QUICK_TRADE_CHUNK_SIZE]
+        to_currencies = [row[columns['to_currency']] for row in chunk]
+        from_currencies = [row[columns['from_currency']] for row in chunk]
+        chunks.append((list(map(fc.parseAmount, [row[columns['to_amount']] for row in chunk], to_currencies)),
+            to_currencies, list(map(fc.parseAmount, [row[columns['from_amount']] for row in chunk], from_currencies)),
+            from_currencies))
+    return chunks
+
+
+# Calculates the quick trade fees and cost basis of each chunk with NumPy
+def calcQuickTradeChunks(chunks):
+    for chunk in chunks:
+        fc.calcQuickTradeColumns(*chunk)
+
+
+# Calculates the quick trade fees and cost basis one row at a time, the same as formatQuickTradeRows
+def calcQuickTradeRows(chunks):
+    for to_amounts, to_currencies, from_amounts, from_currencies in chunks:
+        for to_amount, to_currency, from_amount, from_currency in zip(to_amounts, to_currencies, from_amounts,
+                from_currencies):
+            fee_dict = fc.calcCoinsquareFee(to_amount, to_currency, from_amount, from_currency)
+            tx_type = fc.getTradeType(to_currency, from_currency)
+            if tx_type == fc.SELL_TX:
+                fee_amount = fee_dict['sent_fee_amount']
+            else:
+                fee_amount = fee_dict['received_fee_amount']
+                to_amount += fee_amount
+            fc.calcTxCostBasis(to_amount, to_currency, from_amount, from_currency, fee_amount, tx_type)
+
+
+# Benchmarks the vectorized quick trade formatter against the row by row one, both end to end from reading the
+# report to writing its formatted results, and for their fee and cost basis calculations alone
+def benchmarkQuickTradeColumns(num_rows, work_dir, repeat, trace_memory):
+    if fc.importNumPy() is None:
+        print('Skipping the calcQuickTradeColumns benchmark, NumPy is not installed.')
+        return []
+
+    report_path = generateReport(QUICK_TRADE, num_rows, work_dir)
+    results = []
+    for formatter in [fc.formatQuickTradeReport, fc.formatQuickTradeRows]:
+        def setup():
+            raw_rows, detection = openReport(report_path)
+            return [], raw_rows, detection, makeRunDir(work_dir) / 'formatted.csv', formatter
+        results.append(measure(formatter.__name__, num_rows, setup, runFormatter, repeat, trace_memory))
+
+    chunks = readQuickTradeChunks(report_path)
+    return results + [
+        measure('calcQuickTradeColumns', num_rows, lambda: (chunks,), calcQuickTradeChunks, repeat, trace_memory),
+        measure('calcQuickTradeRows', num_rows, lambda: (chunks,), calcQuickTradeRows, repeat, trace_memory)
+    ]
+
+
+# Benchmarks updating .xlsx and SQLite Master Ledgers of different sizes with new and duplicate transactions
+def benchmarkUpdateMasterLedger(ledger_sizes, work_dir, repeat, trace_memory):
+    results = []
+
+    # The ledgers are filled from an NDAX report and updated with its next transactions plus some duplicates
+    num_tx = max(ledger_sizes) + LEDGER_UPDATE_SIZE
+    report_path = generateReport(TRANSACTIONS, num_tx * 3, work_dir)
+    transactions = loadTransactions(report_path, work_dir)
+
+    for ledger_ext in LEDGER_EXTS:
+        for ledger_size in ledger_sizes:
+            ledger_path = work_dir / f'ledger_{ledger_size}{ledger_ext}'
+            buildLedger(ledger_path, transactions[:ledger_size])
+            new_data = transactions[max(0, ledger_size - LEDGER_UPDATE_SIZE // 2):ledger_size + LEDGER_UPDATE_SIZE // 2]
+
+            def setup():
+                return list(new_data), copyLedger(ledger_path, makeRunDir(work_dir))
+            name = f'updateMasterLedger[{ledger_ext} ledger of {ledger_size}]'
+            results.append(measure(name, len(new_data), setup, fc.updateMasterLedger, repeat, trace_memory))
+    return results
+
+
+# Benchmarks updating the balance index with the transactions formatted from an NDAX report of each size
+def benchmarkBalanceIndex(row_counts, work_dir, repeat, trace_memory):
+    results = []
+    for num_rows in row_counts:
+        data = loadTransactions(generateReport(TRANSACTIONS, num_rows, work_dir), work_dir)
+        setup = lambda: (fc.BalanceIndex(), data)
+        results.append(measure('BalanceIndex.apply', len(data), setup, applyBalances, repeat, trace_memory))
+    return results
+
+
+# Applies transactions to a balance index
+def applyBalances(balance_index, data):
+    for tx in data:
+        balance_index.apply(tx)
+
+
+# Benchmarks writing the Cointracker summary of the transactions formatted from each report size
+def benchmarkCointrackerSummary(row_counts, work_dir, repeat, trace_memory):
+    results = []
+    for num_rows in row_counts:
+        data = loadTransactions(generateReport(FUND_AND_WITHDRAW, num_rows, work_dir), work_dir)
+        setup = lambda: (data, str(makeRunDir(work_dir)) + '/')
+        results.append(measure('getCointrackerSummary', len(data), setup, fc.getCointrackerSummary,
+            repeat, trace_memory))
+    return results
+
+
+# Generates the reports, runs every benchmark and prints a table of the results
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the formatCointracker pipeline on synthetic reports.')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROW_COUNTS,
+        help='row counts of the benchmarked reports, ie. 1000 100000 1000000')
+    parser.add_argument('--ledger-sizes', type=int, nargs='+', default=DEFAULT_LEDGER_SIZES,
+        help='number of transactions already in the benchmarked Master Ledgers')
+    parser.add_argument('--quick-trade-rows', type=int, default=QUICK_TRADE_COLUMN_ROWS,
+        help='number of quick trades the vectorized formatter and its calculations are benchmarked on')
+    parser.add_argument('--repeat', type=int, default=1, help='timed runs of each benchmark, keeping the fastest')
+    parser.add_argument('--no-memory', action='store_true', help='skip the tracemalloc runs for peak memory')
+    parser.add_argument('--skip-csv-to-xlsx', action='store_true', help='skip the slow csvToXlsx benchmarks')
+    parser.add_argument('--json', type=Path, help='file to save the results to, for comparing runs')
+    args = parser.parse_args()
+    trace_memory = not args.no_memory
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        work_dir = Path(temp_dir)
+
+        # Generate each report type as both .csv and .xlsx
+        print('Generating reports...')
+        csv_paths = []
+        xlsx_paths = []
+        for num_rows in args.rows:
+            for report_type in REPORT_TYPES:
+                csv_paths.append((report_type, num_rows, generateReport(report_type, num_rows, work_dir)))
+                xlsx_paths.append((report_type, num_rows, generateReport(report_type, num_rows, work_dir, '.xlsx')))
+
+        print(f'{"benchmark":<44}{"rows":>9}{"seconds":>11}{"rows/s":>12}{"peak MiB":>9}')
+        results = []
+        if not args.skip_csv_to_xlsx:
+            results += benchmarkCSVToXlsx(csv_paths, work_dir, args.repeat, trace_memory)
+        results += benchmarkGetExchangeName(csv_paths + xlsx_paths, args.repeat, trace_memory)
+        results += benchmarkAmountParsing(csv_paths, args.repeat, trace_memory)
+        results += benchmarkQuickTradeColumns(args.quick_trade_rows, work_dir, args.repeat, trace_memory)
+        results += benchmarkFormatters(csv_paths + xlsx_paths, work_dir, args.repeat, trace_memory)
+        results += benchmarkUpdateMasterLedger(args.ledger_sizes, work_dir, args.repeat, trace_memory)
+        results += benchmarkBalanceIndex(args.rows, work_dir, args.repeat, trace_memory)
+        results += benchmarkCointrackerSummary(args.rows, work_dir, args.repeat, trace_memory)
+
+    if args.json is not None:
+        with open(args.json, 'w') as file:
+            json.dump(results, file, indent=2)
+        print(f'Saved the results to {args.json}')
+
+
+if __name__ == '__main__':
+    main()
@@ -2,10 +2,22 @@
 # formatCointracker.py
 # Formats various exchanges crypto transactions into the Cointracker format
 
-import os, openpyxl, shutil, csv
+import os, shutil, csv, json, sqlite3, sys, hashlib, math, time, tracemalloc, cProfile, argparse, queue, threading
 from pathlib import Path
-from openpyxl import workbook 
-from datetime import datetime
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+from itertools import repeat, islice
+from collections import deque
+from functools import lru_cache
+from bisect import bisect_left, bisect_right
+from datetime import datetime, timedelta, timezone
+from decimal import Decimal, ROUND_HALF_EVEN
+
+# The resource module is only available on Unix, where it reports the peak memory of the process
+try:
+    import resource
+except ImportError:
+    resource = None
 
 # Supported Exchanges
 COINSQUARE = 0
@@ -14,6 +26,15 @@ NDAX = 1
 # Supported Report Types
 FUND_AND_WITHDRAW = 2
 QUICK_TRADE = 3
+TRANSACTIONS = 6
+
+# Names of the supported exchanges
+EXCHANGE_NAMES = {COINSQUARE: "Coinsquare", NDAX: "NDAX"}
+
+# Default column index of each report type's fields, used for any field the header row doesn't name
+FUND_AND_WITHDRAW_COLUMNS = {'date': 0, 'operation': 2, 'amount': 3, 'currency': 4}
+QUICK_TRADE_COLUMNS = {'date': 0, 'from_currency': 1, 'from_amount': 2, 'to_currency': 3, 'to_amount': 4}
+NDAX_COLUMNS = {'txid': 0, 'ref_id': 1, 'date': 2, 'time': 3, 'type': 4, 'product': 5, 'amount': 7}
 
 # Exchange Fees
 COINSQUARE_BTC_TX_FEE = .002            # 0.2%
@@ -21,10 +42,26 @@ COINSQUARE_NON_BTC_TX_FEE = .004        # 0.4%
 COINSQUARE_BTC_WITHDRAW_FEE = 0.0005
 COINSQUARE_ETH_WITHDRAW_FEE = 0.005
 COINSQUARE_DOGE_WITHDRAW_FEE = 2
+COINSQUARE_WITHDRAW_FEES = {'BTC': COINSQUARE_BTC_WITHDRAW_FEE, 'ETH': COINSQUARE_ETH_WITHDRAW_FEE,
+    'DOGE': COINSQUARE_DOGE_WITHDRAW_FEE}
 
 # Assorted
 BUY_TX = 4
 SELL_TX = 5
+CRYPTO_TX = 7
+
+# Number of decimals each currency's amounts are kept to as fixed-point integers of its smallest units, any other
+# currency keeping up to DEFAULT_CURRENCY_DECIMALS, and the number of decimals the cost basis is rounded to
+CURRENCY_DECIMALS = {'CAD': 2, 'USD': 2, 'BTC': 8, 'BCH': 8, 'LTC': 8, 'DOGE': 8, 'ETH': 18}
+DEFAULT_CURRENCY_DECIMALS = 18
+COST_BASIS_DECIMALS = 3
+
+# Powers of ten scaling the fixed-point amounts, by number of decimals
+POWERS_OF_TEN = [10 ** decimals for decimals in range(2 * DEFAULT_CURRENCY_DECIMALS + 1)]
+
+# Smallest units in one unit of each currency, so converting an amount back to a float takes a single lookup
+CURRENCY_SCALES = {currency: POWERS_OF_TEN[decimals] for currency, decimals in CURRENCY_DECIMALS.items()}
+DEFAULT_CURRENCY_SCALE = POWERS_OF_TEN[DEFAULT_CURRENCY_DECIMALS]
 
 # Lists of letters
 A_TO_G_LIST = ['A', 'B', 'C', 'D', 'E', 'F', 'G']
@@ -32,8 +69,127 @@ A_TO_H_LIST = A_TO_G_LIST + ['H']
 I_TO_L_LIST = ['I', 'J', 'K', 'L']
 A_TO_G_NO_I_LIST = A_TO_G_LIST + I_TO_L_LIST
 
+# Header row of the Cointracker formatted files
+COINTRACKER_HEADER = ['Date', 'Received Quantity', 'Received Currency', 'Sent Quantity',
+    'Sent Currency', 'Fee Amount', 'Fee Currency', 'Tag']
+
+# Extra columns of the Master Ledger after the Cointracker columns
+LEDGER_EXTRA_HEADER = ['Cost Basis', 'Cost Basis Units', 'Exchange', 'Tx_Id']
+
+# Fields of a Master Ledger transaction in the order of the ledger's columns (skipping the 'Tag' column)
+LEDGER_FIELDS = ('date', 'received_qty', 'received_currency', 'sent_qty', 'sent_currency', 'fee_amount',
+    'fee_currency', 'cost_basis', 'cost_basis_units', 'exchange', 'tx_id')
+
+# Master Ledger columns
+TX_ID_COL = 12                          # Column L
+
+# Master Ledger file types that are stored in a SQLite database instead of a workbook
+SQLITE_LEDGER_SUFFIXES = ('.db', '.sqlite', '.sqlite3')
+
+# Date formats of the Cointracker files and the SQLite Master Ledger (sortable for indexed date queries)
+COINTRACKER_DATE_FORMAT = '%m/%d/%Y %H:%M:%S'
+SQLITE_DATE_FORMAT = '%Y-%m-%d %H:%M:%S'
+
+# Suffix of the sidecar file storing the Master Ledger's tx_id index
+TX_ID_INDEX_SUFFIX = '.txids.json'
+
+# Suffix of the manifest file recording the reports already processed into the Master Ledger
+MANIFEST_SUFFIX = '.manifest.json'
+
+# Number of rows between the prefix hashes the manifest keeps for each report
+MANIFEST_CHECKPOINT_ROWS = 1000
+
+# Size of the chunks a report file is read in to hash its content
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Prefix of the tx_ids generated for Coinsquare transactions, whose reports don't have any
+COINSQUARE_TX_ID_PREFIX = 'CS-'
+
+# Environment variables enabling the instrumentation: the JSON lines file to write the stage metrics to ('-' for
+# stderr), and the name of a report file to format under cProfile
+METRICS_ENV_VAR = 'COINTRACKER_METRICS'
+PROFILE_ENV_VAR = 'COINTRACKER_PROFILE'
+
+# Bytes in a MiB, the unit of the reported memory
+BYTES_PER_MIB = 1024 * 1024
+
+# Default layout of the main crypto directory
+LEDGER_FILENAME = 'Master_Ledger.xlsx'
+REPORTS_DIRNAME = 'Reports'
+RESULTS_DIRNAME = 'Results'
+PRICES_DIRNAME = 'Prices'
+
+# Seconds between each poll of the reports directory in watch mode, the time a report must go unmodified before
+# it's processed, and the longest time new transactions are kept in memory before being written to the Master Ledger
+WATCH_POLL_SECONDS = 2
+WATCH_SETTLE_SECONDS = 5
+LEDGER_FLUSH_SECONDS = 60
+
+# Number of reports read ahead of the formatting in the I/O pipeline, and its default number of writer threads
+PIPELINE_QUEUE_SIZE = 2
+PIPELINE_WRITER_THREADS = 2
+
+# Number of distinct raw dates kept by each of the date normalization caches
+DATE_CACHE_SIZE = 4096
+
+# Number of quick trade rows calculated together when NumPy is available
+QUICK_TRADE_CHUNK_SIZE = 10000
+
+# Number of legs of an NDAX trade (received, sent and fee), and the most trades still missing legs that are kept
+# while reading a report before the oldest one is given up on as incomplete
+NDAX_TRADE_LEGS = 3
+NDAX_MAX_OPEN_TRADES = 10000
+
+# Currency the adjusted cost base (ACB) of the positions is kept in
+ACB_CURRENCY = 'CAD'
+
+# File storing the position checkpoints next to the Master Ledger, the number of transactions between each
+# checkpoint and the most checkpoints kept
+POSITIONS_SUFFIX = '.positions.json'
+POSITION_CHECKPOINT_TX = 1000
+POSITION_MAX_CHECKPOINTS = 50
+
+# Version of the way the positions are computed, any checkpoint saved by another version being replayed
+POSITIONS_VERSION = 2
+
+# Smallest quantity left in a FIFO lot, below which it's treated as used up
+LOT_EPSILON = 1e-12
+
+# File storing the balance index next to the Master Ledger, and the number of decimals its balances are kept to so
+# the ledger's amounts are summed exactly, before being compared at each currency's own precision
+BALANCES_SUFFIX = '.balances.json'
+BALANCE_DECIMALS = DEFAULT_CURRENCY_DECIMALS
+
+# Default exchange-provided balance file in the main crypto directory, and the names of its columns
+BALANCES_FILENAME = 'Balances.csv'
+BALANCE_FILE_COLUMNS = ('exchange', 'currency', 'balance')
+
+# Environment variable naming the directory of the local price files that value crypto to crypto trades in CAD
+PRICES_ENV_VAR = 'COINTRACKER_PRICES'
+
+# Furthest a price can be from the time of the trade it values, and the number of price lookups kept in the cache
+PRICE_MAX_GAP_HOURS = 36
+PRICE_CACHE_SIZE = 65536
+
+# Names of the timestamp and price columns of the price files, otherwise their first two columns are used
+PRICE_TIMESTAMP_COLUMNS = ('timestamp', 'datetime', 'date', 'time')
+PRICE_VALUE_COLUMNS = ('close', 'price', 'rate')
+
+# Largest epoch timestamp of a price file read as seconds, any larger one being in milliseconds (ie. 1612137600000)
+PRICE_MAX_EPOCH_SECONDS = 10 ** 11
+
+# Suffix of the journals of the reports being formatted, kept in the results directory until their transactions are
+# in the Master Ledger, and the number of rows formatted between each commit to a journal (a multiple of the quick
+# trade chunks so none is half formatted at a commit)
+JOURNAL_SUFFIX = '.journal'
+JOURNAL_CHUNK_ROWS = 5 * QUICK_TRADE_CHUNK_SIZE
+
+# Number of incomplete NDAX trades listed by their ref_id when reporting them
+NDAX_LISTED_INCOMPLETE_TRADES = 10
+
 # Convert .csv files to .xlsx
 def csvToXlsx(csv_file_path):
+    import openpyxl
 
     # Create the excel workbook
     workbook = openpyxl.Workbook()
@@ -52,32 +208,194 @@ def csvToXlsx(csv_file_path):
                 worksheet.cell(row=adj_row, column=adj_col).value = col_val
     
     # Organize the files
-    xlsx_file_dir = os.path.abspath(csv_file_path.parent) + '\\' + csv_file_path.stem + '.xlsx'
-    xlsx_file_path = Path(xlsx_file_dir)
+    xlsx_file_path = csv_file_path.with_suffix('.xlsx')
     workbook.save(os.path.abspath(xlsx_file_path))
     os.unlink(csv_file_path)
     print(f'Successfully converted {csv_file_path.name} to {xlsx_file_path.name}')
+    return worksheet.max_row
+
+
+# Sets where the stage metrics are written and which report is profiled, through the environment so worker
+# processes are instrumented the same way
+def configureInstrumentation(metrics_path=None, profile_report=None):
+    if metrics_path is not None:
+        os.environ[METRICS_ENV_VAR] = str(metrics_path)
+    if profile_report is not None:
+        os.environ[PROFILE_ENV_VAR] = str(profile_report)
+
+
+# Returns whether the stage metrics are being recorded
+def isInstrumented():
+    return bool(os.environ.get(METRICS_ENV_VAR))
+
+
+# Returns the peak memory used by the process so far in MiB, if the platform reports it
+def getPeakRSS():
+    if resource is None:
+        return None
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # macOS reports it in bytes and Linux in KiB
+    if sys.platform == 'darwin':
+        return peak_rss / BYTES_PER_MIB
+    return peak_rss / 1024
+
+
+# Writes the metrics of a stage as a JSON line to the metrics file, or stderr
+def emitStageMetrics(stage, report_path, exchange, seconds, rows=None, peak_traced_mib=None):
+    peak_rss_mib = getPeakRSS()
+    metrics = {
+        "stage": stage,
+        "report": report_path.name if report_path is not None else None,
+        "exchange": EXCHANGE_NAMES.get(exchange),
+        "seconds": round(seconds, 6),
+        "rows": rows,
+        "rows_per_second": round(rows / seconds, 1) if rows and seconds > 0 else None,
+        "peak_rss_mib": round(peak_rss_mib, 2) if peak_rss_mib is not None else None,
+        "peak_traced_mib": round(peak_traced_mib, 2) if peak_traced_mib is not None else None,
+        "pid": os.getpid()
+    }
+    line = json.dumps(metrics) + '\n'
+
+    metrics_path = os.environ.get(METRICS_ENV_VAR)
+    if metrics_path == '-':
+        sys.stderr.write(line)
+    else:
+        # Appending whole lines lets worker processes share the same metrics file
+        with open(metrics_path, 'a') as file:
+            file.write(line)
+
+
+# Measures the wall time of a stage, emitting its metrics when instrumented along with the rows it set in stats
+# Time spent loading rows (stats['load_seconds']) is left out, and the peak of the traced memory is only
+# reported when tracemalloc is tracing (ie. python -X tracemalloc)
+@contextmanager
+def measureStage(stage, report_path=None, exchange=None):
+    stats = {}
+    if not isInstrumented():
+        yield stats
+        return
+
+    if tracemalloc.is_tracing():
+        tracemalloc.reset_peak()
+    start = time.perf_counter()
+    yield stats
+    seconds = time.perf_counter() - start - stats.get('load_seconds', 0)
+
+    peak_traced_mib = tracemalloc.get_traced_memory()[1] / BYTES_PER_MIB if tracemalloc.is_tracing() else None
+    emitStageMetrics(stage, report_path, exchange, seconds, stats.get('rows'), peak_traced_mib)
+
+
+# Streams the rows of a report, counting them and the time spent reading them into stats
+def timeRows(raw_rows, stats):
+    perf_counter = time.perf_counter
+    load_seconds = 0
+    rows = 0
+    try:
+        while True:
+            start = perf_counter()
+            row = next(raw_rows, None)
+            load_seconds += perf_counter() - start
+            if row is None:
+                break
+            rows += 1
+            yield row
+    finally:
+        raw_rows.close()
+        stats['load_seconds'] = load_seconds
+        stats['rows'] = rows
+
+
+# Streams the rows of a .csv report as lists of values, skipping any blank lines
+def readCSVRows(csv_file_path):
+    with open(csv_file_path, 'rt', encoding='utf8', newline='') as file:
+        for row in csv.reader(file):
+            if row:
+                yield row
+
+
+# Streams the rows of an .xlsx report as tuples of values from a read-only workbook
+def readXlsxRows(xlsx_file_path):
+    import openpyxl
+    workbook = openpyxl.load_workbook(xlsx_file_path, read_only=True)
+    try:
+        for row in workbook.active.iter_rows(values_only=True):
+            # Skip any empty rows left at the end of the sheet
+            if any(value is not None for value in row):
+                yield row
+    finally:
+        workbook.close()
+
+
+# Streams the rows of a .csv or .xlsx report
+def readReportRows(report_path):
+    if report_path.suffix == '.csv':
+        return readCSVRows(report_path)
+    return readXlsxRows(report_path)
+
+
+# Returns a map of each field to its column index, preferring the column the header row names for it
+def buildColumnMap(header, default_columns):
+    columns = {}
+    for field, col in default_columns.items():
+        columns[field] = header.index(field) if field in header else col
+    return columns
+
+
+# Returns the type of report generated from Coinsquare based on its header row
+def getCoinsquareReportType(header):
+    if header[1] == "description":
+        return FUND_AND_WITHDRAW
+    elif header[1] == "from_currency":
+        return QUICK_TRADE
 
 
-# Returns the exchange from which the report file originated from
-def getExchangeName(file_path):
-    # Load the workbook
-    workbook = openpyxl.load_workbook(file_path)
-    sheet = workbook.active
+# Detects an NDAX transactions report from its header row
+def detectNDAXReport(header):
+    if header[0] == 'txid':
+        return NDAX, TRANSACTIONS, buildColumnMap(header, NDAX_COLUMNS)
 
-    # Determine the exchange based on the report file format
-    if sheet['A1'].value == 'txid':
-        return NDAX
-    elif sheet['G1'].value == 'btid' or sheet['E1'].value == 'to_amount':
-        return COINSQUARE
 
+# Detects a Coinsquare report and its report type from its header row
+def detectCoinsquareReport(header):
+    if header[6] == 'btid' or header[4] == 'to_amount':
+        report_type = getCoinsquareReportType(header)
+        if report_type == FUND_AND_WITHDRAW:
+            return COINSQUARE, report_type, buildColumnMap(header, FUND_AND_WITHDRAW_COLUMNS)
+        elif report_type == QUICK_TRADE:
+            return COINSQUARE, report_type, buildColumnMap(header, QUICK_TRADE_COLUMNS)
 
-# Returns the type of report generated from Coinsquare
-def getCoinsquareReportType(sheet):
-    if sheet['B1'].value == "description":
-        return FUND_AND_WITHDRAW
-    elif sheet['B1'].value == "from_currency":
-        return QUICK_TRADE
+
+# Registry of the report detectors, tried in order on the header row of each report
+REPORT_DETECTORS = [detectNDAXReport, detectCoinsquareReport]
+
+
+# Adds a report detector to the registry
+def registerReportDetector(detector):
+    REPORT_DETECTORS.append(detector)
+    return detector
+
+
+# Returns the (exchange, report type, column map) of a report from its header row, or None if unrecognized
+def detectReport(header):
+    # Pad short header rows so the detectors can check any of the first columns
+    header = list(header) + [None] * (8 - len(header))
+    for detector in REPORT_DETECTORS:
+        detection = detector(header)
+        if detection is not None:
+            return detection
+
+
+# Returns the exchange from which the report file originated from
+def getExchangeName(file_path):
+    # Only the header row of the report is needed
+    raw_rows = readReportRows(file_path)
+    header = next(raw_rows, [])
+    raw_rows.close()
+
+    detection = detectReport(header)
+    if detection is not None:
+        return detection[0]
 
 
 # Get a list of file paths given a set of search criteria
@@ -96,9 +414,7 @@ def writeToExcelSheet(sheet, col_letters, row_number, data):
 
 # Formats the header row of the Transcation files
 def formatCointrackerHeader(sheet):
-    col_names = ['Date', 'Received Quantity', 'Received Currency', 'Sent Quantity',
-        'Sent Currency', 'Fee Amount', 'Fee Currency', 'Tag']
-    writeToExcelSheet(sheet, A_TO_H_LIST, 1, col_names)
+    writeToExcelSheet(sheet, A_TO_H_LIST, 1, COINTRACKER_HEADER)
 
 
 # Create a directory for a supplied folder path
@@ -110,7 +426,11 @@ def createDirectory(folder_path):
 
 # Create a Master Ledger file
 def createMasterLedger(file_path):
-    if not file_path.is_file():
+    if isSQLiteLedger(file_path):
+        createSQLiteLedger(file_path)
+    elif not file_path.is_file():
+        import openpyxl
+
         # Create the workbook and worksheet
         ledger_workbook = openpyxl.Workbook()
         ledger_sheet = ledger_workbook.active
@@ -119,54 +439,68 @@ def createMasterLedger(file_path):
 
         # Worksheet formatting    
         formatCointrackerHeader(ledger_sheet)
-        extra_col_names = ['Cost Basis', 'Cost Basis Units', 'Exchange', 'Tx_Id']
-        writeToExcelSheet(ledger_sheet, I_TO_L_LIST, 1, extra_col_names)
+        writeToExcelSheet(ledger_sheet, I_TO_L_LIST, 1, LEDGER_EXTRA_HEADER)
 
         # Save the Master Ledger file
         ledger_workbook.save(os.path.abspath(file_path))
         print(f'Successfully created new Master Ledger file at {file_path}')
 
 
-def formatCoinsquareDate(date):
-    date_split = date.split("-")
-    day = date_split[0]
-    month = date_split[1]
-    year = date_split[2]
-    return month + '/' + day + '/20' + year + ' 13:00:00'
+# Normalizes a Coinsquare date (ie. 28-07-21) into a datetime and its Cointracker formatted date
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def normalizeCoinsquareDate(date):
+    day, month, year = date.split("-")
 
+    # Coinsquare only reports the day, so all its transactions are set at 13:00
+    timestamp = datetime(2000 + int(year), int(month), int(day), 13)
+    return timestamp, timestamp.strftime(COINTRACKER_DATE_FORMAT)
 
-def formatNDAXDate(raw_date, raw_time):
-    # Date = 2021-07-28
-    date_split = raw_date.split("-")
-    year = date_split[0]
-    month = date_split[1]
-    day = date_split[2]    
 
-    # Time = 5:31 PM
-    raw_hour = raw_time.split(":")
-    raw_other = raw_hour[1].split(" ")
-    AM_or_PM = raw_other[1]
-    minute = raw_other[0]
-    hour = raw_hour[0]
-    hour_int = int(hour)
+# Normalizes an NDAX date (ie. 2021-07-28) and time (ie. 5:31 PM) into a datetime and its Cointracker formatted date
+@lru_cache(maxsize=DATE_CACHE_SIZE)
+def normalizeNDAXDate(raw_date, raw_time):
+    year, month, day = raw_date.split("-")
+    clock, AM_or_PM = raw_time.split(" ")
+    hour, minute = clock.split(":")
+
+    # Convert from 12 hour to 24 hour time format, where 12 AM is hour 0 and 12 PM is hour 12
+    hour = int(hour) % 12
+    if AM_or_PM == "PM":
+        hour += 12
+
+    timestamp = datetime(int(year), int(month), int(day), hour, int(minute))
+    return timestamp, timestamp.strftime(COINTRACKER_DATE_FORMAT)
 
-    # Convert from 12 hour to 24 hour time format
-    if AM_or_PM == "PM" and hour_int < 12:
-        hour = hour_int + 12
 
-    return month + '/' + day + '/' + year + ' ' + str(hour) + ':' + minute + ':' + '00'
+# Normalizes a whole column of Coinsquare dates through the date cache
+def normalizeCoinsquareDates(raw_dates):
+    return list(map(normalizeCoinsquareDate, raw_dates))
+
+
+# Normalizes whole columns of NDAX dates and times through the date cache
+def normalizeNDAXDates(raw_dates, raw_times):
+    return list(map(normalizeNDAXDate, raw_dates, raw_times))
+
+
+def formatCoinsquareDate(date):
+    return normalizeCoinsquareDate(date)[1]
+
+
+def formatNDAXDate(raw_date, raw_time):
+    return normalizeNDAXDate(raw_date, raw_time)[1]
 
 
 # Calculates the Coinsquare transaction fees that aren't explcitly in the reports
+# The quantities and fees are fixed-point amounts, the fees being rounded half to even to their currency's units
 def calcCoinsquareFee(received_qty, received_currency, sent_qty, sent_currency):
 
     # Determines the transaction fees based on the currency used
     if received_currency == "BTC" or sent_currency == "BTC":
-        received_fee_amount = received_qty * COINSQUARE_BTC_TX_FEE        
-        sent_fee_amount = sent_qty * COINSQUARE_BTC_TX_FEE
+        numerator, denominator = getRateRatio(COINSQUARE_BTC_TX_FEE)
     else:
-        received_fee_amount = received_qty * COINSQUARE_NON_BTC_TX_FEE        
-        sent_fee_amount = sent_qty * COINSQUARE_NON_BTC_TX_FEE
+        numerator, denominator = getRateRatio(COINSQUARE_NON_BTC_TX_FEE)
+    received_fee_amount = divideRounded(received_qty * numerator, denominator)
+    sent_fee_amount = divideRounded(sent_qty * numerator, denominator)
     
     # Makes the transaction fee available as both in sent and received currencies
     received_fee_currency = received_currency
@@ -176,31 +510,298 @@ def calcCoinsquareFee(received_qty, received_currency, sent_qty, sent_currency):
             "sent_fee_amount": sent_fee_amount, "sent_fee_currency": sent_fee_currency}
 
 
-# Calculates the cost basis of a transaction
-def calcTxCostBasis(received_qty, received_currency, sent_qty, sent_currency, fee_amount, tx_type):
+# Calculates the cost basis of a transaction from its fixed-point amounts, exactly rounded to COST_BASIS_DECIMALS
+# A crypto to crypto trade's cost basis is in CAD, valuing what was sent at its sent_price in CAD, which is left
+# empty without a price
+def calcTxCostBasis(received_qty, received_currency, sent_qty, sent_currency, fee_amount, tx_type, sent_price=None):
     if tx_type == BUY_TX:
         # Since the received_qty is before the fee_amount is subtracted, the fee has to be subtracted now
-        return {"cost_basis": round(sent_qty/(received_qty - fee_amount), 3),
+        return {"cost_basis": calcAmountRatio(sent_qty, sent_currency, received_qty - fee_amount, received_currency),
                 "cost_basis_units": sent_currency + "/" + received_currency}
     elif tx_type == SELL_TX:
-        return {"cost_basis": round(received_qty/sent_qty, 3),
+        return {"cost_basis": calcAmountRatio(received_qty, received_currency, sent_qty, sent_currency),
                 "cost_basis_units": received_currency + "/" + sent_currency}
+    elif tx_type == CRYPTO_TX and sent_price is not None:
+        # Value what was sent from the exact decimal value of its price
+        price_numerator, price_denominator = Decimal(repr(sent_price)).as_integer_ratio()
+        return {"cost_basis": calcAmountRatio(sent_qty * price_numerator, sent_currency,
+                    (received_qty - fee_amount) * price_denominator, received_currency),
+                "cost_basis_units": ACB_CURRENCY + "/" + received_currency}
+    return {"cost_basis": None, "cost_basis_units": None}
 
 
-# Determines the type of transaction based on trading between CAD and Crypto
-# TODO: Future update for once I trade between cryptos
+# Determines the type of transaction based on trading between CAD and Crypto, or between two cryptos
 def getTradeType(received_currency, sent_currency):
     if received_currency == "CAD":
         return SELL_TX
     elif sent_currency == "CAD":
         return BUY_TX
+    return CRYPTO_TX
+
+
+# Prices of a currency from a local price file as sorted timestamps and their prices
+class PriceSeries:
+    __slots__ = ('timestamps', 'prices')
+
+    def __init__(self, timestamps, prices):
+        self.timestamps = timestamps
+        self.prices = prices
+
+    # Returns the price nearest to a timestamp, or None if the nearest one is more than max_gap away
+    def nearest(self, timestamp, max_gap):
+        i = bisect_left(self.timestamps, timestamp)
+        if i > 0 and (i == len(self.timestamps) or timestamp - self.timestamps[i - 1] <= self.timestamps[i] - timestamp):
+            i -= 1
+        if i < len(self.timestamps) and abs(self.timestamps[i] - timestamp) <= max_gap:
+            return self.prices[i]
+        return None
+
+    # Returns the series inverted, ie. the CAD-BTC prices from the BTC-CAD prices
+    def inverted(self):
+        return PriceSeries(self.timestamps, [1 / price if price else None for price in self.prices])
+
+
+# Offline CAD prices of the currencies, loaded from daily or hourly price files named after their pair
+# (ie. Prices/ETH-CAD.csv or Prices/DOGE_BTC.csv) with a timestamp and a price column
+# Each currency's prices are loaded on first use, from its CAD pair, the inverse pair or through another currency
+# with a CAD price, and looked up at the nearest timestamp by bisection behind an LRU cache
+class PriceCache:
+    def __init__(self, prices_dir, max_gap_hours=PRICE_MAX_GAP_HOURS):
+        self.max_gap = timedelta(hours=max_gap_hours)
+        self.series = {}
+        self.getPrice = lru_cache(maxsize=PRICE_CACHE_SIZE)(self.findPrice)
+
+        # Price files by their (base, quote) pair
+        self.pair_paths = {}
+        for price_path in sorted(Path(prices_dir).glob('*.csv')):
+            pair = price_path.stem.upper().replace('_', '-').split('-')
+            if len(pair) == 2:
+                self.pair_paths[tuple(pair)] = price_path
+
+    # Returns the prices of a pair from its price file, or from the file of its inverse pair
+    def loadPair(self, base, quote):
+        if (base, quote) in self.pair_paths:
+            return readPriceFile(self.pair_paths[(base, quote)])
+        if (quote, base) in self.pair_paths:
+            return readPriceFile(self.pair_paths[(quote, base)]).inverted()
+        return None
+
+    # Returns the CAD price series of a currency, or None if none of the price files can value it
+    def getSeries(self, currency):
+        if currency not in self.series:
+            series = self.loadPair(currency, ACB_CURRENCY)
+
+            # Otherwise go through another currency that has a CAD price, at the times of the currency's prices
+            if series is None:
+                for base, quote in self.pair_paths:
+                    other = quote if base == currency else base if quote == currency else None
+                    if other is None or other == ACB_CURRENCY:
+                        continue
+                    other_series = self.loadPair(other, ACB_CURRENCY)
+                    if other_series is not None:
+                        pair_series = self.loadPair(currency, other)
+                        other_prices = self.getPricesFrom(other_series, pair_series.timestamps)
+                        series = PriceSeries(pair_series.timestamps, [
+                            price * other_price if price is not None and other_price is not None else None
+                            for price, other_price in zip(pair_series.prices, other_prices)])
+                        break
+            self.series[currency] = series
+        return self.series[currency]
+
+    # Returns the CAD price of one unit of a currency at the nearest time to timestamp, or None if it's unknown
+    # Use getPrice, which caches the lookups
+    def findPrice(self, currency, timestamp):
+        if currency == ACB_CURRENCY:
+            return 1.0
+        series = self.getSeries(currency)
+        return series.nearest(timestamp, self.max_gap) if series is not None else None
+
+    # Returns the prices of a series at many timestamps, looking up each distinct timestamp once
+    def getPricesFrom(self, series, timestamps):
+        prices = {}
+        for timestamp in timestamps:
+            if timestamp not in prices:
+                prices[timestamp] = series.nearest(timestamp, self.max_gap)
+        return [prices[timestamp] for timestamp in timestamps]
+
+    # Returns the CAD prices of currencies at their timestamps, ie. for a whole chunk of a report, looking up each
+    # currency's timestamps together. Currencies given as None are skipped and left without a price
+    def getPrices(self, currencies, timestamps):
+        prices = [None] * len(currencies)
+        indices_by_currency = {}
+        for i, currency in enumerate(currencies):
+            if currency is not None:
+                indices_by_currency.setdefault(currency, []).append(i)
+
+        for currency, indices in indices_by_currency.items():
+            if currency == ACB_CURRENCY:
+                currency_prices = [1.0] * len(indices)
+            else:
+                series = self.getSeries(currency)
+                if series is None:
+                    continue
+                currency_prices = self.getPricesFrom(series, [timestamps[i] for i in indices])
+            for i, price in zip(indices, currency_prices):
+                prices[i] = price
+        return prices
+
+
+# Parses the timestamp of a price file's row into a naive UTC datetime, or returns None if it can't be parsed
+# Takes ISO dates and times with or without a timezone (ie. 2021-02-01T00:00:00Z) and epoch seconds or milliseconds
+# Daily prices are set at noon so each of the day's transactions is nearest to its own day's price
+def parsePriceTimestamp(raw_timestamp):
+    try:
+        epoch = float(raw_timestamp)
+    except ValueError:
+        epoch = None
+    if epoch is not None:
+        if abs(epoch) >= PRICE_MAX_EPOCH_SECONDS:
+            epoch /= 1000
+        try:
+            return datetime.fromtimestamp(epoch, timezone.utc).replace(tzinfo=None)
+        except (OverflowError, OSError, ValueError):
+            return None
+
+    try:
+        timestamp = datetime.fromisoformat(raw_timestamp)
+    except ValueError:
+        return None
+    if timestamp.tzinfo is not None:
+        return timestamp.astimezone(timezone.utc).replace(tzinfo=None)
+    if len(raw_timestamp) == 10:
+        return timestamp.replace(hour=12)
+    return timestamp
+
+
+# Reads a price file into a PriceSeries sorted by timestamp, skipping the rows whose timestamp or price can't be
+# parsed with a warning
+def readPriceFile(price_path):
+    with open(price_path, 'rt', encoding='utf8', newline='') as file:
+        rows = csv.reader(file)
+        header = [name.strip().lower() for name in next(rows, [])]
+        timestamp_col = next((header.index(name) for name in PRICE_TIMESTAMP_COLUMNS if name in header), 0)
+        price_col = next((header.index(name) for name in PRICE_VALUE_COLUMNS if name in header), 1)
+
+        prices = []
+        invalid_rows = 0
+        for row in rows:
+            if len(row) <= max(timestamp_col, price_col) or not row[price_col].strip():
+                continue
+            timestamp = parsePriceTimestamp(row[timestamp_col].strip())
+            try:
+                price = extractFloatFromText(row[price_col])
+            except ValueError:
+                price = None
+            if timestamp is None or price is None or not math.isfinite(price):
+                invalid_rows += 1
+                continue
+            prices.append((timestamp, price))
+
+    if invalid_rows:
+        print(f'Skipped {invalid_rows} row(s) of {Path(price_path).name} whose timestamp or price could not be parsed.')
+    prices.sort()
+    return PriceSeries([timestamp for timestamp, _ in prices], [price for _, price in prices])
+
+
+# Sets the directory of the price files used to value crypto to crypto trades, through an environment variable
+# so the worker processes use it too
+def configurePrices(prices_dir=None):
+    if prices_dir is not None and Path(prices_dir).is_dir():
+        os.environ[PRICES_ENV_VAR] = str(prices_dir)
+    else:
+        os.environ.pop(PRICES_ENV_VAR, None)
+
+
+# Returns the PriceCache of the configured price files, or None if there aren't any
+def getPriceCache():
+    prices_dir = os.environ.get(PRICES_ENV_VAR)
+    return loadPriceCache(prices_dir) if prices_dir else None
+
+
+# Loads a directory's price files once per process
+@lru_cache(maxsize=None)
+def loadPriceCache(prices_dir):
+    return PriceCache(prices_dir)
+
+
+# Returns the CAD price of a currency at a timestamp from the configured price files, or None if it's unknown
+def getCADPrice(currency, timestamp):
+    prices = getPriceCache()
+    return prices.getPrice(currency, timestamp) if prices is not None else None
+
+
+# Reports the crypto to crypto trades that were left without a cost basis for lack of a price
+def reportUnvaluedTrades(unvalued_currencies):
+    if unvalued_currencies:
+        print(f'Left {sum(unvalued_currencies.values())} crypto to crypto trade(s) without a cost basis, missing the '
+            f'CAD price of: {", ".join(sorted(unvalued_currencies))}. Add their price files to the prices directory.')
 
 
 # Extracts the number from a spreadsheet cell that is stored as text (ie. removes commas for pure decimal)
+# Cells an .xlsx report stores as numbers are used as is
 def extractFloatFromText(text):
+    if text.__class__ is not str:
+        return float(text)
     return float(text.replace(',',''))
 
 
+# Parses an amount of a currency from a report (ie. '1,234.5678') straight into a fixed-point integer of the
+# currency's smallest units, rounding any digits past its precision (or past decimals if given) half to even
+# Numeric cells are parsed from their shortest repr, and amounts in scientific notation (ie. 1e-05) through Decimal
+def parseAmount(text, currency, decimals=None):
+    if decimals is None:
+        decimals = CURRENCY_DECIMALS.get(currency, DEFAULT_CURRENCY_DECIMALS)
+    if text.__class__ is not str:
+        text = repr(text)
+    text = text.strip()
+    if ',' in text:
+        text = text.replace(',', '')
+
+    point = text.find('.')
+    try:
+        if point < 0:
+            return int(text) * POWERS_OF_TEN[decimals]
+        units = int(text.replace('.', '', 1))
+    except ValueError:
+        return int((Decimal(text) * POWERS_OF_TEN[decimals]).to_integral_value(ROUND_HALF_EVEN))
+
+    fraction_digits = len(text) - point - 1
+    if fraction_digits <= decimals:
+        return units * POWERS_OF_TEN[decimals - fraction_digits]
+    return divideRounded(units, POWERS_OF_TEN[fraction_digits - decimals])
+
+
+# Returns the float nearest to a fixed-point amount of a currency, as written to the results and Master Ledger
+def amountToFloat(units, currency):
+    return units / CURRENCY_SCALES.get(currency, DEFAULT_CURRENCY_SCALE)
+
+
+# Divides an integer by a positive integer, rounding half to even
+def divideRounded(numerator, denominator):
+    quotient, remainder = divmod(numerator, denominator)
+    if 2 * remainder > denominator or (2 * remainder == denominator and quotient & 1):
+        quotient += 1
+    return quotient
+
+
+# Returns a rate (ie. a fee of .002) as the (numerator, denominator) of its exact decimal value
+@lru_cache(maxsize=None)
+def getRateRatio(rate):
+    return Decimal(repr(rate)).as_integer_ratio()
+
+
+# Returns the ratio of two fixed-point amounts (ie. a price in CAD/BTC), exactly rounded half to even to
+# COST_BASIS_DECIMALS
+def calcAmountRatio(numerator, numerator_currency, denominator, denominator_currency):
+    numerator_decimals = CURRENCY_DECIMALS.get(numerator_currency, DEFAULT_CURRENCY_DECIMALS)
+    denominator_decimals = CURRENCY_DECIMALS.get(denominator_currency, DEFAULT_CURRENCY_DECIMALS)
+    if denominator < 0:
+        numerator, denominator = -numerator, -denominator
+    ratio = divideRounded(numerator * POWERS_OF_TEN[denominator_decimals + COST_BASIS_DECIMALS],
+        denominator * POWERS_OF_TEN[numerator_decimals])
+    return ratio / POWERS_OF_TEN[COST_BASIS_DECIMALS]
+
+
 # Generates a new timestamped, unique filename
 def generateFilename(name, file_ext):
     timestamp_obj = datetime.now()
@@ -209,163 +810,1179 @@ def generateFilename(name, file_ext):
     return filename
 
 
-# Saves a newly formatted results file
-def saveNewResultFile(report_workbook, report_path, new_file_path, filename):    
-    # Save the workbook at the provided path
-    report_workbook.save(os.path.abspath(report_path))    
+# Opens a new results file, returning a function that writes a row to it and a function that closes it
+def openResultWriter(new_file_path):
+    # Only build a workbook when an .xlsx results file was asked for, streaming its rows as they are written
+    if new_file_path.suffix == '.xlsx':
+        import openpyxl
+        result_workbook = openpyxl.Workbook(write_only=True)
+        result_sheet = result_workbook.create_sheet(title='Formatted')
+        return result_sheet.append, lambda: result_workbook.save(os.path.abspath(new_file_path))
+
+    result_file = open(new_file_path, 'w', newline='')
+    return csv.writer(result_file).writerow, result_file.close
+
 
-    # Move the new file to the new filepath and rename
-    shutil.move(os.path.abspath(report_path), os.path.abspath(new_file_path))
-    print(f'Saved and moved new file as {filename}.')
+# Moves an unmodified report next to its formatted results file
+def moveRawReport(report_path, new_file_path):
+    raw_file_path = new_file_path.with_name(new_file_path.stem + '_Raw' + report_path.suffix)
+    shutil.move(os.path.abspath(report_path), os.path.abspath(raw_file_path))
+
+
+# A transaction of the Master Ledger, using slots instead of a dict to keep large datasets compact
+# Empty fields are stored as None and the timestamp keeps the parsed datetime of the date for sorting
+class Transaction:
+    __slots__ = LEDGER_FIELDS + ('timestamp',)
+
+    def __init__(self, date, received_qty, received_currency, sent_qty, sent_currency, fee_amount,
+                fee_currency, cost_basis, cost_basis_units, exchange, tx_id, timestamp=None):
+        self.date = date
+        self.received_qty = received_qty
+        self.received_currency = received_currency
+        self.sent_qty = sent_qty
+        self.sent_currency = sent_currency
+        self.fee_amount = fee_amount
+        self.fee_currency = fee_currency
+        self.cost_basis = cost_basis
+        self.cost_basis_units = cost_basis_units
+        self.exchange = exchange
+        self.tx_id = tx_id
+        self.timestamp = timestamp
+
+    # Returns the transaction's fields as a tuple ordered as LEDGER_FIELDS
+    def toRow(self):
+        return (self.date, self.received_qty, self.received_currency, self.sent_qty, self.sent_currency,
+            self.fee_amount, self.fee_currency, self.cost_basis, self.cost_basis_units, self.exchange,
+            self.tx_id)
+
+
+# Interns repeated text such as currency codes so every transaction shares the same string
+def internText(text):
+    if text.__class__ is str:
+        return sys.intern(text)
+    return text
 
 
 # Add a transaction to the Master Ledger data list
 def addMasterLedgerData(data, date, exchange, received_qty, received_currency,
                     sent_qty, sent_currency, fee_amount, fee_currency, cost_basis,
-                    cost_basis_units, tx_id):
-    data.append({
-        "date": date,
-        "exchange": exchange,
-        "received_qty": received_qty,
-        "received_currency": received_currency,
-        "sent_currency": sent_currency,
-        "sent_qty": sent_qty,
-        "fee_amount": fee_amount,
-        "fee_currency": fee_currency,
-        "cost_basis": cost_basis,
-        "cost_basis_units": cost_basis_units,
-        "tx_id": tx_id
-    })
-
-
-# Update the Master Ledger with a new dataset
-def updateMasterLedger(data, ledger_path):
+                    cost_basis_units, tx_id, timestamp=None):
+    data.append(Transaction(date, received_qty, internText(received_currency), sent_qty,
+        internText(sent_currency), fee_amount, internText(fee_currency), cost_basis,
+        internText(cost_basis_units), exchange, tx_id, timestamp))
+
+
+# Returns the timestamp of a transaction, parsing its Cointracker formatted date if it wasn't kept
+def getTxTimestamp(tx):
+    return tx.timestamp or datetime.strptime(tx.date, COINTRACKER_DATE_FORMAT)
+
+
+# Index of a ledger's transactions sorted by timestamp, overall and per exchange, answering the transactions
+# within [start, end) in O(log n + k) by bisecting the sorted timestamps
+class LedgerDateIndex:
+    def __init__(self, data=()):
+        # Sorted timestamps and their transactions, by exchange or None for all exchanges
+        self.timestamps = {}
+        self.transactions = {}
+        for tx in sorted(data, key=getTxTimestamp):
+            self.add(tx)
+
+    # Inserts a transaction after any others with the same timestamp
+    def add(self, tx):
+        timestamp = getTxTimestamp(tx)
+        for exchange in (None, tx.exchange):
+            timestamps = self.timestamps.setdefault(exchange, [])
+            i = bisect_right(timestamps, timestamp)
+            timestamps.insert(i, timestamp)
+            self.transactions.setdefault(exchange, []).insert(i, tx)
+
+    # Returns the transactions from start up to but excluding end, of a single exchange if one is given
+    def query(self, start=None, end=None, exchange=None):
+        timestamps = self.timestamps.get(exchange, [])
+        lo = bisect_left(timestamps, start) if start is not None else 0
+        hi = bisect_left(timestamps, end) if end is not None else len(timestamps)
+        return self.transactions.get(exchange, [])[lo:hi]
+
+    # Returns the number of transactions before end
+    def count(self, end):
+        return bisect_left(self.timestamps.get(None, []), end)
+
+    def __len__(self):
+        return len(self.timestamps.get(None, []))
+
+
+# Returns the path of the tx_id index sidecar file stored next to the Master Ledger
+def getTxIDIndexPath(ledger_path):
+    return ledger_path.with_name(ledger_path.stem + TX_ID_INDEX_SUFFIX)
+
+
+# Returns a set of all the transaction ids (tx_id) present in the Master Ledger worksheet
+def buildTxIDIndex(ledger_sheet):
+    tx_id_index = set()
+
+    # Start on row 2 to bypass header row and only read the Tx_Id column
+    for (tx_id,) in ledger_sheet.iter_rows(min_row=2, min_col=TX_ID_COL, max_col=TX_ID_COL, values_only=True):
+        if tx_id:
+            tx_id_index.add(tx_id)
+
+    return tx_id_index
+
+
+# Loads the tx_id index from its sidecar file if it is still current, otherwise rebuilds it from the ledger
+def loadTxIDIndex(ledger_sheet, ledger_path, index_path=None):
+    if index_path is not None and index_path.is_file():
+        with open(index_path, 'rt', encoding='utf8') as file:
+            index_data = json.load(file)
+
+        # Only trust the sidecar file if the Master Ledger hasn't changed since it was saved
+        ledger_stat = os.stat(ledger_path)
+        if (index_data.get("ledger_mtime_ns") == ledger_stat.st_mtime_ns
+                and index_data.get("ledger_size") == ledger_stat.st_size
+                and index_data.get("row_count") == ledger_sheet.max_row):
+            return set(index_data["tx_ids"])
+
+    return buildTxIDIndex(ledger_sheet)
+
+
+# Saves the tx_id index to its sidecar file along with the state of the Master Ledger it matches
+def saveTxIDIndex(tx_id_index, ledger_path, index_path, row_count):
+    ledger_stat = os.stat(ledger_path)
+    index_data = {
+        "ledger_mtime_ns": ledger_stat.st_mtime_ns,
+        "ledger_size": ledger_stat.st_size,
+        "row_count": row_count,
+        "tx_ids": sorted(tx_id_index)
+    }
+    temp_path = index_path.with_name(index_path.name + '.tmp')
+    with open(temp_path, 'wt', encoding='utf8') as file:
+        json.dump(index_data, file)
+    os.replace(temp_path, index_path)
+
+
+# Saves a workbook to a temporary file next to it, then renames it over the file so an interrupted save never
+# leaves the file half written
+def saveWorkbookAtomically(workbook, file_path):
+    temp_path = file_path.with_name(file_path.name + '.tmp')
+    workbook.save(os.path.abspath(temp_path))
+    os.replace(temp_path, file_path)
+
+
+# Update the Master Ledger with a new dataset, then its balance index with the new transactions
+# Returns the updated BalanceIndex
+def updateMasterLedger(data, ledger_path, use_tx_id_index_file=False):
+    # The balance index is only current if it was saved with the ledger as it is before this update
+    balance_index = loadBalanceIndex(ledger_path)
+
+    # Add the transactions in date order, keeping the report order of transactions with the same date
+    data.sort(key=getTxTimestamp)
+    if isSQLiteLedger(ledger_path):
+        updateSQLiteLedger(data, ledger_path)
+    else:
+        updateXlsxLedger(data, ledger_path, use_tx_id_index_file)
 
-    # Open the existing Master Ledger file and worksheet
-    ledger_workbook = openpyxl.load_workbook(ledger_path)
-    ledger_sheet = ledger_workbook.active
+    return updateBalanceIndex(balance_index, data, ledger_path)
 
-    # Find the next row available to start adding transactions after
-    last_tx_row = ledger_sheet.max_row
-    num_tx = len(data)
-    row_start = last_tx_row + 1
-    row_end = row_start + num_tx
-    print(f'Starting update of Master Ledger on row {row_start} with {num_tx} transactions.')
 
-    # TODO: Sort the transactions by date
-    # TODO: Lookup previous transactions in the master ledger first by date, then loop through to find exact matches
-    tx_check = 0
-    dupe_tx = 0
+# Opens an .xlsx Master Ledger, returning its workbook, worksheet, tx_id index and the path of the index file if used
+def loadXlsxLedger(ledger_path, use_tx_id_index_file=False):
+    import openpyxl
 
-    # Check the existing Master Ledger for the current transaction ids (tx_id)
-    tx_id_list = getAllTxIDs(ledger_path)
-    tx_id_exists = False
+    with measureStage('ledger_load', ledger_path) as stats:
+        ledger_workbook = openpyxl.load_workbook(ledger_path)
+        ledger_sheet = ledger_workbook.active
 
-    for i in range(row_start, row_end):
-        # Adjust xl_offset to continue writing to the last_row of the Master Ledger avoiding spaces from dupe_tx
-        xl_offset = i - dupe_tx
+        # Index the existing Master Ledger's transaction ids (tx_id) for constant time lookups
+        index_path = getTxIDIndexPath(ledger_path) if use_tx_id_index_file else None
+        tx_id_index = loadTxIDIndex(ledger_sheet, ledger_path, index_path)
+        stats['rows'] = ledger_sheet.max_row
 
-        # Adjust data_offset to start at index 0 of the data array
-        data_offset = xl_offset - row_start
-        
-        # Check if the transaction id already exists in the data collected
-        tx_id_exists = tx_id_list.count(data[data_offset]["tx_id"]) > 0
+    return ledger_workbook, ledger_sheet, tx_id_index, index_path
 
-        if tx_id_exists:
-            # tx_id exists so skip re-writing it to avoid duplication
-            dupe_tx += 1
 
-            # Remove the duplicate data from the ledger data
-            # Note: Same data[index] needs to be checked again after dupe_tx popped from data
-            data.pop(data_offset)
-            continue
+# Writes the transactions that aren't in the tx_id index yet to the ledger's worksheet starting on row_start,
+# returning the new transactions
+def appendXlsxLedgerRows(ledger_sheet, tx_id_index, data, row_start, ledger_path=None):
+    new_data = []
+
+    with measureStage('ledger_dedupe', ledger_path) as stats:
+        for tx in data:
+            tx_id = tx.tx_id
+
+            if tx_id in tx_id_index:
+                # tx_id exists so skip re-writing it to avoid duplication
+                continue
+
+            # Index the new tx_id so duplicates within the same dataset are also skipped
+            if tx_id:
+                tx_id_index.add(tx_id)
 
-        elif not tx_id_exists:
             # Write the data to the ledger's worksheet
-            ledger_data = [data[data_offset]["date"],   data[data_offset]["received_qty"],
-                data[data_offset]["received_currency"], data[data_offset]["sent_qty"],
-                data[data_offset]["sent_currency"],     data[data_offset]["fee_amount"],
-                data[data_offset]["fee_currency"],      data[data_offset]["cost_basis"],
-                data[data_offset]["cost_basis_units"],  data[data_offset]["exchange"],
-                data[data_offset]["tx_id"]]
+            ledger_data = tx.toRow()
             # Excludes writing to the 'Tag' column since there aren't any I've used yet
-            writeToExcelSheet(ledger_sheet, A_TO_G_NO_I_LIST, xl_offset, ledger_data)
-            tx_check += 1            
-    
+            writeToExcelSheet(ledger_sheet, A_TO_G_NO_I_LIST, row_start + len(new_data), ledger_data)
+            new_data.append(tx)
+        stats['rows'] = len(data)
+
+    return new_data
+
+
+# Saves an .xlsx Master Ledger, along with its tx_id index file if used
+def saveXlsxLedger(ledger_workbook, ledger_sheet, ledger_path, tx_id_index, index_path, num_new_tx):
+    with measureStage('ledger_save', ledger_path) as stats:
+        saveWorkbookAtomically(ledger_workbook, ledger_path)
+        if index_path is not None:
+            saveTxIDIndex(tx_id_index, ledger_path, index_path, ledger_sheet.max_row)
+        stats['rows'] = num_new_tx
+
+
+# Update an .xlsx Master Ledger with a new dataset
+def updateXlsxLedger(data, ledger_path, use_tx_id_index_file=False):
+
+    # Open the existing Master Ledger file and worksheet
+    ledger_workbook, ledger_sheet, tx_id_index, index_path = loadXlsxLedger(ledger_path, use_tx_id_index_file)
+
+    # Find the next row available to start adding transactions after
+    last_tx_row = ledger_sheet.max_row
+    num_tx = len(data)
+    row_start = last_tx_row + 1
+    print(f'Starting update of Master Ledger on row {row_start} with {num_tx} transactions.')
+
+    new_data = appendXlsxLedgerRows(ledger_sheet, tx_id_index, data, row_start, ledger_path)
+    tx_check = len(new_data)
+    dupe_tx = num_tx - tx_check
+
+    # Remove the duplicate data from the ledger data in a single pass
+    data[:] = new_data
+
     # Save the updated Master Ledger
-    ledger_workbook.save(os.path.abspath(ledger_path))
+    saveXlsxLedger(ledger_workbook, ledger_sheet, ledger_path, tx_id_index, index_path, tx_check)
+
     if tx_check + dupe_tx - num_tx == 0:
         print(f'Successfully updated the Master Ledger with {tx_check} new transactions out of {num_tx} total.')
     else:
         print(f'Error updating the Master Ledger. Total of {tx_check+dupe_tx}/{num_tx} transactions completed.')
 
 
+# Returns whether the Master Ledger is stored in a SQLite database
+def isSQLiteLedger(ledger_path):
+    return ledger_path.suffix in SQLITE_LEDGER_SUFFIXES
+
+
+# Create a SQLite Master Ledger database with its indexes
+def createSQLiteLedger(file_path):
+    new_ledger = not file_path.is_file()
+    connection = sqlite3.connect(file_path)
+    try:
+        with connection:
+            connection.execute('''CREATE TABLE IF NOT EXISTS transactions (
+                date TEXT NOT NULL, received_qty REAL, received_currency TEXT, sent_qty REAL,
+                sent_currency TEXT, fee_amount REAL, fee_currency TEXT, cost_basis REAL,
+                cost_basis_units TEXT, exchange TEXT NOT NULL, tx_id TEXT)''')
+
+            # Transactions without a tx_id are stored as NULL, which the unique index never treats as equal
+            connection.execute('''CREATE UNIQUE INDEX IF NOT EXISTS transactions_exchange_tx_id
+                ON transactions (exchange, tx_id)''')
+            connection.execute('CREATE INDEX IF NOT EXISTS transactions_date ON transactions (date)')
+            connection.execute('''CREATE INDEX IF NOT EXISTS transactions_exchange_date
+                ON transactions (exchange, date)''')
+    finally:
+        connection.close()
+
+    if new_ledger:
+        print(f'Successfully created new Master Ledger database at {file_path}')
+
+
+# Converts a transaction into a row of the SQLite Master Ledger
+def toSQLiteLedgerRow(tx):
+    row = list(tx.toRow())
+    row[0] = getTxTimestamp(tx).strftime(SQLITE_DATE_FORMAT)
+    if row[-1] is not None:
+        row[-1] = str(row[-1])
+    return row
+
+
+# Update a SQLite Master Ledger with a new dataset, letting its unique index skip duplicate transactions
+def updateSQLiteLedger(data, ledger_path):
+    num_tx = len(data)
+    connection = sqlite3.connect(ledger_path)
+    try:
+        with measureStage('ledger_dedupe', ledger_path) as stats:
+            last_rowid = connection.execute('SELECT COALESCE(MAX(rowid), 0) FROM transactions').fetchone()[0]
+            print(f'Starting update of Master Ledger after row {last_rowid} with {num_tx} transactions.')
+
+            # Bulk insert the data, ignoring any (exchange, tx_id) that already exists
+            connection.executemany(f'''INSERT OR IGNORE INTO transactions ({', '.join(LEDGER_FIELDS)})
+                VALUES ({', '.join('?' * len(LEDGER_FIELDS))})''', (toSQLiteLedgerRow(tx) for tx in data))
+
+            # Find which of the transactions with a tx_id were actually inserted
+            inserted_keys = set(connection.execute('''SELECT exchange, tx_id FROM transactions
+                WHERE rowid > ? AND tx_id IS NOT NULL''', (last_rowid,)))
+            stats['rows'] = num_tx
+
+        with measureStage('ledger_save', ledger_path):
+            connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    finally:
+        connection.close()
+
+    # Keep only the new transactions in the dataset, the first occurrence of a tx_id being the one inserted
+    new_data = []
+    for tx in data:
+        if tx.tx_id:
+            key = (tx.exchange, str(tx.tx_id))
+            if key not in inserted_keys:
+                continue
+            inserted_keys.discard(key)
+        new_data.append(tx)
+
+    tx_check = len(new_data)
+    dupe_tx = num_tx - tx_check
+    data[:] = new_data
+    print(f'Successfully updated the Master Ledger with {tx_check} new transactions out of {num_tx} total '
+        f'({dupe_tx} duplicates skipped).')
+
+
+# Exports a SQLite Master Ledger to the .xlsx Master Ledger layout
+def exportLedgerToXlsx(ledger_path, xlsx_path):
+    import openpyxl
+    export_workbook = openpyxl.Workbook(write_only=True)
+    export_sheet = export_workbook.create_sheet(title="Transactions")
+    export_sheet.append(COINTRACKER_HEADER + LEDGER_EXTRA_HEADER)
+
+    num_tx = 0
+    connection = sqlite3.connect(ledger_path)
+    try:
+        rows = connection.execute(f'SELECT {", ".join(LEDGER_FIELDS)} FROM transactions ORDER BY rowid')
+        for row in rows:
+            date = datetime.strptime(row[0], SQLITE_DATE_FORMAT).strftime(COINTRACKER_DATE_FORMAT)
+
+            # Leaves the 'Tag' column empty
+            export_sheet.append([date, *row[1:7], None, *row[7:]])
+            num_tx += 1
+    finally:
+        connection.close()
+
+    export_workbook.save(os.path.abspath(xlsx_path))
+    print(f'Successfully exported {num_tx} transactions from the Master Ledger to {xlsx_path}')
+
+
+# Reads all the transactions of an .xlsx Master Ledger
+def readXlsxLedgerTransactions(ledger_path):
+    data = []
+    ledger_rows = readXlsxRows(ledger_path)
+    next(ledger_rows, None)
+    for row in ledger_rows:
+        # Pad rows missing their last empty columns, and skip the 'Tag' column
+        row = tuple(row) + (None,) * (TX_ID_COL - len(row))
+        date = row[0]
+        timestamp = None
+        if isinstance(date, datetime):
+            timestamp = date
+            date = date.strftime(COINTRACKER_DATE_FORMAT)
+        data.append(Transaction(date, *row[1:7], *row[8:TX_ID_COL], timestamp=timestamp))
+    return data
+
+
+# Returns the transactions of a Master Ledger from start up to but excluding end, in date order and of a single
+# exchange if one is given. A SQLite ledger answers it from its date indexes, while an .xlsx ledger, which can only
+# be streamed from its start, is read whole and sorted into a LedgerDateIndex on every call
+def queryLedger(ledger_path, start=None, end=None, exchange=None):
+    if not isSQLiteLedger(ledger_path):
+        return LedgerDateIndex(readXlsxLedgerTransactions(ledger_path)).query(start, end, exchange)
+
+    conditions = []
+    params = []
+    if exchange is not None:
+        conditions.append('exchange = ?')
+        params.append(exchange)
+    if start is not None:
+        conditions.append('date >= ?')
+        params.append(start.strftime(SQLITE_DATE_FORMAT))
+    if end is not None:
+        conditions.append('date < ?')
+        params.append(end.strftime(SQLITE_DATE_FORMAT))
+    where = ' WHERE ' + ' AND '.join(conditions) if conditions else ''
+
+    data = []
+    connection = sqlite3.connect(ledger_path)
+    try:
+        rows = connection.execute(f'SELECT {", ".join(LEDGER_FIELDS)} FROM transactions{where} ORDER BY date, rowid',
+            params)
+        for row in rows:
+            timestamp = datetime.strptime(row[0], SQLITE_DATE_FORMAT)
+            data.append(Transaction(timestamp.strftime(COINTRACKER_DATE_FORMAT), *row[1:], timestamp=timestamp))
+    finally:
+        connection.close()
+    return data
+
+
+# Creates a Cointracker import file of the Master Ledger's transactions from start up to but excluding end,
+# ie. a whole tax year, of a single exchange if one is given
+def exportCointrackerWindow(ledger_path, new_file_dir, start=None, end=None, exchange=None):
+    if not isSQLiteLedger(ledger_path):
+        print(f'Reading the whole {ledger_path.name} for the export, only a .db Master Ledger is indexed by date.')
+    data = queryLedger(ledger_path, start, end, exchange)
+    print(f'Found {len(data)} transactions in the Master Ledger from {start or "the start"} to {end or "the end"}.')
+    getCointrackerSummary(data, new_file_dir)
+    return data
+
+
+# Returns the number of transactions of a SQLite Master Ledger before end
+def countSQLiteLedgerTransactions(ledger_path, end):
+    connection = sqlite3.connect(ledger_path)
+    try:
+        return connection.execute('SELECT COUNT(*) FROM transactions WHERE date < ?',
+            (end.strftime(SQLITE_DATE_FORMAT),)).fetchone()[0]
+    finally:
+        connection.close()
+
+
+# Running position of a currency: its quantity, adjusted cost base (ACB), realized gains and optionally its
+# FIFO lots as a deque of [quantity, cost] from oldest to newest
+class Position:
+    __slots__ = ('quantity', 'acb', 'realized_gain', 'fifo_realized_gain', 'lots')
+
+    def __init__(self, quantity=0.0, acb=0.0, realized_gain=0.0, fifo_realized_gain=0.0, lots=None):
+        self.quantity = quantity
+        self.acb = acb
+        self.realized_gain = realized_gain
+        self.fifo_realized_gain = fifo_realized_gain
+        self.lots = lots
+
+    # Adds a quantity bought or received for a total cost
+    def acquire(self, qty, cost):
+        self.quantity += qty
+        self.acb += cost
+        if self.lots is not None and qty > 0:
+            self.lots.append([qty, cost])
+
+    # Removes a quantity, returning its share of the ACB and its cost from the oldest FIFO lots
+    def dispose(self, qty):
+        acb_cost = self.acb * min(qty / self.quantity, 1) if self.quantity > 0 else 0.0
+        self.quantity -= qty
+        self.acb -= acb_cost
+
+        fifo_cost = acb_cost
+        if self.lots is not None:
+            fifo_cost = 0.0
+            remaining = qty
+            while remaining > LOT_EPSILON and self.lots:
+                lot = self.lots[0]
+                used = min(lot[0], remaining)
+                used_cost = lot[1] * used / lot[0]
+                fifo_cost += used_cost
+                lot[0] -= used
+                lot[1] -= used_cost
+                remaining -= used
+                if lot[0] <= LOT_EPSILON:
+                    self.lots.popleft()
+        return acb_cost, fifo_cost
+
+    def toList(self):
+        return [self.quantity, self.acb, self.realized_gain, self.fifo_realized_gain,
+            [list(lot) for lot in self.lots] if self.lots is not None else None]
+
+    @classmethod
+    def fromList(cls, values):
+        quantity, acb, realized_gain, fifo_realized_gain, lots = values
+        return cls(quantity, acb, realized_gain, fifo_realized_gain, deque(lots) if lots is not None else None)
+
+
+# Running positions of every currency, updated one ledger transaction at a time in date order
+# Each transaction adds its received quantity and removes its sent quantity and fee. Crypto bought with CAD adds
+# what was paid (and any CAD fee) to its ACB, and crypto sold for CAD realizes a gain from the proceeds (less any
+# CAD fee) and its share of the ACB. A crypto to crypto trade valued in CAD (a CAD/... cost basis) is a disposition
+# at the CAD value of what was received, which is also its ACB. Without a CAD value, ie. transfers and trades
+# without a price, the ACB of what was sent is carried over to what was received without realizing a gain
+class PositionEngine:
+    def __init__(self, track_lots=False):
+        self.positions = {}
+        self.track_lots = track_lots
+        self.count = 0
+
+    def getPosition(self, currency):
+        position = self.positions.get(currency)
+        if position is None:
+            position = Position(lots=deque() if self.track_lots and currency != ACB_CURRENCY else None)
+            self.positions[currency] = position
+        return position
+
+    def apply(self, tx):
+        received_qty = tx.received_qty or 0.0
+        sent_qty = tx.sent_qty or 0.0
+        fee_amount = tx.fee_amount or 0.0
+        received_currency = tx.received_currency if received_qty else None
+        sent_currency = tx.sent_currency if sent_qty else None
+        fee_currency = tx.fee_currency if fee_amount else None
+
+        # The CAD paid for what was received or received for what was sent, net of any CAD fee
+        cad_fee = fee_amount if fee_currency == ACB_CURRENCY else 0.0
+        if sent_currency == ACB_CURRENCY:
+            cad_value = sent_qty + cad_fee
+        elif received_currency == ACB_CURRENCY:
+            cad_value = received_qty - cad_fee
+        elif (received_currency is not None and tx.cost_basis is not None
+                and (tx.cost_basis_units or '').startswith(ACB_CURRENCY + '/')):
+            # The cost basis of a crypto to crypto trade is the CAD value of each unit received net of the fee
+            net_received_qty = received_qty - fee_amount if fee_currency == received_currency else received_qty
+            cad_value = tx.cost_basis * net_received_qty
+        else:
+            cad_value = None
+
+        # A fee paid in the sent or received currency is part of that side of the transaction
+        if fee_currency == sent_currency:
+            sent_qty += fee_amount
+        elif fee_currency == received_currency:
+            received_qty -= fee_amount
+        elif fee_currency is not None:
+            self.getPosition(fee_currency).dispose(fee_amount)
+
+        carried_cost = 0.0
+        if sent_currency is not None:
+            position = self.getPosition(sent_currency)
+            acb_cost, fifo_cost = position.dispose(sent_qty)
+            carried_cost = acb_cost
+            if cad_value is not None and sent_currency != ACB_CURRENCY:
+                position.realized_gain += cad_value - acb_cost
+                position.fifo_realized_gain += cad_value - fifo_cost
+
+        if received_currency is not None:
+            cost = cad_value if cad_value is not None else carried_cost
+            self.getPosition(received_currency).acquire(received_qty, cost if received_currency != ACB_CURRENCY else 0.0)
+
+        self.count += 1
+
+    # Returns a checkpoint of the positions after every transaction before until
+    def toCheckpoint(self, until):
+        return {
+            "until": until.strftime(SQLITE_DATE_FORMAT),
+            "count": self.count,
+            "positions": {currency: position.toList() for currency, position in self.positions.items()}
+        }
+
+    @classmethod
+    def fromCheckpoint(cls, checkpoint, track_lots=False):
+        engine = cls(track_lots)
+        engine.count = checkpoint["count"]
+        engine.positions = {currency: Position.fromList(values) for currency, values in checkpoint["positions"].items()}
+        return engine
+
+
+# Returns the path of the position checkpoints stored next to the Master Ledger
+def getPositionsPath(ledger_path):
+    return ledger_path.with_name(ledger_path.stem + POSITIONS_SUFFIX)
+
+
+# Loads the position checkpoints, or starts with none if they don't exist, were computed by another version of the
+# positions or were kept with(out) FIFO lots
+def loadPositionCheckpoints(positions_path, track_lots=False):
+    if positions_path.is_file():
+        with open(positions_path, 'rt', encoding='utf8') as file:
+            saved_positions = json.load(file)
+        if saved_positions.get("version") == POSITIONS_VERSION and saved_positions["track_lots"] == track_lots:
+            return saved_positions["checkpoints"]
+    return []
+
+
+# Saves the position checkpoints, replacing the file atomically
+def savePositionCheckpoints(checkpoints, positions_path, track_lots=False):
+    temp_path = positions_path.with_name(positions_path.name + '.tmp')
+    with open(temp_path, 'wt', encoding='utf8') as file:
+        json.dump({"version": POSITIONS_VERSION, "track_lots": track_lots, "checkpoints": checkpoints}, file)
+    os.replace(temp_path, positions_path)
+
+
+# Brings the positions up to date with the Master Ledger, replaying only the transactions after the latest
+# checkpoint that still has the same number of earlier transactions in the ledger, and saving a new checkpoint
+# every checkpoint_tx transactions. Returns the PositionEngine with the current positions
+def updatePositions(ledger_path, track_lots=False, checkpoint_tx=POSITION_CHECKPOINT_TX):
+    positions_path = getPositionsPath(ledger_path)
+    checkpoints = loadPositionCheckpoints(positions_path, track_lots)
+
+    # A SQLite ledger is queried through its date index, while an .xlsx ledger has to be read once
+    if isSQLiteLedger(ledger_path):
+        date_index = None
+        countTransactions = lambda end: countSQLiteLedgerTransactions(ledger_path, end)
+    else:
+        date_index = LedgerDateIndex(readXlsxLedgerTransactions(ledger_path))
+        countTransactions = date_index.count
+
+    # Transactions added or removed before a checkpoint make it and any later checkpoint stale
+    while checkpoints:
+        until = datetime.strptime(checkpoints[-1]["until"], SQLITE_DATE_FORMAT)
+        if countTransactions(until) == checkpoints[-1]["count"]:
+            break
+        checkpoints.pop()
+
+    if checkpoints:
+        engine = PositionEngine.fromCheckpoint(checkpoints[-1], track_lots)
+        start = datetime.strptime(checkpoints[-1]["until"], SQLITE_DATE_FORMAT)
+    else:
+        engine = PositionEngine(track_lots)
+        start = None
+    replay_start = engine.count
+
+    data = date_index.query(start) if date_index is not None else queryLedger(ledger_path, start)
+    last_checkpoint_count = engine.count
+    previous_timestamp = None
+    for tx in data:
+        # Checkpoints are only taken between different timestamps, so they cover all transactions before them
+        timestamp = getTxTimestamp(tx)
+        if engine.count - last_checkpoint_count >= checkpoint_tx and timestamp != previous_timestamp:
+            checkpoints.append(engine.toCheckpoint(timestamp))
+            last_checkpoint_count = engine.count
+        engine.apply(tx)
+        previous_timestamp = timestamp
+
+    savePositionCheckpoints(checkpoints[-POSITION_MAX_CHECKPOINTS:], positions_path, track_lots)
+    print(f'Updated the positions with {engine.count - replay_start} transactions, '
+        f'replaying from transaction {replay_start + 1} of {engine.count}.')
+    return engine
+
+
+# Creates a summary file of the current positions with their ACB and realized gains
+def getPositionsSummary(engine, new_file_dir):
+    filename = generateFilename("Positions", '.csv')
+    new_file_path = Path(new_file_dir) / filename
+
+    with open(new_file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Currency", "Quantity", "ACB (CAD)", "ACB per Unit", "Realized Gain (CAD)",
+            "FIFO Realized Gain (CAD)", "Open Lots"])
+        for currency, position in sorted(engine.positions.items()):
+            if currency == ACB_CURRENCY:
+                writer.writerow([currency, round(position.quantity, 8)])
+                continue
+            acb_per_unit = position.acb / position.quantity if position.quantity > LOT_EPSILON else None
+            writer.writerow([
+                currency,
+                round(position.quantity, 8),
+                round(position.acb, 2),
+                round(acb_per_unit, 8) if acb_per_unit is not None else None,
+                round(position.realized_gain, 2),
+                round(position.fifo_realized_gain, 2) if position.lots is not None else None,
+                len(position.lots) if position.lots is not None else None
+            ])
+    print(f'Successfully created new Positions file with {len(engine.positions)} currencies at {filename}.')
+
+
+# Rounds a balance kept to BALANCE_DECIMALS to the fixed-point units of its currency
+def roundBalance(units, currency):
+    return divideRounded(units, POWERS_OF_TEN[BALANCE_DECIMALS - CURRENCY_DECIMALS.get(currency,
+        DEFAULT_CURRENCY_DECIMALS)])
+
+
+# Running balance of each currency held on each exchange, net of fees, updated one ledger transaction at a time
+# A withdrawal is recorded as a transfer sending and receiving the same quantity of a currency, which already
+# includes its fee, so only its sent quantity leaves the exchange. Any other transaction adds its received quantity
+# and removes its sent quantity and fee. The (date, tx_id) of the earliest transaction that took each balance below
+# zero is kept in negatives
+class BalanceIndex:
+    def __init__(self, balances=None, count=0, negatives=None):
+        self.balances = balances if balances is not None else {}
+        self.count = count
+        self.negatives = negatives if negatives is not None else {}
+
+    # Adds an amount to the balance of a currency on the transaction's exchange
+    def add(self, tx, currency, qty):
+        key = (tx.exchange, currency)
+        balance = self.balances.get(key, 0)
+        new_balance = balance + parseAmount(qty, currency, BALANCE_DECIMALS)
+        self.balances[key] = new_balance
+        if new_balance < 0 and roundBalance(new_balance, currency) < 0 <= roundBalance(balance, currency):
+            negative = self.negatives.get(key)
+            if negative is None or getTxTimestamp(tx) < datetime.strptime(negative[0], COINTRACKER_DATE_FORMAT):
+                self.negatives[key] = (tx.date, tx.tx_id)
+
+    def apply(self, tx):
+        if tx.sent_qty and tx.sent_currency == tx.received_currency and tx.sent_qty == tx.received_qty:
+            self.add(tx, tx.sent_currency, -tx.sent_qty)
+        else:
+            if tx.received_qty:
+                self.add(tx, tx.received_currency, tx.received_qty)
+            if tx.sent_qty:
+                self.add(tx, tx.sent_currency, -tx.sent_qty)
+            if tx.fee_amount:
+                self.add(tx, tx.fee_currency, -tx.fee_amount)
+        self.count += 1
+
+
+# Returns the path of the balance index stored next to the Master Ledger
+def getBalancesPath(ledger_path):
+    return ledger_path.with_name(ledger_path.stem + BALANCES_SUFFIX)
+
+
+# Loads the balance index, or returns None if it doesn't exist or the Master Ledger changed since it was saved
+def loadBalanceIndex(ledger_path):
+    balances_path = getBalancesPath(ledger_path)
+    if not balances_path.is_file() or not ledger_path.is_file():
+        return None
+    with open(balances_path, 'rt', encoding='utf8') as file:
+        index_data = json.load(file)
+
+    # Indexes saved before the negative balances were kept are rebuilt too
+    ledger_stat = os.stat(ledger_path)
+    if (index_data.get("ledger_mtime_ns") != ledger_stat.st_mtime_ns
+            or index_data.get("ledger_size") != ledger_stat.st_size or "negatives" not in index_data):
+        return None
+    balances = {(exchange, currency): units for exchange, currency, units in index_data["balances"]}
+    negatives = {(exchange, currency): (date, tx_id) for exchange, currency, date, tx_id in index_data["negatives"]}
+    return BalanceIndex(balances, index_data["count"], negatives)
+
+
+# Saves the balance index along with the state of the Master Ledger it matches, replacing the file atomically
+def saveBalanceIndex(balance_index, ledger_path):
+    balances_path = getBalancesPath(ledger_path)
+    ledger_stat = os.stat(ledger_path)
+    index_data = {
+        "ledger_mtime_ns": ledger_stat.st_mtime_ns,
+        "ledger_size": ledger_stat.st_size,
+        "count": balance_index.count,
+        "balances": [[exchange, currency, units] for (exchange, currency), units in balance_index.balances.items()],
+        "negatives": [[exchange, currency, date, tx_id]
+            for (exchange, currency), (date, tx_id) in balance_index.negatives.items()]
+    }
+    temp_path = balances_path.with_name(balances_path.name + '.tmp')
+    with open(temp_path, 'wt', encoding='utf8') as file:
+        json.dump(index_data, file)
+    os.replace(temp_path, balances_path)
+
+
+# Brings the balance index loaded before the Master Ledger was updated up to date with the ledger's new transactions,
+# only rebuilding it from the whole ledger if there was no current index. Returns the updated BalanceIndex
+# New transactions dated before the ledger's latest ones are added on top of the current balances, which stay exact,
+# so only their running balance from then on is checked for going negative
+def updateBalanceIndex(balance_index, new_data, ledger_path):
+    with measureStage('balances', ledger_path) as stats:
+        if balance_index is None:
+            print('Rebuilding the balance index from the Master Ledger.')
+            balance_index = BalanceIndex()
+            new_data = queryLedger(ledger_path)
+
+        for tx in new_data:
+            balance_index.apply(tx)
+        saveBalanceIndex(balance_index, ledger_path)
+        stats['rows'] = len(new_data)
+    return balance_index
+
+
+# Reads an exchange-provided balance file of the current balance of each currency on each exchange
+def readBalanceFile(balances_path):
+    with open(balances_path, 'rt', encoding='utf8', newline='') as file:
+        rows = csv.reader(file)
+        header = [name.strip().lower() for name in next(rows, [])]
+        exchange_col, currency_col, balance_col = (header.index(name) if name in header else col
+            for col, name in enumerate(BALANCE_FILE_COLUMNS))
+
+        balances = {}
+        for row in rows:
+            if len(row) <= max(exchange_col, currency_col, balance_col) or not row[balance_col].strip():
+                continue
+            currency = row[currency_col].strip().upper()
+            balances[(row[exchange_col].strip(), currency)] = parseAmount(row[balance_col], currency, BALANCE_DECIMALS)
+    return balances
+
+
+# Creates a reconciliation file of the balance of each currency on each exchange, flagging the balances that are or
+# went negative and those that don't match the exchange-provided balance file, if there is one
+def getReconciliationReport(balance_index, new_file_dir, balances_path=None):
+    exchange_balances = {}
+    if balances_path is not None and Path(balances_path).is_file():
+        exchange_balances = readBalanceFile(balances_path)
+
+    filename = generateFilename("Reconciliation", '.csv')
+    new_file_path = Path(new_file_dir) / filename
+    num_negative = 0
+    num_mismatched = 0
+    keys = sorted(set(balance_index.balances) | set(exchange_balances), key=lambda key: (key[0] or '', key[1] or ''))
+
+    with open(new_file_path, 'w', newline='') as file:
+        writer = csv.writer(file)
+        writer.writerow(["Exchange", "Currency", "Ledger Balance", "Exchange Balance", "Difference", "Status",
+            "Went Negative On", "Negative Tx_Id"])
+        for key in keys:
+            exchange, currency = key
+            balance = roundBalance(balance_index.balances.get(key, 0), currency)
+            exchange_balance = exchange_balances.get(key)
+            difference = None
+            status = []
+
+            negative = balance_index.negatives.get(key)
+            if balance < 0 or negative is not None:
+                status.append("NEGATIVE")
+                num_negative += 1
+            if exchange_balance is not None:
+                exchange_balance = roundBalance(exchange_balance, currency)
+                difference = balance - exchange_balance
+                if difference:
+                    status.append("MISMATCH")
+                    num_mismatched += 1
+
+            writer.writerow([
+                exchange,
+                currency,
+                amountToFloat(balance, currency),
+                amountToFloat(exchange_balance, currency) if exchange_balance is not None else None,
+                amountToFloat(difference, currency) if difference is not None else None,
+                ' '.join(status) or "OK",
+                negative[0] if negative is not None else None,
+                negative[1] if negative is not None else None
+            ])
+
+    print(f'Successfully created new Reconciliation file of {len(keys)} balances at {filename}, with {num_negative} '
+        f'negative and {num_mismatched} not matching the exchange balances.')
+
+
+# Returns a deterministic tx_id from a transaction's normalized content, numbering identical transactions in the
+# order they appear in the report so each one keeps the same tx_id when the report is re-exported
+def fingerprintTransaction(occurrences, content):
+    key = '\x1f'.join(map(repr, content))
+    digest = hashlib.blake2b(key.encode('utf8'), digest_size=10).hexdigest()
+
+    occurrence = occurrences.get(digest, 0) + 1
+    occurrences[digest] = occurrence
+    if occurrence == 1:
+        return COINSQUARE_TX_ID_PREFIX + digest
+    return COINSQUARE_TX_ID_PREFIX + digest + '-' + str(occurrence)
+
+
+# Returns the normalized content of a Coinsquare FUND_AND_WITHDRAW row, as fingerprinted by its formatter
+def getFundAndWithdrawContent(columns, row):
+    return (formatCoinsquareDate(row[columns['date']]), row[columns['operation']],
+        extractFloatFromText(row[columns['amount']]), row[columns['currency']])
+
+
+# Returns the normalized content of a Coinsquare QUICK_TRADE row, as fingerprinted by its formatter
+def getQuickTradeContent(columns, row):
+    return (formatCoinsquareDate(row[columns['date']]), row[columns['from_currency']],
+        extractFloatFromText(row[columns['from_amount']]), row[columns['to_currency']],
+        extractFloatFromText(row[columns['to_amount']]))
+
+
+# Returns the Coinsquare withdrawal fee of a currency as a fixed-point amount, or None if it has none
+@lru_cache(maxsize=None)
+def getCoinsquareWithdrawFee(currency):
+    fee = COINSQUARE_WITHDRAW_FEES.get(currency)
+    return parseAmount(fee, currency) if fee is not None else None
+
+
 # Format a Coinsquare report of type: FUND_AND_WITHDRAW
-def formatFundAndWithdrawReport(data, raw_sheet, new_sheet, last_row):
-    # TODO: Add in a future custom Coinsquare tx_id
-    tx_id = ""
+def formatFundAndWithdrawReport(data, columns, raw_rows, write_row, state):
     exchange = "Coinsquare"
+    occurrences = state.setdefault('occurrences', {})
+
+    # Column indices of the report's fields
+    date_col = columns['date']
+    amount_col = columns['amount']
+    currency_col = columns['currency']
+    operation_col = columns['operation']
 
     # Read and format the data from the file
-    for i in range(2, last_row+1):
+    for row in raw_rows:
         # Date
-        date = formatCoinsquareDate(raw_sheet['A' + str(i)].value)
+        timestamp, date = normalizeCoinsquareDate(row[date_col])
 
-        # Amount Info             
-        qty = extractFloatFromText(raw_sheet['D' + str(i)].value)   # Amount           
-        currency = raw_sheet['E' + str(i)].value                    # Currency
-        operation = raw_sheet['C' + str(i)].value                   # Credit or Debit
-        cost_basis = ""
-        cost_basis_units = ""
+        # Amount Info, the amount as a fixed-point amount
+        currency = row[currency_col]                    # Currency
+        qty = parseAmount(row[amount_col], currency)    # Amount
+        operation = row[operation_col]                  # Credit or Debit
+        cost_basis = None
+        cost_basis_units = None
+
+        # Fingerprint the transaction to use as its tx_id
+        tx_id = fingerprintTransaction(occurrences, (date, operation, extractFloatFromText(row[amount_col]), currency))
 
         # Calculate fees and quantities
         if operation == "credit":
-            received_qty = qty
+            received_qty = amountToFloat(qty, currency)
             received_currency = currency
-            sent_qty = ""
-            sent_currency = ""
-            fee_amount = ""
-            fee_currency = ""
+            sent_qty = None
+            sent_currency = None
+            fee_amount = None
+            fee_currency = None
         elif operation == "debit":
-            if currency == "BTC":
-                fee_amount = COINSQUARE_BTC_WITHDRAW_FEE
-            if currency == "ETH":
-                fee_amount = COINSQUARE_ETH_WITHDRAW_FEE
-            if currency == "DOGE":
-                fee_amount = COINSQUARE_DOGE_WITHDRAW_FEE   
-            sent_qty = qty              # Includes fees 
-            sent_currency = currency                 
-            fee_currency = currency  
+            fee_units = getCoinsquareWithdrawFee(currency)
+            fee_amount = amountToFloat(fee_units, currency) if fee_units is not None else None
+            fee_currency = currency if fee_units is not None else None
+            sent_qty = amountToFloat(qty, currency)     # Includes fees
+            sent_currency = currency
 
             # Reformats a transfer as a send/receive of the same amount, with a fee deducted        
             received_qty = sent_qty
             received_currency = sent_currency
 
-        # Write the data to the new_sheet on the original file
+        # Write the data to the formatted results
         new_data = [date, received_qty, received_currency, sent_qty, sent_currency, fee_amount, fee_currency]
-        writeToExcelSheet(new_sheet, A_TO_G_LIST, i, new_data)
+        write_row(new_data)
 
         # Add the new data to be list of possible new transactions for the master ledger
         addMasterLedgerData(data, date, exchange, received_qty, received_currency,
             sent_qty, sent_currency, fee_amount, fee_currency, cost_basis,
-            cost_basis_units, tx_id)
-
+            cost_basis_units, tx_id, timestamp)
+
+
+# NumPy is optional and only used to vectorize the quick trade calculations, so it's imported on first use
+# Returns None if it isn't installed
+@lru_cache(maxsize=None)
+def importNumPy():
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+
+# Divides arrays of integers by arrays of positive integers, rounding half to even like divideRounded
+def divideRoundedArrays(np, numerators, denominators):
+    quotients = numerators // denominators
+    twice_remainders = 2 * (numerators - quotients * denominators)
+    rounds_up = (twice_remainders > denominators) | ((twice_remainders == denominators) & (quotients % 2 == 1))
+    return np.where(rounds_up.astype(bool), quotients + 1, quotients)
+
+
+# Returns the number of decimals of each currency of an array, looking up each distinct currency once
+def getCurrencyDecimalsArray(np, currencies):
+    distinct_currencies, indices = np.unique(currencies, return_inverse=True)
+    return np.asarray([CURRENCY_DECIMALS.get(currency, DEFAULT_CURRENCY_DECIMALS)
+        for currency in distinct_currencies.tolist()], dtype=np.int64)[indices]
+
+
+# Calculates the trade types, fees, fee adjusted received quantities and cost basis of quick trades from arrays of
+# their fixed-point amounts, matching getTradeType, calcCoinsquareFee and calcTxCostBasis row by row. The amounts are
+# calculated as int64 arrays, except for the rows whose amounts could overflow them (ie. 18 decimal amounts over
+# 4 units), which are calculated row by row as Python integers in object arrays. The cost basis of crypto to crypto
+# trades is left as None, to be valued by the formatter
+def calcQuickTradeColumns(to_amounts, to_currencies, from_amounts, from_currencies):
+    np = importNumPy()
+    btc_numerator, btc_denominator = getRateRatio(COINSQUARE_BTC_TX_FEE)
+    non_btc_numerator, non_btc_denominator = getRateRatio(COINSQUARE_NON_BTC_TX_FEE)
+    int64_max = np.iinfo(np.int64).max
+    int64_limit = int64_max // (2 * max(btc_numerator, non_btc_numerator))
+
+    # Rows too large for int64 are zeroed in the arrays, and calculated apart
+    overflow_rows = []
+    if (max(to_amounts, default=0) >= int64_limit or min(to_amounts, default=0) <= -int64_limit
+            or max(from_amounts, default=0) >= int64_limit or min(from_amounts, default=0) <= -int64_limit):
+        overflow_rows = [i for i, (to_amount, from_amount) in enumerate(zip(to_amounts, from_amounts))
+            if not -int64_limit < to_amount < int64_limit or not -int64_limit < from_amount < int64_limit]
+    large_rows = [(to_amounts[i], to_currencies[i], from_amounts[i], from_currencies[i]) for i in overflow_rows]
+    if overflow_rows:
+        to_amounts = list(to_amounts)
+        from_amounts = list(from_amounts)
+        for i in overflow_rows:
+            to_amounts[i] = from_amounts[i] = 0
+
+    to_amounts = np.asarray(to_amounts, dtype=np.int64)
+    from_amounts = np.asarray(from_amounts, dtype=np.int64)
+    to_currencies = np.asarray(to_currencies)
+    from_currencies = np.asarray(from_currencies)
+
+    # Trading fee rates based on the currency used
+    is_btc = (to_currencies == "BTC") | (from_currencies == "BTC")
+    fee_numerators = np.where(is_btc, btc_numerator, non_btc_numerator).astype(np.int64)
+    fee_denominators = np.where(is_btc, btc_denominator, non_btc_denominator).astype(np.int64)
+
+    # Selling to CAD takes priority like in getTradeType, trades without any CAD are between cryptos
+    is_sell = to_currencies == "CAD"
+    is_buy = ~is_sell & (from_currencies == "CAD")
+    tx_types = np.where(is_sell, SELL_TX, np.where(is_buy, BUY_TX, CRYPTO_TX))
+
+    # Buys and crypto to crypto trades pay the fee in the received currency and sells in the sent currency
+    is_received_fee = ~is_sell
+    fee_amounts = divideRoundedArrays(np, np.where(is_received_fee, to_amounts, from_amounts) * fee_numerators,
+        fee_denominators)
+
+    # Adjust the received_qty of buys and crypto to crypto trades to include the fee
+    received_qtys = np.where(is_received_fee, to_amounts + fee_amounts, to_amounts)
+
+    # The cost basis of buys and sells is their CAD amount over their crypto amount before the fee, scaled to
+    # COST_BASIS_DECIMALS like calcAmountRatio less the power of ten both sides share
+    is_cad_trade = is_sell | is_buy
+    cad_amounts = np.where(is_sell, to_amounts, from_amounts)
+    crypto_amounts = np.where(is_sell, from_amounts, np.where(is_cad_trade, to_amounts, 1))
+    to_decimals = getCurrencyDecimalsArray(np, to_currencies)
+    from_decimals = getCurrencyDecimalsArray(np, from_currencies)
+    cad_decimals = np.where(is_sell, to_decimals, from_decimals)
+    crypto_decimals = np.where(is_sell, from_decimals, to_decimals)
+    shared_decimals = np.minimum(crypto_decimals + COST_BASIS_DECIMALS, cad_decimals)
+    numerator_exponents = crypto_decimals + COST_BASIS_DECIMALS - shared_decimals
+    denominator_exponents = cad_decimals - shared_decimals
+    is_negative = crypto_amounts < 0
+    cad_amounts = np.where(is_negative, -cad_amounts, cad_amounts)
+    crypto_amounts = np.where(is_negative, -crypto_amounts, crypto_amounts)
+
+    # Amounts given to fewer decimals than their currency's (ie. ETH to 8 decimals) end in zeros, which cancel out of
+    # the numerator's power of ten
+    reducible = is_cad_trade & (numerator_exponents > 0) & (crypto_amounts % 10 == 0) & (crypto_amounts != 0)
+    while reducible.any():
+        crypto_amounts = np.where(reducible, crypto_amounts // 10, crypto_amounts)
+        numerator_exponents = numerator_exponents - reducible
+        reducible &= (numerator_exponents > 0) & (crypto_amounts % 10 == 0)
+
+    # The rows whose scaled amounts fit int64, with room to double the remainders when rounding, are divided as
+    # arrays and the others as Python integers
+    scale_limits = np.asarray([int64_max // (2 * power) for power in POWERS_OF_TEN], dtype=np.int64)
+    fits_int64 = ((crypto_amounts != 0) & (np.abs(cad_amounts) <= scale_limits[numerator_exponents])
+        & (crypto_amounts <= scale_limits[denominator_exponents]))
+    cost_basis = np.zeros(len(tx_types))
+    rows = np.flatnonzero(is_cad_trade & fits_int64)
+    if len(rows):
+        powers_of_ten = np.asarray(POWERS_OF_TEN[:19], dtype=np.int64)
+        cost_basis[rows] = divideRoundedArrays(np, cad_amounts[rows] * powers_of_ten[numerator_exponents[rows]],
+            crypto_amounts[rows] * powers_of_ten[denominator_exponents[rows]]) / POWERS_OF_TEN[COST_BASIS_DECIMALS]
+    is_overflow = np.zeros(len(tx_types), dtype=bool)
+    is_overflow[overflow_rows] = True
+    rows = np.flatnonzero(is_cad_trade & ~fits_int64 & ~is_overflow)
+    if len(rows):
+        cost_basis[rows] = [divideRounded(cad_amount * POWERS_OF_TEN[numerator_exponent],
+            crypto_amount * POWERS_OF_TEN[denominator_exponent]) / POWERS_OF_TEN[COST_BASIS_DECIMALS]
+            for cad_amount, crypto_amount, numerator_exponent, denominator_exponent in zip(
+                cad_amounts[rows].tolist(), crypto_amounts[rows].tolist(), numerator_exponents[rows].tolist(),
+                denominator_exponents[rows].tolist())]
+    cost_basis = np.where(is_cad_trade, cost_basis, None)
+
+    # Calculate the rows too large for int64 like the row by row formatter
+    if overflow_rows:
+        received_qtys = received_qtys.astype(object)
+        fee_amounts = fee_amounts.astype(object)
+        for i, (to_amount, to_currency, from_amount, from_currency) in zip(overflow_rows, large_rows):
+            fee_dict = calcCoinsquareFee(to_amount, to_currency, from_amount, from_currency)
+            tx_type = getTradeType(to_currency, from_currency)
+            if tx_type == SELL_TX:
+                fee_amounts[i] = fee_dict['sent_fee_amount']
+                received_qtys[i] = to_amount
+                cost_basis[i] = calcTxCostBasis(to_amount, to_currency, from_amount, from_currency, fee_amounts[i],
+                    SELL_TX)["cost_basis"]
+            else:
+                fee_amounts[i] = fee_dict['received_fee_amount']
+                received_qtys[i] = to_amount + fee_amounts[i]
+                if tx_type == BUY_TX:
+                    cost_basis[i] = calcTxCostBasis(received_qtys[i], to_currency, from_amount, from_currency,
+                        fee_amounts[i], BUY_TX)["cost_basis"]
+
+    return tx_types, received_qtys, fee_amounts, cost_basis
+
+
+# Format a Coinsquare report of type: QUICK_TRADE, vectorizing the fee and cost basis math when NumPy is available
+def formatQuickTradeReport(data, columns, raw_rows, write_row, state):
+    if importNumPy() is None:
+        formatQuickTradeRows(data, columns, raw_rows, write_row, state)
+        return
 
-# Format a Coinsquare report of type: QUICK_TRADE
-def formatQuickTradeReport(data, raw_sheet, new_sheet, last_row):
-    # TODO: Add in a future custom Coinsquare tx_id
-    tx_id = ""
     exchange = "Coinsquare"
+    occurrences = state.setdefault('occurrences', {})
+    prices = getPriceCache()
+    unvalued_currencies = state.setdefault('unvalued_currencies', {})
+
+    # Column indices of the report's fields
+    date_col = columns['date']
+    from_currency_col = columns['from_currency']
+    from_amount_col = columns['from_amount']
+    to_currency_col = columns['to_currency']
+    to_amount_col = columns['to_amount']
+
+    # Calculate the rows in chunks to keep memory bounded on large reports
+    raw_rows = iter(raw_rows)
+    chunk = list(islice(raw_rows, QUICK_TRADE_CHUNK_SIZE))
+    while chunk:
+        # Dates and From/To Info, as fixed-point amounts
+        dates = normalizeCoinsquareDates([row[date_col] for row in chunk])
+        from_currencies = [row[from_currency_col] for row in chunk]
+        from_amounts = list(map(parseAmount, [row[from_amount_col] for row in chunk], from_currencies))
+        to_currencies = [row[to_currency_col] for row in chunk]
+        to_amounts = list(map(parseAmount, [row[to_amount_col] for row in chunk], to_currencies))
+
+        # Look up the CAD prices of the chunk's crypto to crypto trades together
+        sent_prices = [None] * len(chunk)
+        if prices is not None:
+            sent_prices = prices.getPrices([from_currency if "CAD" not in (from_currency, to_currency) else None
+                for from_currency, to_currency in zip(from_currencies, to_currencies)],
+                [timestamp for timestamp, _ in dates])
+
+        tx_types, received_qtys, fee_amounts, cost_bases = calcQuickTradeColumns(
+            to_amounts, to_currencies, from_amounts, from_currencies)
+        tx_types = tx_types.tolist()
+        received_qtys = received_qtys.tolist()
+        fee_amounts = fee_amounts.tolist()
+        cost_bases = cost_bases.tolist()
+
+        for i in range(len(chunk)):
+            timestamp, date = dates[i]
+            to_currency = to_currencies[i]
+            from_currency = from_currencies[i]
+            from_amount = amountToFloat(from_amounts[i], from_currency)
+            tx_type = tx_types[i]
+
+            # Determine the fee_currency and cost basis units, buys and crypto to crypto trades paying the fee in
+            # the received currency
+            if tx_type == SELL_TX:
+                fee_currency = from_currency
+                cost_basis = cost_bases[i]
+                cost_basis_units = to_currency + "/" + from_currency
+            elif tx_type == BUY_TX:
+                fee_currency = to_currency
+                cost_basis = cost_bases[i]
+                cost_basis_units = from_currency + "/" + to_currency
+
+            # Crypto to crypto trades are valued in CAD at the sent currency's price
+            else:
+                fee_currency = to_currency
+                if sent_prices[i] is None:
+                    unvalued_currencies[from_currency] = unvalued_currencies.get(from_currency, 0) + 1
+                cost_basis_dict = calcTxCostBasis(received_qtys[i], to_currency, from_amounts[i], from_currency,
+                    fee_amounts[i], tx_type, sent_prices[i])
+                cost_basis = cost_basis_dict["cost_basis"]
+                cost_basis_units = cost_basis_dict["cost_basis_units"]
+
+            # Fingerprint the transaction to use as its tx_id
+            row = chunk[i]
+            tx_id = fingerprintTransaction(occurrences, (date, from_currency,
+                extractFloatFromText(row[from_amount_col]), to_currency, extractFloatFromText(row[to_amount_col])))
+
+            # Write the data to the formatted results
+            to_amount = amountToFloat(received_qtys[i], to_currency)
+            fee_amount = amountToFloat(fee_amounts[i], fee_currency)
+            row_data = [date, to_amount, to_currency, from_amount, from_currency, fee_amount, fee_currency]
+            write_row(row_data)
+
+            # Add the new data to be list of possible new transactions for the master ledger
+            addMasterLedgerData(data, date, exchange, to_amount, to_currency,
+                from_amount, from_currency, fee_amount, fee_currency,
+                cost_basis, cost_basis_units, tx_id, timestamp)
+
+        chunk = list(islice(raw_rows, QUICK_TRADE_CHUNK_SIZE))
+
+    reportUnvaluedTrades(unvalued_currencies)
+
+
+# Format a Coinsquare report of type: QUICK_TRADE one row at a time
+def formatQuickTradeRows(data, columns, raw_rows, write_row, state):
+    exchange = "Coinsquare"
+    occurrences = state.setdefault('occurrences', {})
+    unvalued_currencies = state.setdefault('unvalued_currencies', {})
 
-    for i in range(2, last_row+1):
+    # Column indices of the report's fields
+    date_col = columns['date']
+    from_currency_col = columns['from_currency']
+    from_amount_col = columns['from_amount']
+    to_currency_col = columns['to_currency']
+    to_amount_col = columns['to_amount']
+
+    for row in raw_rows:
         # Date
-        date = formatCoinsquareDate(raw_sheet['A' + str(i)].value)
+        timestamp, date = normalizeCoinsquareDate(row[date_col])
+
+        # From/To Info, as fixed-point amounts
+        from_currency = row[from_currency_col]
+        from_amount = parseAmount(row[from_amount_col], from_currency)
+        to_currency = row[to_currency_col]
+        to_amount = parseAmount(row[to_amount_col], to_currency)
 
-        # From/To Info
-        from_currency = raw_sheet['B' + str(i)].value
-        from_amount = extractFloatFromText(raw_sheet['C' + str(i)].value)
-        to_currency = raw_sheet['D' + str(i)].value
-        to_amount = extractFloatFromText(raw_sheet['E' + str(i)].value)
+        # Fingerprint the transaction to use as its tx_id
+        tx_id = fingerprintTransaction(occurrences, (date, from_currency, extractFloatFromText(row[from_amount_col]),
+            to_currency, extractFloatFromText(row[to_amount_col])))
 
         fee_dict = calcCoinsquareFee(to_amount, to_currency, from_amount, from_currency)
 
@@ -386,205 +2003,248 @@ def formatQuickTradeReport(data, raw_sheet, new_sheet, last_row):
             fee_amount = fee_dict['sent_fee_amount']
 
             cost_basis_dict = calcTxCostBasis(to_amount, to_currency, from_amount, from_currency, fee_amount, SELL_TX)
+
+        # Crypto to crypto trades pay the fee like buys, valuing what was sent in CAD
         else:
-            print('Error calculating fees and cost basis')
+            fee_currency = fee_dict['received_fee_currency']
+            fee_amount = fee_dict['received_fee_amount']
+            to_amount += fee_amount
+
+            sent_price = getCADPrice(from_currency, timestamp)
+            if sent_price is None:
+                unvalued_currencies[from_currency] = unvalued_currencies.get(from_currency, 0) + 1
+            cost_basis_dict = calcTxCostBasis(to_amount, to_currency, from_amount, from_currency, fee_amount,
+                CRYPTO_TX, sent_price)
 
         # Extract the cost basis info
         cost_basis = cost_basis_dict["cost_basis"]
         cost_basis_units = cost_basis_dict["cost_basis_units"]
 
-        # Write the data to the new_sheet on the original file
+        # Convert the fixed-point amounts for the formatted results
+        to_amount = amountToFloat(to_amount, to_currency)
+        from_amount = amountToFloat(from_amount, from_currency)
+        fee_amount = amountToFloat(fee_amount, fee_currency)
+
+        # Write the data to the formatted results
         row_data = [date, to_amount, to_currency, from_amount, from_currency, fee_amount, fee_currency]     
-        writeToExcelSheet(new_sheet, A_TO_G_LIST, i, row_data)
+        write_row(row_data)
 
         # Add the new data to be list of possible new transactions for the master ledger
         addMasterLedgerData(data, date, exchange, to_amount, to_currency,
             from_amount, from_currency, fee_amount, fee_currency,
-            cost_basis, cost_basis_units, tx_id)
-
-
-# Format a Coinsquare Ledger file for the "Fund/Withdraw" transactions
-def formatCoinsquare(data, report_path, new_file_dir):
-    print(f'Preparing to format file at {report_path}...')
-
-    # Generate a filename
-    exchange = "Coinsquare"
-    filename = generateFilename(exchange, '.xlsx')
-    new_file_path = Path(new_file_dir + filename)
-
-    # Load the file being processed    
-    report_workbook = openpyxl.load_workbook(report_path)
-
-    # Defines the sheets
-    raw_sheet = report_workbook.active
-    new_sheet = report_workbook.create_sheet(title='Formatted')
-    last_row = raw_sheet.max_row
-    formatCointrackerHeader(new_sheet)
-
-    # Determine the report type
-    report_type = getCoinsquareReportType(raw_sheet)
-    if report_type == FUND_AND_WITHDRAW:
-        formatFundAndWithdrawReport(data, raw_sheet, new_sheet, last_row)
-    elif report_type == QUICK_TRADE:
-        formatQuickTradeReport(data, raw_sheet, new_sheet, last_row)
-
-    # Save the new formatted file
-    saveNewResultFile(report_workbook, report_path, new_file_path, filename)
-    return data
+            cost_basis, cost_basis_units, tx_id, timestamp)
 
+    reportUnvaluedTrades(unvalued_currencies)
 
-# Format an NDAX transactions file
-def formatNDAX(data, report_path, new_file_dir):    
-    print(f'Preparing to format file at {report_path}...')
 
-    # Generate a filename
+# Format an NDAX report of type: TRANSACTIONS
+def formatNDAXReport(data, columns, raw_rows, write_row, state):
     exchange = "NDAX"
-    filename = generateFilename(exchange, '.xlsx')
-    new_file_path = Path(new_file_dir + filename)
 
-    # Load the file being processed    
-    report_workbook = openpyxl.load_workbook(report_path)
+    # Column indices of the report's fields
+    tx_id_col = columns['txid']
+    ref_id_col = columns['ref_id']
+    date_col = columns['date']
+    time_col = columns['time']
+    type_col = columns['type']
+    currency_col = columns['product']
+    amount_col = columns['amount']
 
-    # Defines the sheets
-    raw_sheet = report_workbook.active
-    new_sheet = report_workbook.create_sheet(title='Formatted')
-    last_row = raw_sheet.max_row
-    formatCointrackerHeader(new_sheet)
+    # The legs of each trade share a ref_id, so they're grouped by it until all of the trade's legs were read
+    open_trades = state.setdefault('open_trades', {})
+    incomplete_trades = state.setdefault('incomplete_trades', [])
+    unvalued_currencies = state.setdefault('unvalued_currencies', {})
 
-    # Define the tracking index to help process the multi-line nature of the transactions
-    next_tx_index = last_row
-    skip_offset = 0
+    # Read and format the data from the file in a single forward pass
+    for row in raw_rows:
 
-    # Read and format the data from the file
-    for i in range(last_row, 2, -1):
+        # Type and Cost Basis
+        tx_type = row[type_col]
+        cost_basis = None
+        cost_basis_units = None
+
+        # Wait for the rest of the trade's legs before processing it
+        if tx_type == 'Trade':
+            ref_id = row[ref_id_col]
+            legs = open_trades.setdefault(ref_id, [])
+            legs.append(row)
+            if len(legs) < NDAX_TRADE_LEGS:
+                # Give up on the oldest trade if too many are missing legs
+                if len(open_trades) > NDAX_MAX_OPEN_TRADES:
+                    incomplete_trades.append(next(iter(open_trades)))
+                    del open_trades[incomplete_trades[-1]]
+                continue
+            del open_trades[ref_id]
 
-        # Skip indices to get to the next transaction after a trade has been processed
-        if i > next_tx_index:
-            continue
+            trade_legs = splitNDAXTradeLegs(legs, currency_col, amount_col)
+            if trade_legs is None:
+                incomplete_trades.append(ref_id)
+                continue
+            (received_row, received_units), (sent_row, sent_units), (fee_row, fee_units) = trade_legs
 
-        # Offset for starting to write data at row 2 in the new formatted sheet
-        offset = last_row - i + 2 - skip_offset
+            # The trade's tx_id and date are those of its last leg in the report
+            row = legs[-1]
 
         # Reference IDs
-        tx_id = raw_sheet['A' + str(i)].value
-        # ref_id = raw_sheet['B' + str(i)].value
+        tx_id = row[tx_id_col]
 
         # Datetime
-        raw_date = raw_sheet['C' + str(i)].value
-        raw_time = raw_sheet['D' + str(i)].value
-        date = formatNDAXDate(raw_date, raw_time)
-
-        # Type and Cost Basis
-        tx_type = raw_sheet['E' + str(i)].value
-        cost_basis = ""
-        cost_basis_units = ""
+        raw_date = row[date_col]
+        raw_time = row[time_col]
+        timestamp, date = normalizeNDAXDate(raw_date, raw_time)
 
         # Finds the relevant transactions and fees based on the type of transaction
         if tx_type == 'Deposit':
-            # Get the deposit info
-            received_qty = float(raw_sheet['H' + str(i)].value)
-            received_currency = raw_sheet['F' + str(i)].value
+            # Get the deposit info, its amount being written as is
+            received_currency = row[currency_col]
 
             # Process fiat currency (CAD) deposits only
             if received_currency == "CAD":
-                sent_qty = ""
-                sent_currency = ""
-                fee_amount = ""
-                fee_currency = ""
+                received_qty = extractFloatFromText(row[amount_col])
+                sent_qty = None
+                sent_currency = None
+                fee_amount = None
+                fee_currency = None
 
             # Ignore non-fiat transfers because transfers are dealt with as tx_type=Trade
-            else:                
-                # Assign the indices for the current transaction to skip over the next loop
-                skip_offset += 1
+            else:
                 continue
 
         elif tx_type == 'Affiliate Payout':
-            received_qty = float(raw_sheet['H' + str(i)].value)
-            received_currency = raw_sheet['F' + str(i)].value
-            sent_qty = ""
-            sent_currency = ""
-            fee_amount = ""
-            fee_currency = ""
+            received_currency = row[currency_col]
+            received_qty = extractFloatFromText(row[amount_col])
+            sent_qty = None
+            sent_currency = None
+            fee_amount = None
+            fee_currency = None
             
         elif tx_type == 'Trade':
-            # Fees
-            qty_i_2 = raw_sheet['H' + str(i-2)].value
-            fee_amount = float(qty_i_2)*-1
-            fee_currency = raw_sheet['F' + str(i-2)].value
-
-            # Determine which indexes are the sent/receive
-            qty_i = raw_sheet['H' + str(i)].value
-            qty_i_1 = raw_sheet['H' + str(i-1)].value
-            if float(qty_i) > 0:
-                received_qty = float(qty_i)
-                received_currency = raw_sheet['F' + str(i)].value
-                sent_qty = float(qty_i_1)*-1
-                sent_currency = raw_sheet['F' + str(i-1)].value
-            elif float(qty_i) < 0:
-                received_qty = float(qty_i_1)
-                received_currency = raw_sheet['F' + str(i-1)].value
-                sent_qty = float(qty_i)*-1
-                sent_currency = raw_sheet['F' + str(i)].value
-
-            # Assign the indices for the current transaction to skip over the next 2 loops
-            next_tx_index = i - 3
-            skip_offset += 2
+            # Fees, as a fixed-point amount
+            fee_units = -fee_units
+            fee_currency = fee_row[currency_col]
+
+            # Sent/received, as fixed-point amounts
+            received_currency = received_row[currency_col]
+            sent_units = -sent_units
+            sent_currency = sent_row[currency_col]
         
             # Determine the cost basis for the transaction
             trade_type = getTradeType(received_currency, sent_currency)
-            cost_basis_dict = calcTxCostBasis(received_qty, received_currency, sent_qty, sent_currency,
-                                                fee_amount, trade_type)
+            sent_price = None
+            if trade_type == CRYPTO_TX:
+                sent_price = getCADPrice(sent_currency, timestamp)
+                if sent_price is None:
+                    unvalued_currencies[sent_currency] = unvalued_currencies.get(sent_currency, 0) + 1
+            cost_basis_dict = calcTxCostBasis(received_units, received_currency, sent_units, sent_currency,
+                                                fee_units, trade_type, sent_price)
             cost_basis = cost_basis_dict["cost_basis"]
             cost_basis_units = cost_basis_dict["cost_basis_units"]        
 
-        # Write the data to the new_sheet on the original file
+            # Convert the fixed-point amounts for the formatted results
+            received_qty = amountToFloat(received_units, received_currency)
+            sent_qty = amountToFloat(sent_units, sent_currency)
+            fee_amount = amountToFloat(fee_units, fee_currency)
+
+        # Skip any other type of transaction instead of writing it with the previous transaction's values
+        else:
+            continue
+
+        # Write the data to the formatted results
         new_data = [date, received_qty, received_currency, sent_qty, sent_currency, fee_amount, fee_currency]
-        writeToExcelSheet(new_sheet, A_TO_G_LIST, offset, new_data)
+        write_row(new_data)
 
         # Add the new data to be list of possible new transactions for the master ledger
         addMasterLedgerData(data, date, exchange, received_qty, received_currency,
             sent_qty, sent_currency, fee_amount, fee_currency, cost_basis,
-            cost_basis_units, tx_id)
-    
-    saveNewResultFile(report_workbook, report_path, new_file_path, filename)
+            cost_basis_units, tx_id, timestamp)
+
+    # Report the trades that couldn't be formatted, ie. partially exported at the start or end of the report
+    incomplete_trades.extend(open_trades)
+    if incomplete_trades:
+        listed_trades = ', '.join(map(str, incomplete_trades[:NDAX_LISTED_INCOMPLETE_TRADES]))
+        more_trades = len(incomplete_trades) - NDAX_LISTED_INCOMPLETE_TRADES
+        print(f'Skipped {len(incomplete_trades)} incomplete NDAX trade(s) with ref_id: {listed_trades}'
+            + (f' and {more_trades} more.' if more_trades > 0 else '.'))
+    reportUnvaluedTrades(unvalued_currencies)
+
+
+# Returns the (received, sent, fee) legs of an NDAX trade as (row, fixed-point amount) pairs, from their amounts in
+# any order, or None if they aren't a trade. The received leg is the only positive one and the fee is paid in the
+# received currency, otherwise the fee is the first of the negative legs in the report, as NDAX exports them
+# Each leg's amount is only parsed once
+def splitNDAXTradeLegs(legs, currency_col, amount_col):
+    legs = [(leg, parseAmount(leg[amount_col], leg[currency_col])) for leg in legs]
+    received_legs = [leg for leg in legs if leg[1] > 0]
+    if len(received_legs) != 1:
+        return None
+    received_leg = received_legs[0]
+    negative_legs = [leg for leg in legs if leg is not received_leg]
+
+    fee_legs = [leg for leg in negative_legs if leg[0][currency_col] == received_leg[0][currency_col]]
+    fee_leg = fee_legs[0] if len(fee_legs) == 1 else negative_legs[0]
+    sent_leg = negative_legs[1] if fee_leg is negative_legs[0] else negative_legs[0]
+    return received_leg, sent_leg, fee_leg
+
+
+# Formatters for each supported report type
+REPORT_FORMATTERS = {
+    FUND_AND_WITHDRAW: formatFundAndWithdrawReport,
+    QUICK_TRADE: formatQuickTradeReport,
+    TRANSACTIONS: formatNDAXReport
+}
+
+
+# Format the rest of a report's rows, after its header row was detected, into a new results file
+# With a journal, the formatted transactions are committed to it as they are formatted, resuming from its last commit
+def formatReport(data, report_path, new_file_dir, raw_rows, detection, output_ext=None, state=None, journal=None):
+    print(f'Preparing to format file at {report_path}...')
+    exchange, report_type, columns = detection
+    state = {} if state is None else state
+    entry_rows = len(data)
+
+    # Generate a filename, keeping the report's own file type unless another one was asked for
+    filename = generateFilename(EXCHANGE_NAMES[exchange], output_ext or report_path.suffix)
+    new_file_path = Path(new_file_dir) / filename
+
+    # Write the formatted rows to the new results file, timing the reading of the rows apart when instrumented
+    with measureStage('format', report_path, exchange) as stats:
+        if isInstrumented():
+            raw_rows = timeRows(raw_rows, stats)
+        write_row, close_result_file = openResultWriter(new_file_path)
+        write_row(COINTRACKER_HEADER)
+        if journal is not None:
+            raw_rows = journal.begin(raw_rows, new_file_path, write_row, data, state)
+        REPORT_FORMATTERS[report_type](data, columns, raw_rows, write_row, state)
+        raw_rows.close()
+    if 'load_seconds' in stats:
+        emitStageMetrics('load', report_path, exchange, stats['load_seconds'], stats['rows'])
+
+    # Save the results and move the untouched report next to them
+    with measureStage('save', report_path, exchange) as stats:
+        close_result_file()
+        if journal is not None:
+            journal.finish(data, state)
+        moveRawReport(report_path, new_file_path)
+        stats['rows'] = len(data) - entry_rows
+    print(f'Saved new file as {filename}.')
     return data
 
 
-# Returns a list of all the transaction ids (tx_id) present in the Master Ledger
-def getAllTxIDs(ledger_path):
-    # Load the Master Ledger worksheet
-    workbook = openpyxl.load_workbook(ledger_path)
-    sheet = workbook.active
-
-    # Create a list of all the tx_ids present
-    tx_id_list = []
-    last_tx_row = sheet.max_row
-    row_start = 2   # Start on row 2 to bypass header row
-    row_end = last_tx_row + 1
-    
-    for i in range(row_start, row_end):
-        tx_id = sheet['J' + str(i)].value
-        if tx_id != "":
-            tx_id_list.append(tx_id)
-
-    return tx_id_list
-
-
 # Creates a summarized import file for Cointracker
 def getCointrackerSummary(data, new_file_dir):
-    print(f'Preparing Cointracker Summary file at {results_dir}...')
+    print(f'Preparing Cointracker Summary file at {new_file_dir}...')
 
     # Generate a filename
     name = "Cointracker_Import"
     filename = generateFilename(name, '.csv')
-    new_file_path = Path(new_file_dir + filename)
+    new_file_path = Path(new_file_dir) / filename
 
     # Setup a checker to confirm all transactions were processed
     tx_check = 0
     num_tx = len(data)
 
     # Create a new .csv file
-    with open(new_file_path, 'w', newline='') as file:
+    with measureStage('summary') as stats, open(new_file_path, 'w', newline='') as file:
         writer = csv.writer(file)
 
         # Write header row
@@ -595,15 +2255,16 @@ def getCointrackerSummary(data, new_file_dir):
         for i in range(len(data)):
             row = data[i]
             writer.writerow([
-                row["date"],
-                row["received_qty"],
-                row["received_currency"],
-                row["sent_qty"],
-                row["sent_currency"],
-                row["fee_amount"],
-                row["fee_currency"]
+                row.date,
+                row.received_qty,
+                row.received_currency,
+                row.sent_qty,
+                row.sent_currency,
+                row.fee_amount,
+                row.fee_currency
             ])
             tx_check += 1
+        stats['rows'] = tx_check
     
     if tx_check - num_tx == 0:
         print(f'Successfully created new Cointracker Summary file with {tx_check} transactions.')
@@ -622,34 +2283,798 @@ def convertCSVFiles(reports_path):
     else:
         # Convert all .csv files into .xlsx
         for csv_file_path in csv_file_paths_list:
-            csvToXlsx(csv_file_path)
+            with measureStage('convert', csv_file_path) as stats:
+                stats['rows'] = csvToXlsx(csv_file_path)
+
+
+# Returns the path of the report manifest stored next to the Master Ledger
+def getManifestPath(ledger_path):
+    return ledger_path.with_name(ledger_path.stem + MANIFEST_SUFFIX)
+
+
+# Loads the report manifest, starting an empty one if there isn't one yet
+def loadManifest(manifest_path):
+    if manifest_path.is_file():
+        with open(manifest_path, 'rt', encoding='utf8') as file:
+            return json.load(file)
+    return {"reports": {}}
+
+
+# Saves the report manifest, replacing the previous one only once it is fully written
+def saveManifest(manifest, manifest_path):
+    temp_path = manifest_path.with_name(manifest_path.name + '.tmp')
+    with open(temp_path, 'wt', encoding='utf8') as file:
+        json.dump(manifest, file)
+    os.replace(temp_path, manifest_path)
+
+
+# Returns the SHA-256 hash of a file's content, reading it in chunks
+def hashFile(file_path):
+    hasher = hashlib.sha256()
+    with open(file_path, 'rb') as file:
+        for chunk in iter(lambda: file.read(HASH_CHUNK_SIZE), b''):
+            hasher.update(chunk)
+    return hasher.hexdigest()
+
+
+# Encodes a report row so rows can be hashed the same way no matter which file type they came from
+def encodeRow(row):
+    return ('\x1f'.join('' if value is None else str(value) for value in row) + '\x1e').encode('utf8')
+
+
+# Returns the hash of a single report row
+def hashRow(row):
+    return hashlib.sha256(encodeRow(row)).hexdigest()
+
+
+# Streams the rows of a report, skipping the leading rows that an earlier report already ingested
+# The earlier reports' prefix hashes are compared every MANIFEST_CHECKPOINT_ROWS rows and at their last row,
+# so at most that many rows are held back while they might still match
+# Once the rows are exhausted, progress receives the row count, the skipped rows and this report's prefix hashes
+# Each skipped row is passed to skipped_row_handler, if there is one
+def skipIngestedRows(raw_rows, ingested_reports, progress, skipped_row_handler=None):
+    hasher = hashlib.sha256()
+    checkpoints = {}
+    candidates = list(ingested_reports)
+    held_rows = []
+    row_count = 0
+    skipped = 0
+
+    try:
+        for row in raw_rows:
+            row_count += 1
+            hasher.update(encodeRow(row))
+            digest = None
+            if row_count % MANIFEST_CHECKPOINT_ROWS == 0:
+                digest = hasher.hexdigest()
+                checkpoints[str(row_count)] = digest
+
+            if not candidates:
+                yield row
+                continue
+
+            # Check the earlier reports that have a prefix hash at this row
+            held_rows.append(row)
+            matched = False
+            remaining = []
+            for entry in candidates:
+                expected = entry["checkpoints"].get(str(row_count))
+                if expected is None:
+                    remaining.append(entry)
+                    continue
+
+                if digest is None:
+                    digest = hasher.hexdigest()
+                if expected == digest:
+                    matched = True
+                    if row_count < entry["rows"]:
+                        remaining.append(entry)
+            candidates = remaining
+
+            # Every row so far was already ingested, or no earlier report matches anymore
+            if matched:
+                skipped = row_count
+                if skipped_row_handler is not None:
+                    for held_row in held_rows:
+                        skipped_row_handler(held_row)
+                held_rows = []
+            elif not candidates:
+                yield from held_rows
+                held_rows = []
+
+        # Any rows held back past the last matching prefix are new
+        yield from held_rows
+    finally:
+        raw_rows.close()
+
+    if row_count % MANIFEST_CHECKPOINT_ROWS != 0:
+        checkpoints[str(row_count)] = hasher.hexdigest()
+    progress.update(rows=row_count, skipped=skipped, checkpoints=checkpoints)
+
+
+# Packs a dataset into a compact batch of tuples ordered as LEDGER_FIELDS followed by the timestamp
+def packTransactions(data):
+    return [tx.toRow() + (tx.timestamp,) for tx in data]
+
+
+# Adds a batch of packed transactions back into a dataset
+def unpackTransactions(batch, data):
+    data.extend(Transaction(*row) for row in batch)
+    return data
 
 
-# Main method for processing all the exchange's reports
-def processReports(reports_path, results_dir, ledger_path):
+# Content of the rows of each report type whose tx_ids are fingerprints
+REPORT_FINGERPRINT_CONTENT = {
+    FUND_AND_WITHDRAW: getFundAndWithdrawContent,
+    QUICK_TRADE: getQuickTradeContent
+}
+
+
+# Returns a handler that keeps counting the fingerprint occurrences of the rows skipped from a report, so the
+# rows formatted after them get the same tx_ids as when the whole report is formatted
+def getSkippedRowHandler(detection, state):
+    exchange, report_type, columns = detection
+    get_content = REPORT_FINGERPRINT_CONTENT.get(report_type)
+    if get_content is None:
+        return None
+
+    occurrences = state.setdefault('occurrences', {})
+    return lambda row: fingerprintTransaction(occurrences, get_content(columns, row))
+
+
+# Runs format_function on a report, under cProfile if it's the report asked for, saving its profile next to its results
+def runProfiled(report_path, results_dir, format_function, *args):
+    if os.environ.get(PROFILE_ENV_VAR) != report_path.name:
+        return format_function(*args)
+
+    profiler = cProfile.Profile()
+    try:
+        return profiler.runcall(format_function, *args)
+    finally:
+        profile_path = Path(results_dir) / (report_path.name + '.prof')
+        profiler.dump_stats(profile_path)
+        print(f'Saved the profile of {report_path.name} to {profile_path}')
+
+
+# Formats a single report, under cProfile if it's the report asked for
+def formatReportData(data, report_path, results_dir, output_ext=None, manifest=None, manifest_entries=None):
+    return runProfiled(report_path, results_dir, formatReportFile, data, report_path, results_dir, output_ext,
+        manifest, manifest_entries)
+
+
+# Formats a single report in one pass, detecting its format from the header row
+# With a manifest, reports already processed are skipped before being parsed, only the rows after any part
+# already ingested from an earlier report are formatted and the report's new entry is added to manifest_entries
+# Returns None if the report's format isn't recognized
+def formatReportFile(data, report_path, results_dir, output_ext=None, manifest=None, manifest_entries=None):
+    if manifest is not None:
+        with measureStage('hash', report_path):
+            file_hash = hashFile(report_path)
+        if file_hash in manifest["reports"] or file_hash in manifest_entries:
+            print(f'Skipping {report_path.name}, its content was already processed.')
+            return data
+
+    with measureStage('detect', report_path) as stats:
+        raw_rows = readReportRows(report_path)
+        header = next(raw_rows, None)
+        detection = detectReport(header) if header is not None else None
+        stats['rows'] = 1 if header is not None else 0
+
+    if detection is None:
+        raw_rows.close()
+        print(f'Unrecognized report format for {report_path.name}, leaving it in place.')
+        return None
+
+    if manifest is None:
+        return formatReport(data, report_path, results_dir, raw_rows, detection, output_ext)
+
+    # Journal the formatting, resuming it if an earlier run was interrupted
+    header_hash = hashRow(header)
+    progress = {}
+    state = {}
+    journal = ReportJournal(getJournalPath(results_dir, report_path, file_hash), report_path, header_hash, progress)
+    journal.resume(data, state)
+    raw_rows = skipIngestedRows(raw_rows, getIngestedReports(manifest, header_hash), progress,
+        getSkippedRowHandler(detection, state))
+    formatReport(data, report_path, results_dir, raw_rows, detection, output_ext, state, journal)
+    manifest_entries[file_hash] = journal.manifest_entry
+    return data
 
-    # Convert any .csv reports if applicable
-    convertCSVFiles(reports_path)
 
-    # Get a dictionary of all the .xlsx file paths to prep for analysis
-    xlsx_file_paths = getFilePathListDict(reports_path, ['xlsx'])
-    xlsx_file_paths_list = xlsx_file_paths["xlsx"]
+# Returns the manifest entries of the earlier reports that can overlap with a report, having the same header row
+def getIngestedReports(manifest, header_hash):
+    return [entry for entry in manifest["reports"].values() if entry["header"] == header_hash]
+
+
+# Returns the manifest entry of a report once its rows were read through skipIngestedRows
+def getManifestEntry(report_path, header_hash, progress):
+    if progress["skipped"]:
+        print(f'Skipped the first {progress["skipped"]} rows of {report_path.name}, already processed from an earlier report.')
+
+    # Record the data rows of the report (row 1 being the first row after the header) and which were ingested
+    return {
+        "name": report_path.name,
+        "header": header_hash,
+        "rows": progress["rows"],
+        "ingested": [progress["skipped"] + 1, progress["rows"]],
+        "checkpoints": progress["checkpoints"]
+    }
+
+
+# Returns the path of a report's journal in the results directory
+def getJournalPath(results_dir, report_path, file_hash):
+    return Path(results_dir) / f'{report_path.name}.{file_hash}{JOURNAL_SUFFIX}'
+
+
+# Returns the hash of the report a journal is for, from its file name
+def getJournalHash(journal_path):
+    return journal_path.name[:-len(JOURNAL_SUFFIX)].rsplit('.', 1)[1]
+
+
+# Encodes a formatter's state for a journal, keeping the order and keys of the NDAX trades still missing legs
+# The fingerprint occurrences aren't kept since they are counted again from the journaled tx_ids
+def encodeFormatterState(state):
+    encoded = {key: value for key, value in state.items() if key != 'occurrences'}
+    if 'open_trades' in state:
+        encoded['open_trades'] = list(state['open_trades'].items())
+    return encoded
+
+
+def decodeFormatterState(encoded):
+    state = dict(encoded)
+    if 'open_trades' in state:
+        state['open_trades'] = {ref_id: legs for ref_id, legs in state['open_trades']}
+    return state
+
+
+# Counts the fingerprint occurrences of journaled transactions, their tx_ids ending with their occurrence
+def countJournaledOccurrences(transactions, occurrences):
+    for tx in transactions:
+        if isinstance(tx.tx_id, str) and tx.tx_id.startswith(COINSQUARE_TX_ID_PREFIX):
+            digest, _, occurrence = tx.tx_id[len(COINSQUARE_TX_ID_PREFIX):].partition('-')
+            occurrences[digest] = max(occurrences.get(digest, 0), int(occurrence or 1))
+
+
+# Journal of a report being formatted, kept as JSON lines in the results directory until the report's transactions
+# are in the Master Ledger. Every JOURNAL_CHUNK_ROWS rows, the transactions formatted since the last commit are
+# appended along with the number of rows formatted and the formatter's state, so an interrupted report resumes from
+# its last commit instead of being formatted again from its first row. The transactions are journaled without their
+# timestamps, which are parsed from their dates again when needed. The last commit, made before the report is moved
+# next to its results file, completes the journal with the report's manifest entry
+class ReportJournal:
+    def __init__(self, journal_path, report_path=None, header_hash=None, progress=None):
+        self.path = journal_path
+        self.report_path = report_path
+        self.header_hash = header_hash
+        self.progress = progress
+        self.rows = 0
+        self.transactions = []
+        self.state = {}
+        self.results_file = None
+        self.manifest_entry = None
+        self.committed = 0
+        self.rows_read = 0
+        self.load()
+
+    # Loads the commits of an earlier run, ignoring a last line left partly written by an interruption
+    def load(self):
+        if not self.path.is_file():
+            return
+        with open(self.path, 'rt', encoding='utf8') as file:
+            for line in file:
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                if "results_file" in record:
+                    self.results_file = record["results_file"]
+                    continue
+                self.rows = record["rows"]
+                self.transactions.extend(Transaction(*row) for row in record["transactions"])
+                self.state = decodeFormatterState(record["state"])
+                self.manifest_entry = record.get("manifest_entry")
+
+    def isComplete(self):
+        return self.manifest_entry is not None
+
+    # Adds the journaled transactions to the dataset and restores the formatter's state
+    def resume(self, data, state):
+        if self.rows:
+            print(f'Resuming {self.report_path.name} after row {self.rows}, from its journal.')
+        data.extend(self.transactions)
+        state.update(self.state)
+        self.committed = len(data)
+
+    # Starts writing a new results file, replacing the partial one of an interrupted run with the journaled rows,
+    # and returns the report's rows after the last commit
+    def begin(self, raw_rows, new_file_path, write_row, data, state):
+        if self.results_file is not None and self.results_file != new_file_path.name:
+            new_file_path.with_name(self.results_file).unlink(missing_ok=True)
+        self.append({"results_file": new_file_path.name})
+        for tx in self.transactions:
+            write_row(list(tx.toRow()[:7]))
+        return self.commitRows(raw_rows, data, state)
+
+    # Streams the rows after the last commit, committing every JOURNAL_CHUNK_ROWS rows
+    def commitRows(self, raw_rows, data, state):
+        resume_rows = self.rows
+        row_count = 0
+        try:
+            for row in raw_rows:
+                row_count += 1
+                if row_count <= resume_rows:
+                    continue
+                if row_count == resume_rows + 1 and self.transactions:
+                    countJournaledOccurrences(self.transactions, state.setdefault('occurrences', {}))
+
+                # The formatter only asks for the next row once every earlier row was formatted
+                if (row_count - 1) % JOURNAL_CHUNK_ROWS == 0 and row_count - 1 > self.rows:
+                    self.commit(row_count - 1, data, state)
+                yield row
+        finally:
+            raw_rows.close()
+        self.rows_read = row_count
+
+    # Commits the last of the report's transactions, completing the journal with its manifest entry
+    def finish(self, data, state):
+        manifest_entry = getManifestEntry(self.report_path, self.header_hash, self.progress)
+        self.commit(self.rows_read, data, state, manifest_entry)
+
+    def commit(self, rows, data, state, manifest_entry=None):
+        record = {
+            "rows": rows,
+            "transactions": [tx.toRow() for tx in data[self.committed:]],
+            "state": encodeFormatterState(state)
+        }
+        if manifest_entry is not None:
+            record["manifest_entry"] = manifest_entry
+        self.append(record)
+        self.committed = len(data)
+        self.rows = rows
+        self.manifest_entry = manifest_entry
+
+    # Appends a record to the journal, only returning once it's on disk
+    def append(self, record):
+        with open(self.path, 'at', encoding='utf8') as file:
+            file.write(json.dumps(record, default=str, separators=(',', ':'), check_circular=False) + '\n')
+            file.flush()
+            os.fsync(file.fileno())
+
+
+# Recovers the reports whose journals are complete, but whose transactions may not have reached the Master Ledger
+# before an interruption, adding their transactions to data and their entries to manifest_entries. A report still
+# in the reports directory is moved next to its results file. Journals of the reports already in the manifest are
+# removed, while incomplete journals are left to resume their reports
+def recoverJournals(data, reports_path, results_dir, manifest, manifest_entries):
+    for journal_path in sorted(Path(results_dir).glob('*' + JOURNAL_SUFFIX)):
+        file_hash = getJournalHash(journal_path)
+        if file_hash in manifest["reports"]:
+            journal_path.unlink()
+            continue
+
+        journal = ReportJournal(journal_path)
+        if not journal.isComplete():
+            continue
+        print(f'Recovering {len(journal.transactions)} transactions of {journal.manifest_entry["name"]} from its journal.')
+        data.extend(journal.transactions)
+        manifest_entries[file_hash] = journal.manifest_entry
+
+        report_path = Path(reports_path) / journal.manifest_entry["name"]
+        if report_path.is_file() and hashFile(report_path) == file_hash:
+            moveRawReport(report_path, Path(results_dir) / journal.results_file)
+
+
+# Removes the journals of the reports recorded in the manifest, whose transactions are in the Master Ledger
+def clearJournals(results_dir, manifest):
+    for journal_path in Path(results_dir).glob('*' + JOURNAL_SUFFIX):
+        if getJournalHash(journal_path) in manifest["reports"]:
+            journal_path.unlink()
+
+
+# Formats a single report in a worker process, returning its transactions as a packed batch along with
+# its new manifest entries. The batch is None if the report's format isn't recognized
+def formatReportBatch(report_path, results_dir, output_ext=None, manifest=None):
+    manifest_entries = {}
+    data = formatReportData([], report_path, results_dir, output_ext, manifest, manifest_entries)
+    if data is None:
+        return None, manifest_entries
+    return packTransactions(data), manifest_entries
+
+
+# Reads a report ahead of its formatting in the I/O pipeline, returning it as a job with its detected format and
+# rows. The job has no detection if the report's format isn't recognized, and is marked as skipped if its content
+# was already processed (by an earlier run or another report of this run, whose hashes are in seen_hashes)
+def readReportJob(report_path, manifest, seen_hashes):
+    job = {"report_path": report_path, "detection": None, "skipped": False, "error": None}
+    try:
+        if manifest is not None:
+            with measureStage('hash', report_path):
+                job["file_hash"] = hashFile(report_path)
+            if job["file_hash"] in manifest["reports"] or job["file_hash"] in seen_hashes:
+                job["skipped"] = True
+                return job
+            seen_hashes.add(job["file_hash"])
+
+        with measureStage('detect', report_path) as stats:
+            raw_rows = readReportRows(report_path)
+            header = next(raw_rows, None)
+            job["detection"] = detectReport(header) if header is not None else None
+            stats['rows'] = 1 if header is not None else 0
+
+        if job["detection"] is None:
+            raw_rows.close()
+            return job
+
+        job["state"] = {}
+        if manifest is not None:
+            job["header_hash"] = hashRow(header)
+            job["progress"] = {}
+            raw_rows = skipIngestedRows(raw_rows, getIngestedReports(manifest, job["header_hash"]), job["progress"],
+                getSkippedRowHandler(job["detection"], job["state"]))
+
+        with measureStage('load', report_path, job["detection"][0]) as stats:
+            try:
+                job["rows"] = list(raw_rows)
+            finally:
+                raw_rows.close()
+            stats['rows'] = len(job["rows"])
+    except Exception as error:
+        job["error"] = error
+    return job
+
+
+# Starts the journal of a report job, which was formatted whole, replacing the journal of an interrupted run of the
+# report along with its partial results file
+def beginJobJournal(job, results_dir, new_file_path):
+    journal_path = getJournalPath(results_dir, job["report_path"], job["file_hash"])
+    earlier_results_file = ReportJournal(journal_path).results_file
+    if earlier_results_file is not None and earlier_results_file != new_file_path.name:
+        new_file_path.with_name(earlier_results_file).unlink(missing_ok=True)
+    journal_path.unlink(missing_ok=True)
+
+    journal = ReportJournal(journal_path, job["report_path"], job["header_hash"], job["progress"])
+    journal.append({"results_file": new_file_path.name})
+    journal.rows_read = job["rows_read"]
+    return journal
+
+
+# Formats the rows of a report job, returning its transactions, its formatted rows and the path of its results file
+def formatReportJob(job, results_dir, output_ext=None):
+    report_path = job["report_path"]
+    exchange, report_type, columns = job["detection"]
+    print(f'Preparing to format file at {report_path}...')
 
-    # Start a new dataset for all the transactions of the newly processed files
     data = []
+    formatted_rows = [COINTRACKER_HEADER]
+    with measureStage('format', report_path, exchange) as stats:
+        raw_rows = job.pop("rows")
+        job["rows_read"] = stats['rows'] = len(raw_rows)
+        REPORT_FORMATTERS[report_type](data, columns, raw_rows, formatted_rows.append, job["state"])
+
+    filename = generateFilename(EXCHANGE_NAMES[exchange], output_ext or report_path.suffix)
+    return data, formatted_rows, Path(results_dir) / filename
+
+
+# Writes the formatted rows of a report to its results file and moves the untouched report next to it
+# With a journal, the report's transactions are committed to it before the report is moved, and its manifest
+# entry is returned
+def saveReportResults(report_path, new_file_path, formatted_rows, journal=None, data=None, state=None):
+    with measureStage('save', report_path) as stats:
+        write_row, close_result_file = openResultWriter(new_file_path)
+        for row in formatted_rows:
+            write_row(row)
+        close_result_file()
+        if journal is not None:
+            journal.finish(data, state)
+        moveRawReport(report_path, new_file_path)
+        stats['rows'] = len(formatted_rows) - 1
+    print(f'Saved new file as {new_file_path.name}.')
+    return journal.manifest_entry if journal is not None else None
+
+
+# Formats the reports through a pipeline overlapping their I/O: a reader thread loads and parses the next reports
+# while the current one is formatted, and a pool of writer threads saves the results files. Bounded queues on both
+# sides keep at most a few reports in memory. With a manifest, each report is journaled like in formatReportFile
+# before it's moved, so an interrupted run recovers it. The reports' transactions are added to data in the order of
+# the reports, once their results are saved, and the reports that failed are returned with their error
+def formatReportsPipeline(data, report_file_paths_list, results_dir, writers, writer_threads, output_ext=None,
+                            manifest=None, manifest_entries=None, unrecognized_reports=None):
+    jobs = queue.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+    pending_writes = threading.BoundedSemaphore(PIPELINE_QUEUE_SIZE + writer_threads)
+    failed_reports = []
+    saved_jobs = []
+
+    def readReports():
+        seen_hashes = set(manifest_entries or ())
+        for report_path in report_file_paths_list:
+            jobs.put(readReportJob(report_path, manifest, seen_hashes))
+        jobs.put(None)
+
+    reader = threading.Thread(target=readReports, name='report-reader', daemon=True)
+    reader.start()
+
+    for job in iter(jobs.get, None):
+        report_path = job["report_path"]
+        if job["error"] is not None:
+            failed_reports.append((report_path, job["error"]))
+        elif job["skipped"]:
+            print(f'Skipping {report_path.name}, its content was already processed.')
+        elif job["detection"] is None:
+            print(f'Unrecognized report format for {report_path.name}, leaving it in place.')
+            if unrecognized_reports is not None:
+                unrecognized_reports.append(report_path)
+        else:
+            try:
+                job_data, formatted_rows, new_file_path = runProfiled(report_path, results_dir, formatReportJob, job,
+                    results_dir, output_ext)
+                journal = beginJobJournal(job, results_dir, new_file_path) if manifest is not None else None
+            except Exception as error:
+                failed_reports.append((report_path, error))
+                continue
 
-    for report_path in xlsx_file_paths_list:
-        exchange = getExchangeName(report_path)
-        if exchange == COINSQUARE:
-            formatCoinsquare(data, report_path, results_dir)
-        elif exchange == NDAX:
-            formatNDAX(data, report_path, results_dir)
+            # Wait for a writer if too many results are waiting to be saved
+            pending_writes.acquire()
+            future = writers.submit(saveReportResults, report_path, new_file_path, formatted_rows, journal, job_data,
+                job["state"])
+            future.add_done_callback(lambda future: pending_writes.release())
+            saved_jobs.append((job, job_data, future))
+    reader.join()
+
+    for job, job_data, future in saved_jobs:
+        try:
+            manifest_entry = future.result()
+        except Exception as error:
+            failed_reports.append((job["report_path"], error))
+            continue
+        data.extend(job_data)
+        if manifest is not None:
+            manifest_entries[job["file_hash"]] = manifest_entry
+    return failed_reports
 
-    # Update the Master Ledger with the new data
-    updateMasterLedger(data, ledger_path)
 
-    # Create a summarized import form for all new transactions to import into Cointracker
-    getCointrackerSummary(data, results_dir)
+# Main method for processing all the exchange's reports
+# With pipeline, the reports are formatted through the I/O pipeline with writer_threads saving the results files
+# The balances are reconciled against the exchange-provided balance file at balances_path, if there is one
+# With use_tx_id_index_file, an .xlsx Master Ledger's tx_id index is kept in a sidecar file between runs
+# Returns the new transactions added to the Master Ledger
+def processReports(reports_path, results_dir, ledger_path, convert_csv=False, output_ext=None, workers=1,
+                    use_manifest=True, pipeline=False, writer_threads=PIPELINE_WRITER_THREADS, balances_path=None,
+                    use_tx_id_index_file=False):
+
+    # Convert any .csv reports to .xlsx only if asked to, otherwise they are streamed directly
+    if convert_csv:
+        convertCSVFiles(reports_path)
+
+    # Load the manifest of the reports already processed into the Master Ledger
+    manifest_path = getManifestPath(ledger_path)
+    manifest = loadManifest(manifest_path) if use_manifest else None
+    manifest_entries = {}
+
+    # Start a new dataset for all the transactions of the newly processed files, recovering those of the reports
+    # formatted by an interrupted run
+    data = []
+    unrecognized_reports = []
+    writers = None
+    if manifest is not None:
+        recoverJournals(data, reports_path, results_dir, manifest, manifest_entries)
+
+    # Get a dictionary of all the .csv and .xlsx file paths to prep for analysis
+    report_file_paths = getFilePathListDict(reports_path, ['csv', 'xlsx'])
+
+    # Sort the reports so their transactions are always merged in the same order
+    report_file_paths_list = sorted(report_file_paths["csv"] + report_file_paths["xlsx"])
+
+    if workers > 1 and len(report_file_paths_list) > 1:
+        # Format the independent reports in parallel, merging their batches in the order of the reports
+        print(f'Formatting {len(report_file_paths_list)} reports with {workers} worker processes...')
+        from concurrent.futures import ProcessPoolExecutor
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            batches = executor.map(formatReportBatch, report_file_paths_list, repeat(results_dir),
+                repeat(output_ext), repeat(manifest))
+            for report_path, (batch, report_manifest_entries) in zip(report_file_paths_list, batches):
+                if batch is None:
+                    unrecognized_reports.append(report_path)
+                else:
+                    unpackTransactions(batch, data)
+                    manifest_entries.update(report_manifest_entries)
+    elif pipeline:
+        writers = ThreadPoolExecutor(max_workers=writer_threads, thread_name_prefix='result-writer')
+        failed_reports = formatReportsPipeline(data, report_file_paths_list, results_dir, writers, writer_threads,
+            output_ext, manifest, manifest_entries, unrecognized_reports)
+
+        # Report each file that failed, which is left in place to be processed again
+        if failed_reports:
+            print(f'Failed to process {len(failed_reports)} report(s):')
+            for report_path, error in failed_reports:
+                print(f'    {report_path.name}: {type(error).__name__}: {error}')
+    else:
+        for report_path in report_file_paths_list:
+            if formatReportData(data, report_path, results_dir, output_ext, manifest, manifest_entries) is None:
+                unrecognized_reports.append(report_path)
+
+    # Report any files that couldn't be processed instead of silently skipping them
+    if unrecognized_reports:
+        print(f'Skipped {len(unrecognized_reports)} report(s) with an unrecognized format: '
+            + ', '.join(report_path.name for report_path in unrecognized_reports))
+
+    # Update the Master Ledger and its balances with the new data
+    balance_index = updateMasterLedger(data, ledger_path, use_tx_id_index_file)
+
+    # Create a summarized import form for all new transactions to import into Cointracker, with the writer threads
+    # while the manifest is saved when pipelined
+    summary = writers.submit(getCointrackerSummary, data, results_dir) if writers is not None else None
+
+    # Only record the new reports in the manifest once their transactions are in the Master Ledger
+    if manifest is not None and manifest_entries:
+        manifest["reports"].update(manifest_entries)
+        saveManifest(manifest, manifest_path)
+        clearJournals(results_dir, manifest)
+
+    if summary is None:
+        getCointrackerSummary(data, results_dir)
+    else:
+        summary.result()
+        writers.shutdown()
+
+    # Reconcile the balances next to the summary
+    getReconciliationReport(balance_index, results_dir, balances_path)
+    return data
+
+
+# Returns the (mtime, size) signature of a file, or None if it no longer exists
+def getFileSignature(file_path):
+    try:
+        file_stat = os.stat(file_path)
+    except FileNotFoundError:
+        return None
+    return file_stat.st_mtime_ns, file_stat.st_size
+
+
+# Returns the signature of each report in the reports directory, skipping Excel's lock files (~$name.xlsx)
+def scanReports(reports_path):
+    report_signatures = {}
+    report_file_paths = getFilePathListDict(reports_path, ['csv', 'xlsx'])
+    for report_path in sorted(report_file_paths["csv"] + report_file_paths["xlsx"]):
+        signature = getFileSignature(report_path)
+        if signature is not None and not report_path.name.startswith('~$'):
+            report_signatures[report_path] = signature
+    return report_signatures
+
+
+# Master Ledger kept open by the watch mode, so each report is deduplicated against the tx_id index in memory
+# and written to the ledger's worksheet right away, while saving the ledger is left to flush()
+# A SQLite ledger already dedupes through its unique index, so its new transactions are only held until flush()
+class WarmLedger:
+    def __init__(self, ledger_path, use_tx_id_index_file=False):
+        self.ledger_path = ledger_path
+        self.use_tx_id_index_file = use_tx_id_index_file
+        self.pending = []
+        self.balance_index = None
+        if not isSQLiteLedger(ledger_path):
+            self.load()
+
+    # Loads the .xlsx ledger with its tx_id index and next free row
+    def load(self):
+        self.workbook, self.sheet, self.tx_id_index, self.index_path = loadXlsxLedger(self.ledger_path,
+            self.use_tx_id_index_file)
+        self.next_row = self.sheet.max_row + 1
+        self.signature = getFileSignature(self.ledger_path)
+
+    # Adds a dataset to the ledger, removing the transactions that are already in it from the dataset
+    def add(self, data):
+        data.sort(key=getTxTimestamp)
+        if not isSQLiteLedger(self.ledger_path):
+            data[:] = appendXlsxLedgerRows(self.sheet, self.tx_id_index, data, self.next_row, self.ledger_path)
+            self.next_row += len(data)
+        self.pending.extend(data)
+
+    # Saves the transactions added since the last flush to the ledger and updates its balance index, returning them
+    def flush(self):
+        flushed, self.pending = self.pending, []
+        if not flushed:
+            return flushed
+        balance_index = loadBalanceIndex(self.ledger_path)
+        if isSQLiteLedger(self.ledger_path):
+            updateSQLiteLedger(flushed, self.ledger_path)
+            self.balance_index = updateBalanceIndex(balance_index, flushed, self.ledger_path)
+            return flushed
+
+        # Reload the ledger if it was changed by something else, adding the transactions to it again
+        if getFileSignature(self.ledger_path) != self.signature:
+            print('The Master Ledger changed on disk, reloading it.')
+            self.load()
+            self.add(flushed)
+            flushed, self.pending = self.pending, []
+
+        saveXlsxLedger(self.workbook, self.sheet, self.ledger_path, self.tx_id_index, self.index_path, len(flushed))
+        self.signature = getFileSignature(self.ledger_path)
+        print(f'Saved {len(flushed)} new transactions to the Master Ledger, up to row {self.next_row - 1}.')
+        self.balance_index = updateBalanceIndex(balance_index, flushed, self.ledger_path)
+        return flushed
+
+
+# Saves the watched reports' new transactions to the Master Ledger, then records the reports in the manifest and
+# writes the Cointracker summary of the transactions and the reconciliation of the balances
+def flushWatchedReports(ledger, results_dir, manifest, manifest_entries, manifest_path, balances_path=None):
+    flushed = ledger.flush()
+
+    if manifest is not None and manifest_entries:
+        manifest["reports"].update(manifest_entries)
+        manifest_entries.clear()
+        saveManifest(manifest, manifest_path)
+        clearJournals(results_dir, manifest)
+
+    if flushed:
+        getCointrackerSummary(flushed, results_dir)
+        getReconciliationReport(ledger.balance_index, results_dir, balances_path)
+
+
+# Watches the reports directory, formatting each new report once its mtime and size are unchanged since the
+# previous poll and it wasn't modified for settle_seconds, then flushing the new transactions to the Master Ledger at most flush_seconds after they arrive
+# Runs until interrupted (Ctrl+C), or for max_polls polls, always flushing before it returns
+def watchReports(reports_path, results_dir, ledger_path, output_ext=None, use_manifest=True,
+                    poll_seconds=WATCH_POLL_SECONDS, settle_seconds=WATCH_SETTLE_SECONDS,
+                    flush_seconds=LEDGER_FLUSH_SECONDS, max_polls=None, balances_path=None,
+                    use_tx_id_index_file=False):
+    manifest_path = getManifestPath(ledger_path)
+    manifest = loadManifest(manifest_path) if use_manifest else None
+    manifest_entries = {}
+
+    ledger = WarmLedger(ledger_path, use_tx_id_index_file)
+    last_signatures = {}
+    # Reports left in place (unrecognized, already processed or failed) aren't retried until they change
+    ignored_reports = {}
+    pending_since = None
+    polls = 0
+
+    # Recover the reports formatted by an interrupted run
+    if manifest is not None:
+        recovered = []
+        recoverJournals(recovered, reports_path, results_dir, manifest, manifest_entries)
+        ledger.add(recovered)
+        if manifest_entries:
+            pending_since = time.monotonic()
+
+    print(f'Watching {reports_path} for new reports every {poll_seconds}s, press Ctrl+C to stop.')
+    try:
+        while max_polls is None or polls < max_polls:
+            signatures = scanReports(reports_path)
+            ignored_reports = {path: sig for path, sig in ignored_reports.items() if path in signatures}
+
+            for report_path, signature in signatures.items():
+                # Wait for the report to be completely written before processing it
+                if last_signatures.get(report_path) != signature or ignored_reports.get(report_path) == signature:
+                    continue
+                if time.time_ns() - signature[0] < settle_seconds * 1e9:
+                    continue
+
+                data = []
+                try:
+                    formatReportData(data, report_path, results_dir, output_ext, manifest, manifest_entries)
+                except Exception as error:
+                    print(f'Error formatting {report_path.name}: {error}')
+                    data = []
+
+                if report_path.exists():
+                    ignored_reports[report_path] = signature
+                ledger.add(data)
+                if pending_since is None and (data or manifest_entries):
+                    pending_since = time.monotonic()
+
+            last_signatures = signatures
+            polls += 1
+
+            if pending_since is not None and time.monotonic() - pending_since >= flush_seconds:
+                flushWatchedReports(ledger, results_dir, manifest, manifest_entries, manifest_path, balances_path)
+                pending_since = None
+
+            if max_polls is None or polls < max_polls:
+                time.sleep(poll_seconds)
+    except KeyboardInterrupt:
+        print('Stopped watching for new reports.')
+    finally:
+        if pending_since is not None:
+            flushWatchedReports(ledger, results_dir, manifest, manifest_entries, manifest_path, balances_path)
 
 
 # Initialize the directory structure and create a Master Ledger
@@ -662,21 +3087,198 @@ def init(reports_path, results_path, ledger_path):
     createMasterLedger(ledger_path)
 
 
-# Main crypto directory, which will also store the Master Ledger
-crypto_dir = 'C:\\Users\\michael chaplin\\OneDrive - MDS Aero Support\\Documents\\Python\\Crypto\\'
-ledger_dir = crypto_dir + 'Master_Ledger.xlsx'
-ledger_path = Path(ledger_dir)
+# Returns the key of a Master Ledger's lock, the same for every path to the same file
+def getLedgerLockKey(ledger_path):
+    return os.path.normcase(os.path.realpath(ledger_path))
+
+
+# Initializes an account's crypto directory and processes its reports while holding its Master Ledger's lock,
+# returning the account's stats. Any error is recorded in the stats so the other accounts keep going
+# Crypto to crypto trades are valued with the prices in prices_dir, or else in the account's own prices directory
+def processAccount(crypto_dir, ledger_lock, options, prices_dir=None):
+    crypto_dir = Path(crypto_dir)
+    configurePrices(prices_dir or crypto_dir / PRICES_DIRNAME)
+    ledger_path = crypto_dir / LEDGER_FILENAME
+    reports_path = crypto_dir / REPORTS_DIRNAME
+    results_path = crypto_dir / RESULTS_DIRNAME
+    stats = {"account": str(crypto_dir), "reports": 0, "transactions": 0, "seconds": 0.0, "wait_seconds": 0.0,
+        "error": None}
+
+    start = time.perf_counter()
+    try:
+        with ledger_lock:
+            stats["wait_seconds"] = time.perf_counter() - start
+            init(reports_path, results_path, ledger_path)
+            report_file_paths = getFilePathListDict(reports_path, ['csv', 'xlsx'])
+            stats["reports"] = len(report_file_paths["csv"]) + len(report_file_paths["xlsx"])
+            stats["transactions"] = len(processReports(reports_path, results_path, ledger_path,
+                balances_path=crypto_dir / BALANCES_FILENAME, **options))
+    except Exception as error:
+        stats["error"] = f'{type(error).__name__}: {error}'
+    stats["seconds"] = time.perf_counter() - start
+    return stats
+
+
+# Processes many accounts' crypto directories on one shared pool of worker processes, which only pay the startup
+# and import costs once. Accounts sharing a Master Ledger take turns through a lock per ledger, so a ledger is never
+# written by two jobs at once. Prints and returns the stats of each account
+def processAccounts(crypto_dirs, workers=1, prices_dir=None, **options):
+    start = time.perf_counter()
+    crypto_dirs = [Path(crypto_dir) for crypto_dir in crypto_dirs]
+
+    if workers <= 1 or len(crypto_dirs) <= 1:
+        ledger_lock = threading.Lock()
+        account_stats = [processAccount(crypto_dir, ledger_lock, options, prices_dir) for crypto_dir in crypto_dirs]
+    else:
+        import multiprocessing
+        from concurrent.futures import ProcessPoolExecutor
+
+        # The locks are shared with the worker processes through a manager process
+        with multiprocessing.Manager() as manager, ProcessPoolExecutor(max_workers=workers) as executor:
+            ledger_locks = {}
+            jobs = []
+            for crypto_dir in crypto_dirs:
+                lock_key = getLedgerLockKey(crypto_dir / LEDGER_FILENAME)
+                if lock_key not in ledger_locks:
+                    ledger_locks[lock_key] = manager.Lock()
+                jobs.append(executor.submit(processAccount, crypto_dir, ledger_locks[lock_key], options, prices_dir))
+            account_stats = [job.result() for job in jobs]
+
+    printAccountsSummary(account_stats, time.perf_counter() - start)
+    return account_stats
+
+
+# Prints the consolidated throughput of each account processed in a batch, and of the whole batch
+def printAccountsSummary(account_stats, total_seconds):
+    print(f'\n{"Account":<40}{"Reports":>8}{"New Tx":>9}{"Seconds":>9}{"Tx/s":>10}{"Waited":>8}  Status')
+    for stats in account_stats:
+        tx_per_second = stats["transactions"] / stats["seconds"] if stats["seconds"] > 0 else 0
+        print(f'{stats["account"][-40:]:<40}{stats["reports"]:>8}{stats["transactions"]:>9}{stats["seconds"]:>9.2f}'
+            f'{tx_per_second:>10.1f}{stats["wait_seconds"]:>8.2f}  {stats["error"] or "OK"}')
+
+    total_reports = sum(stats["reports"] for stats in account_stats)
+    total_tx = sum(stats["transactions"] for stats in account_stats)
+    failed = sum(1 for stats in account_stats if stats["error"])
+    total_tx_per_second = total_tx / total_seconds if total_seconds > 0 else 0
+    print(f'Processed {len(account_stats)} accounts ({failed} failed) with {total_reports} reports and {total_tx} '
+        f'new transactions in {total_seconds:.2f}s ({total_tx_per_second:.1f} tx/s).')
+
+
+# Parses the command line for the crypto directories, then formats all of the exchange's reports
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Formats crypto exchange reports into the Cointracker format.')
+    parser.add_argument('crypto_dir', nargs='?', type=Path, default=Path.cwd(),
+        help='main crypto directory, which also stores the Master Ledger (default: the current directory)')
+    parser.add_argument('--ledger', type=Path,
+        help=f'Master Ledger file, which is a SQLite database if it ends in .db (default: crypto_dir/{LEDGER_FILENAME})')
+    parser.add_argument('--reports-dir', type=Path,
+        help=f"directory of the exchange's reports (default: crypto_dir/{REPORTS_DIRNAME})")
+    parser.add_argument('--results-dir', type=Path,
+        help=f'directory to store the formatted result files (default: crypto_dir/{RESULTS_DIRNAME})')
+    parser.add_argument('--convert-csv', action='store_true', help='convert the .csv reports to .xlsx first')
+    parser.add_argument('--output-ext', choices=['.csv', '.xlsx'],
+        help="file type of the formatted result files (default: the report's own)")
+    parser.add_argument('--workers', type=int, default=1, help='number of processes formatting the reports')
+    parser.add_argument('--pipeline', action='store_true',
+        help='overlap reading, formatting and saving the reports with background threads')
+    parser.add_argument('--writer-threads', type=int, default=PIPELINE_WRITER_THREADS,
+        help='number of threads saving the results files with --pipeline')
+    parser.add_argument('--tx-id-index', action='store_true',
+        help=f"keep an .xlsx Master Ledger's tx_id index in a sidecar file (*{TX_ID_INDEX_SUFFIX}) so it isn't "
+            f"rebuilt from the ledger on every run")
+    parser.add_argument('--no-manifest', action='store_true', help='process every report, even the ones already processed')
+    parser.add_argument('--watch', action='store_true',
+        help='keep running, processing each new report as soon as it is completely written')
+    parser.add_argument('--poll-seconds', type=float, default=WATCH_POLL_SECONDS,
+        help='seconds between each poll of the reports directory in watch mode')
+    parser.add_argument('--settle-seconds', type=float, default=WATCH_SETTLE_SECONDS,
+        help='seconds a report must go unmodified before it is processed in watch mode')
+    parser.add_argument('--flush-seconds', type=float, default=LEDGER_FLUSH_SECONDS,
+        help='longest time new transactions are held before being saved to the Master Ledger in watch mode')
+    export_group = parser.add_argument_group('windowed exports',
+        'Only a .db Master Ledger answers these exports from its date indexes, an .xlsx Master Ledger is read whole '
+        'and sorted on every export')
+    export_group.add_argument('--export-from', type=datetime.fromisoformat, metavar='DATE',
+        help="only export the Master Ledger's transactions from this date to a Cointracker import file")
+    export_group.add_argument('--export-to', type=datetime.fromisoformat, metavar='DATE',
+        help="only export the Master Ledger's transactions before this date to a Cointracker import file")
+    export_group.add_argument('--tax-year', type=int, help="only export the Master Ledger's transactions of a year")
+    export_group.add_argument('--exchange', choices=list(EXCHANGE_NAMES.values()), help='only export this exchange')
+    parser.add_argument('--export-xlsx', type=Path, metavar='PATH',
+        help='export a .db Master Ledger to an .xlsx Master Ledger at PATH instead of processing the reports')
+    parser.add_argument('--positions', action='store_true',
+        help='update the running positions and ACB from the Master Ledger and write them to a Positions file')
+    parser.add_argument('--fifo', action='store_true', help='also track the FIFO lots of the positions')
+    parser.add_argument('--prices-dir', type=Path,
+        help=f'directory of the daily or hourly price files (ie. ETH-BTC.csv) valuing crypto to crypto trades in CAD '
+            f'(default: crypto_dir/{PRICES_DIRNAME})')
+    parser.add_argument('--balances', type=Path,
+        help=f'exchange-provided balance file (exchange, currency, balance columns) to reconcile the Master Ledger '
+            f'against (default: crypto_dir/{BALANCES_FILENAME})')
+    parser.add_argument('--accounts', type=Path, nargs='+', metavar='CRYPTO_DIR',
+        help='process the crypto directories of many accounts in a batch, on --workers processes, each with the '
+            'default layout of its crypto_dir')
+    parser.add_argument('--metrics', help='JSON lines file to write the metrics of each stage to, or - for stderr')
+    parser.add_argument('--profile', metavar='REPORT', help='name of a report file to format under cProfile')
+    args = parser.parse_args(argv)
+
+    # Each account of a batch keeps its Master Ledger, reports, results and balances in its own crypto directory
+    if args.accounts:
+        for option, value in (('--ledger', args.ledger), ('--reports-dir', args.reports_dir),
+                ('--results-dir', args.results_dir), ('--balances', args.balances)):
+            if value is not None:
+                parser.error(f'{option} cannot be used with --accounts, each account uses the files of its crypto_dir')
+
+        # A batch only processes the reports of each account, so it would silently skip these
+        for option, value in (('--watch', args.watch), ('--positions', args.positions), ('--fifo', args.fifo),
+                ('--export-from', args.export_from), ('--export-to', args.export_to),
+                ('--tax-year', args.tax_year), ('--exchange', args.exchange), ('--export-xlsx', args.export_xlsx)):
+            if value not in (None, False):
+                parser.error(f'{option} cannot be used with --accounts, which only processes the reports of each '
+                    f'account')
+
+    ledger_path = args.ledger or args.crypto_dir / LEDGER_FILENAME
+    balances_path = args.balances or args.crypto_dir / BALANCES_FILENAME
+    reports_path = args.reports_dir or args.crypto_dir / REPORTS_DIRNAME
+    results_path = args.results_dir or args.crypto_dir / RESULTS_DIRNAME
+    if args.export_xlsx is not None and not isSQLiteLedger(ledger_path):
+        parser.error(f'--export-xlsx needs a .db Master Ledger, not {ledger_path.name}')
+    configureInstrumentation(args.metrics, args.profile)
+    configurePrices(args.prices_dir or args.crypto_dir / PRICES_DIRNAME)
+
+    # Process many accounts in a batch sharing the worker processes
+    if args.accounts:
+        processAccounts(args.accounts, args.workers, args.prices_dir, convert_csv=args.convert_csv, output_ext=args.output_ext,
+            use_manifest=not args.no_manifest, pipeline=args.pipeline, writer_threads=args.writer_threads,
+            use_tx_id_index_file=args.tx_id_index)
+        return
 
-# Directory to store the exchange's reports 
-reports_dir = crypto_dir + 'Reports\\'
-reports_path = Path(reports_dir)
+    # Initialize the directory and Master Ledger
+    init(reports_path, results_path, ledger_path)
+
+    # Export the SQLite Master Ledger to the .xlsx layout, or a window of it, instead of processing the reports
+    if args.tax_year is not None:
+        args.export_from = datetime(args.tax_year, 1, 1)
+        args.export_to = datetime(args.tax_year + 1, 1, 1)
+    if args.export_xlsx is not None:
+        exportLedgerToXlsx(ledger_path, args.export_xlsx)
+    elif args.export_from or args.export_to or args.exchange:
+        exportCointrackerWindow(ledger_path, results_path, args.export_from, args.export_to, args.exchange)
+
+    # Process each of the exchange's reports, or keep processing them as they arrive
+    elif args.watch:
+        watchReports(reports_path, results_path, ledger_path, args.output_ext, not args.no_manifest,
+            args.poll_seconds, args.settle_seconds, args.flush_seconds, balances_path=balances_path,
+            use_tx_id_index_file=args.tx_id_index)
+    else:
+        processReports(reports_path, results_path, ledger_path, args.convert_csv, args.output_ext, args.workers,
+            not args.no_manifest, args.pipeline, args.writer_threads, balances_path, args.tx_id_index)
 
-# Directory to store the formatted result files
-results_dir = crypto_dir + 'Results\\'
-results_path = Path(results_dir)
+    # Bring the positions up to date with the Master Ledger
+    if args.positions and not args.watch:
+        getPositionsSummary(updatePositions(ledger_path, args.fifo), results_path)
 
-# Initialize the directory and Master Ledger
-init(reports_path, results_path, ledger_path)
 
-# Process each of the exchange's reports
-processReports(reports_path, results_dir, ledger_path)
+# Only run when executed as a script, since worker processes import this module
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,186 @@
+import argparse
+import csv
+import random
+import openpyxl
+from pathlib import Path
+from datetime import date, timedelta
+
+# Report types that can be generated, named the same as their formatCointracker counterparts
+FUND_AND_WITHDRAW = 'fund_and_withdraw'
+QUICK_TRADE = 'quick_trade'
+TRANSACTIONS = 'ndax_transactions'
+REPORT_TYPES = [FUND_AND_WITHDRAW, QUICK_TRADE, TRANSACTIONS]
+
+# Header rows of each report type, as exported by the exchanges
+FUND_AND_WITHDRAW_HEADER = ['date', 'description', 'action', 'amount', 'currency', 'balance', 'btid']
+QUICK_TRADE_HEADER = ['date', 'from_currency', 'from_amount', 'to_currency', 'to_amount']
+NDAX_HEADER = ['txid', 'ref_id', 'date', 'time', 'type', 'product', 'product_type', 'amount']
+
+# Default number of rows and file types of the generated reports
+DEFAULT_ROW_COUNTS = [1000, 100000, 1000000]
+DEFAULT_FILE_EXTS = ['.csv', '.xlsx']
+
+# First day of the generated transactions, which span about 3 years
+START_DATE = date(2019, 1, 1)
+DATE_SPAN_DAYS = 1095
+
+# Currencies traded and their typical price range in CAD
+CRYPTO_PRICES = {'BTC': (4000, 80000), 'ETH': (150, 5500), 'DOGE': (0.002, 0.9)}
+
+# Share of NDAX report entries that are 3 row trades and deposits, the rest being affiliate payouts
+NDAX_TRADE_SHARE = .8
+NDAX_DEPOSIT_SHARE = .15
+
+# Default seed so the same reports are generated on every run
+DEFAULT_SEED = 2021
+
+
+# Returns a random date within the generated span
+def randomDate(rng):
+    return START_DATE + timedelta(days=rng.randrange(DATE_SPAN_DAYS))
+
+
+# Returns a random crypto currency and an amount of it worth about cad_amount
+def randomCryptoAmount(rng, cad_amount):
+    currency = rng.choice(list(CRYPTO_PRICES))
+    low_price, high_price = CRYPTO_PRICES[currency]
+    return currency, cad_amount / rng.uniform(low_price, high_price)
+
+
+# Generates the rows of a Coinsquare FUND_AND_WITHDRAW report
+def generateFundAndWithdrawRows(num_rows, rng):
+    yield FUND_AND_WITHDRAW_HEADER
+    for btid in range(num_rows):
+        tx_date = randomDate(rng).strftime('%d-%m-%y')
+        cad_amount = rng.uniform(20, 5000)
+
+        # Mostly fiat deposits, with some crypto deposits and withdrawals
+        if rng.random() < .6:
+            action, currency, amount = 'credit', 'CAD', cad_amount
+        else:
+            action = rng.choice(['credit', 'debit'])
+            currency, amount = randomCryptoAmount(rng, cad_amount)
+
+        description = 'Deposit' if action == 'credit' else 'Withdrawal'
+        yield [tx_date, description, action, f'{amount:,.8f}', currency, f'{rng.uniform(0, 10000):.8f}',
+            str(1000000 + btid)]
+
+
+# Generates the rows of a Coinsquare QUICK_TRADE report
+def generateQuickTradeRows(num_rows, rng):
+    yield QUICK_TRADE_HEADER
+    for _ in range(num_rows):
+        tx_date = randomDate(rng).strftime('%d-%m-%y')
+        cad_amount = rng.uniform(10, 5000)
+        currency, crypto_amount = randomCryptoAmount(rng, cad_amount)
+
+        # Buys and sells of crypto with CAD
+        if rng.random() < .5:
+            yield [tx_date, 'CAD', f'{cad_amount:,.2f}', currency, f'{crypto_amount:.8f}']
+        else:
+            yield [tx_date, currency, f'{crypto_amount:.8f}', 'CAD', f'{cad_amount:,.2f}']
+
+
+# Returns the legs of an NDAX trade as (currency, amount) in the order they happen: received, sent, then fee
+def getNDAXTradeLegs(rng):
+    cad_amount = round(rng.uniform(10, 5000), 2)
+    currency, crypto_amount = randomCryptoAmount(rng, cad_amount)
+    crypto_amount = round(crypto_amount, 8)
+
+    # Buys pay the fee in the crypto received, sells pay it in the CAD received
+    if rng.random() < .5:
+        return [(currency, crypto_amount), ('CAD', -cad_amount), (currency, -round(crypto_amount * .002, 8))]
+    return [('CAD', cad_amount), (currency, -crypto_amount), ('CAD', -round(cad_amount * .002, 2))]
+
+
+# Generates the rows of an NDAX transactions report, made of 3 row Trade groups, Deposits and Affiliate Payouts
+def generateNDAXRows(num_rows, rng):
+    entries = []
+    tx_id = 10000000
+    ref_id = 50000000
+    num_generated = 0
+
+    while num_generated < num_rows:
+        tx_date = randomDate(rng).isoformat()
+        tx_time = f'{rng.randint(1, 12)}:{rng.randint(0, 59):02d} {rng.choice(["AM", "PM"])}'
+        ref_id += 1
+        entry_type = rng.random()
+
+        # Trades are only generated if all 3 of their rows fit in the report
+        if entry_type < NDAX_TRADE_SHARE and num_rows - num_generated >= 3:
+            legs = [('Trade', currency, amount) for currency, amount in getNDAXTradeLegs(rng)]
+        elif entry_type < NDAX_TRADE_SHARE + NDAX_DEPOSIT_SHARE:
+            legs = [('Deposit', 'CAD', round(rng.uniform(20, 5000), 2))]
+        else:
+            legs = [('Affiliate Payout', 'BTC', round(rng.uniform(.00001, .001), 8))]
+
+        for tx_type, currency, amount in legs:
+            tx_id += 1
+            product_type = 'NationalCurrency' if currency == 'CAD' else 'CryptoCurrency'
+            entries.append([str(tx_id), str(ref_id), tx_date, tx_time, tx_type, currency, product_type, str(amount)])
+            num_generated += 1
+
+    # NDAX lists the newest transactions first
+    yield NDAX_HEADER
+    yield from reversed(entries)
+
+
+# Generators of the rows of each report type
+REPORT_GENERATORS = {
+    FUND_AND_WITHDRAW: generateFundAndWithdrawRows,
+    QUICK_TRADE: generateQuickTradeRows,
+    TRANSACTIONS: generateNDAXRows
+}
+
+
+# Writes rows to a .csv report
+def writeCSVReport(report_path, rows):
+    with open(report_path, 'w', encoding='utf8', newline='') as file:
+        csv.writer(file).writerows(rows)
+
+
+# Writes rows to an .xlsx report, streaming them through a write-only workbook
+def writeXlsxReport(report_path, rows):
+    workbook = openpyxl.Workbook(write_only=True)
+    worksheet = workbook.create_sheet(title="Transactions")
+    for row in rows:
+        worksheet.append(row)
+    workbook.save(report_path)
+
+
+# Generates a report of a given type, row count and file type, returning its path
+def generateReport(report_type, num_rows, report_dir, file_ext='.csv', seed=DEFAULT_SEED):
+    rng = random.Random(f'{seed}-{report_type}-{num_rows}')
+    rows = REPORT_GENERATORS[report_type](num_rows, rng)
+
+    report_path = Path(report_dir) / f'{report_type}_{num_rows}{file_ext}'
+    if file_ext == '.xlsx':
+        writeXlsxReport(report_path, rows)
+    else:
+        writeCSVReport(report_path, rows)
+    return report_path
+
+
+# Generates the requested reports into the output directory
+def main():
+    parser = argparse.ArgumentParser(description='Generate synthetic Coinsquare and NDAX reports.')
+    parser.add_argument('output_dir', type=Path, help='directory to write the reports to')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROW_COUNTS,
+        help='row counts of the reports to generate')
+    parser.add_argument('--types', nargs='+', choices=REPORT_TYPES, default=REPORT_TYPES,
+        help='report types to generate')
+    parser.add_argument('--formats', nargs='+', choices=DEFAULT_FILE_EXTS, default=DEFAULT_FILE_EXTS,
+        help='file types of the reports to generate')
+    parser.add_argument('--seed', type=int, default=DEFAULT_SEED, help='seed of the random generators')
+    args = parser.parse_args()
+
+    args.output_dir.mkdir(parents=True, exist_ok=True)
+    for num_rows in args.rows:
+        for report_type in args.types:
+            for file_ext in args.formats:
+                report_path = generateReport(report_type, num_rows, args.output_dir, file_ext, args.seed)
+                print(f'Generated {report_path}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# The scripts live at the root of the repo, so make them importable from the tests
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
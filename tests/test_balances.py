@@ -0,0 +1,114 @@
+import contextlib
+import csv
+import io
+import shutil
+
+import pytest
+
+import formatCointracker as fc
+from generateReports import REPORT_TYPES, generateReport
+
+NUM_ROWS = 300
+
+
+# Returns a Master Ledger transaction on an exchange with only the fields the balances use
+def makeTx(date, received_qty, received_currency, sent_qty=None, sent_currency=None, fee_amount=None,
+            fee_currency=None, tx_id=None, exchange='NDAX'):
+    return fc.Transaction(date, received_qty, received_currency, sent_qty, sent_currency, fee_amount, fee_currency,
+        None, None, exchange, tx_id)
+
+
+# Returns the rows of a csv file
+def readCSVRows(file_path):
+    with open(file_path, newline='') as file:
+        return list(csv.reader(file))
+
+
+# Writes the reconciliation file of a balance index, returning its rows
+def reconcile(balance_index, results_path, balances_path=None):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.getReconciliationReport(balance_index, results_path, balances_path)
+    (reconciliation_path,) = results_path.glob('Reconciliation_*.csv')
+    return readCSVRows(reconciliation_path)
+
+
+# Processes the reports directory into the SQLite Master Ledger, returning its balance index as saved
+def processBalances(crypto_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.processReports(crypto_dir / 'Reports', crypto_dir / 'Results', crypto_dir / 'ledger.db')
+    return fc.loadBalanceIndex(crypto_dir / 'ledger.db')
+
+
+@pytest.fixture
+def crypto_dir(tmp_path, monkeypatch):
+    monkeypatch.delenv(fc.PRICES_ENV_VAR, raising=False)
+    crypto_dir = tmp_path / 'crypto'
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.init(crypto_dir / 'Reports', crypto_dir / 'Results', crypto_dir / 'ledger.db')
+    return crypto_dir
+
+
+def test_withdrawal_fee_and_first_negative(tmp_path):
+    balance_index = fc.BalanceIndex()
+    for tx in [
+        makeTx('02/01/2021 12:00:00', 1.0, 'BTC', 40000.0, 'CAD', 0.002, 'BTC', tx_id='1'),
+        # A withdrawal's quantity already includes its fee
+        makeTx('02/02/2021 12:00:00', 0.5, 'BTC', 0.5, 'BTC', 0.0005, 'BTC', tx_id='2'),
+        makeTx('02/03/2021 12:00:00', 100.0, 'CAD', tx_id='3'),
+    ]:
+        balance_index.apply(tx)
+
+    assert balance_index.balances[('NDAX', 'BTC')] == fc.parseAmount('0.498', 'BTC', fc.BALANCE_DECIMALS)
+    assert balance_index.negatives == {('NDAX', 'CAD'): ('02/01/2021 12:00:00', '1')}
+    assert balance_index.count == 3
+
+    # A backdated transaction taking the balance below zero again is the earliest one to have
+    balance_index.apply(makeTx('02/04/2021 12:00:00', 40000.0, 'CAD', tx_id='4'))
+    balance_index.apply(makeTx('01/31/2021 12:00:00', None, None, 1000.0, 'CAD', tx_id='5'))
+    assert balance_index.negatives == {('NDAX', 'CAD'): ('01/31/2021 12:00:00', '5')}
+
+
+def test_reconciliation_report_flags_negative_and_mismatched_balances(tmp_path):
+    balance_index = fc.BalanceIndex()
+    balance_index.apply(makeTx('02/01/2021 12:00:00', 1.0, 'BTC', 40000.0, 'CAD', tx_id='1'))
+    balance_index.apply(makeTx('02/02/2021 12:00:00', 50000.0, 'CAD', tx_id='2'))
+    balance_index.apply(makeTx('02/03/2021 12:00:00', 0.25, 'ETH', tx_id='3'))
+
+    balances_path = tmp_path / 'Balances.csv'
+    balances_path.write_text('exchange,currency,balance\nNDAX,BTC,1.00000000\nNDAX,ETH,0.2\nNDAX,DOGE,5\n')
+
+    assert reconcile(balance_index, tmp_path, balances_path) == [
+        ['Exchange', 'Currency', 'Ledger Balance', 'Exchange Balance', 'Difference', 'Status', 'Went Negative On',
+            'Negative Tx_Id'],
+        ['NDAX', 'BTC', '1.0', '1.0', '0.0', 'OK', '', ''],
+        ['NDAX', 'CAD', '10000.0', '', '', 'NEGATIVE', '02/01/2021 12:00:00', '1'],
+        ['NDAX', 'DOGE', '0.0', '5.0', '-5.0', 'MISMATCH', '', ''],
+        ['NDAX', 'ETH', '0.25', '0.2', '0.05', 'MISMATCH', '', ''],
+    ]
+
+
+def test_rerun_reconciles_like_the_run_that_built_the_index(crypto_dir):
+    for report_type in REPORT_TYPES:
+        generateReport(report_type, NUM_ROWS, crypto_dir / 'Reports')
+
+    # A run without new reports reloads the saved index, which must reconcile the same
+    processBalances(crypto_dir)
+    processBalances(crypto_dir)
+    first_rows, rerun_rows = map(readCSVRows, sorted((crypto_dir / 'Results').glob('Reconciliation_*.csv')))
+    assert any(row[6] for row in first_rows[1:])
+    assert rerun_rows == first_rows
+
+
+def test_incremental_index_matches_a_rebuild(crypto_dir, tmp_path):
+    generated_dir = tmp_path / 'generated'
+    generated_dir.mkdir()
+    report_paths = [generateReport(report_type, NUM_ROWS, generated_dir) for report_type in REPORT_TYPES]
+
+    for report_path in report_paths:
+        shutil.copy(report_path, crypto_dir / 'Reports' / report_path.name)
+        balance_index = processBalances(crypto_dir)
+
+    with contextlib.redirect_stdout(io.StringIO()):
+        rebuilt_index = fc.updateBalanceIndex(None, [], crypto_dir / 'ledger.db')
+    assert balance_index.balances == rebuilt_index.balances
+    assert balance_index.count == rebuilt_index.count
@@ -0,0 +1,51 @@
+import contextlib
+import io
+
+import pytest
+
+import formatCointracker as fc
+from generateReports import REPORT_TYPES, generateReport
+
+NUM_ROWS = 200
+
+
+@pytest.mark.parametrize('options', [
+    ['--ledger', 'ledger.db'],
+    ['--balances', 'Balances.csv'],
+    ['--watch'],
+    ['--positions'],
+    ['--fifo'],
+    ['--export-from', '2021-01-01'],
+    ['--export-to', '2022-01-01'],
+    ['--tax-year', '2021'],
+    ['--exchange', 'NDAX'],
+    ['--export-xlsx', 'ledger.xlsx'],
+])
+def test_accounts_rejects_the_options_it_would_ignore(tmp_path, options, capsys):
+    with pytest.raises(SystemExit) as error:
+        fc.main(['--accounts', str(tmp_path / 'account')] + options)
+    assert error.value.code == 2
+    assert f'{options[0]} cannot be used with --accounts' in capsys.readouterr().err
+
+
+def test_export_xlsx_round_trips_the_sqlite_ledger(tmp_path, monkeypatch):
+    monkeypatch.delenv(fc.PRICES_ENV_VAR, raising=False)
+    crypto_dir = tmp_path / 'crypto'
+    ledger_path = crypto_dir / 'ledger.db'
+    xlsx_path = tmp_path / 'ledger.xlsx'
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.init(crypto_dir / 'Reports', crypto_dir / 'Results', ledger_path)
+        for report_type in REPORT_TYPES:
+            generateReport(report_type, NUM_ROWS, crypto_dir / 'Reports')
+        fc.main([str(crypto_dir), '--ledger', str(ledger_path)])
+        fc.main([str(crypto_dir), '--ledger', str(ledger_path), '--export-xlsx', str(xlsx_path)])
+
+    expected = [tx.toRow() for tx in fc.queryLedger(ledger_path)]
+    assert len(expected) > 0
+    assert [tx.toRow() for tx in fc.queryLedger(xlsx_path)] == expected
+
+
+def test_export_xlsx_needs_a_sqlite_ledger(tmp_path, capsys):
+    with pytest.raises(SystemExit):
+        fc.main([str(tmp_path), '--ledger', str(tmp_path / 'ledger.xlsx'), '--export-xlsx', str(tmp_path / 'out.xlsx')])
+    assert '--export-xlsx needs a .db Master Ledger' in capsys.readouterr().err
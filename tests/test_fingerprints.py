@@ -0,0 +1,140 @@
+import contextlib
+import csv
+import io
+import os
+
+import pytest
+
+import formatCointracker as fc
+from generateReports import FUND_AND_WITHDRAW_HEADER, QUICK_TRADE_HEADER, writeXlsxReport
+
+FUND_AND_WITHDRAW_ROWS = [
+    ['01-02-21', 'Deposit', 'credit', '1,000.50', 'CAD', '1000.50', '1000001'],
+    ['02-02-21', 'Withdrawal', 'debit', '0.25000000', 'BTC', '0', '1000002'],
+    ['03-02-21', 'Deposit', 'credit', '12,345.00', 'CAD', '13345.50', '1000003'],
+]
+
+QUICK_TRADE_ROWS = [
+    ['01-02-21', 'CAD', '1,000.50', 'BTC', '0.02500000'],
+    ['02-02-21', 'ETH', '1.50000000', 'CAD', '2,250.00'],
+    ['03-02-21', 'BTC', '0.10000000', 'ETH', '2.75000000'],
+]
+
+
+# Returns the rows with their amounts formatted differently, as another export of the same report could write them
+def reformatAmounts(rows, amount_cols):
+    reformatted = []
+    for row in rows:
+        row = list(row)
+        for col in amount_cols:
+            row[col] = repr(float(row[col].replace(',', '')))
+        reformatted.append(row)
+    return reformatted
+
+
+# Formats report rows with a formatter, returning the tx_ids of its transactions
+def formatTxIDs(formatter, columns, rows):
+    data = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        formatter(data, dict(columns), iter(rows), lambda row: None, {})
+    return [tx.tx_id for tx in data]
+
+
+# Formats a report file through its detected formatter, returning the tx_ids of its transactions
+def formatReportTxIDs(report_path):
+    raw_rows = fc.readReportRows(report_path)
+    exchange, report_type, columns = fc.detectReport(next(raw_rows))
+    return formatTxIDs(fc.REPORT_FORMATTERS[report_type], columns, raw_rows)
+
+
+def writeCSVReport(report_path, rows):
+    with open(report_path, 'w', encoding='utf8', newline='') as file:
+        csv.writer(file).writerows(rows)
+    return report_path
+
+
+FORMATTERS = [
+    (fc.formatFundAndWithdrawReport, fc.FUND_AND_WITHDRAW_COLUMNS, FUND_AND_WITHDRAW_ROWS, [3]),
+    (fc.formatQuickTradeRows, fc.QUICK_TRADE_COLUMNS, QUICK_TRADE_ROWS, [2, 4]),
+    (fc.formatQuickTradeReport, fc.QUICK_TRADE_COLUMNS, QUICK_TRADE_ROWS, [2, 4]),
+]
+
+
+@pytest.mark.parametrize('formatter, columns, rows, amount_cols', FORMATTERS)
+def test_ids_ignore_amount_formatting(formatter, columns, rows, amount_cols):
+    reformatted = reformatAmounts(rows, amount_cols)
+    assert reformatted[0][amount_cols[0]] == '1000.5'
+
+    tx_ids = formatTxIDs(formatter, columns, rows)
+    assert all(tx_id.startswith(fc.COINSQUARE_TX_ID_PREFIX) for tx_id in tx_ids)
+    assert len(set(tx_ids)) == len(rows)
+    assert formatTxIDs(formatter, columns, reformatted) == tx_ids
+
+
+@pytest.mark.parametrize('formatter, columns, rows, amount_cols', FORMATTERS)
+def test_ids_survive_appended_rows(formatter, columns, rows, amount_cols):
+    tx_ids = formatTxIDs(formatter, columns, rows[:2])
+    assert formatTxIDs(formatter, columns, rows)[:2] == tx_ids
+
+
+@pytest.mark.parametrize('formatter, columns, rows, amount_cols', FORMATTERS)
+def test_repeated_rows_are_numbered(formatter, columns, rows, amount_cols):
+    repeated = [rows[0], rows[1], rows[0], rows[0]]
+    tx_ids = formatTxIDs(formatter, columns, repeated)
+    assert tx_ids[2] == tx_ids[0] + '-2'
+    assert tx_ids[3] == tx_ids[0] + '-3'
+    assert tx_ids[1] == formatTxIDs(formatter, columns, rows)[1]
+
+    # A re-export with the amounts written differently numbers them the same way
+    assert formatTxIDs(formatter, columns, reformatAmounts(repeated, amount_cols)) == tx_ids
+
+
+@pytest.mark.parametrize('header, rows', [(FUND_AND_WITHDRAW_HEADER, FUND_AND_WITHDRAW_ROWS),
+    (QUICK_TRADE_HEADER, QUICK_TRADE_ROWS)])
+def test_csv_and_xlsx_reports_give_the_same_ids(tmp_path, header, rows):
+    csv_ids = formatReportTxIDs(writeCSVReport(tmp_path / 'report.csv', [header] + rows))
+
+    writeXlsxReport(tmp_path / 'report.xlsx', [header] + rows)
+    assert formatReportTxIDs(tmp_path / 'report.xlsx') == csv_ids
+
+    # Amounts stored as numeric cells instead of text
+    numeric_rows = [[float(value.replace(',', '')) if col in (2, 3, 4) and header[col].endswith('amount')
+        else value for col, value in enumerate(row)] for row in rows]
+    writeXlsxReport(tmp_path / 'numeric.xlsx', [header] + numeric_rows)
+    assert formatReportTxIDs(tmp_path / 'numeric.xlsx') == csv_ids
+
+
+# Processes the reports directory into the SQLite Master Ledger, returning the tx_ids of the whole ledger
+def processLedgerTxIDs(crypto_dir):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.processReports(crypto_dir / 'Reports', str(crypto_dir / 'Results') + os.sep, crypto_dir / 'ledger.db')
+        return sorted(tx.tx_id for tx in fc.queryLedger(crypto_dir / 'ledger.db'))
+
+
+def test_prefix_skip_gives_the_same_ids_as_a_single_pass(tmp_path, monkeypatch):
+    monkeypatch.setattr(fc, 'MANIFEST_CHECKPOINT_ROWS', 4)
+    monkeypatch.delenv(fc.PRICES_ENV_VAR, raising=False)
+
+    # Identical rows on both sides of the end of the first export, so the numbering carries over the skipped rows
+    rows = [QUICK_TRADE_ROWS[i % 3] for i in range(10)] + [QUICK_TRADE_ROWS[0], QUICK_TRADE_ROWS[0]]
+    first_export = [QUICK_TRADE_HEADER] + rows[:9]
+    second_export = [QUICK_TRADE_HEADER] + rows
+
+    incremental_dir = tmp_path / 'incremental'
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.init(incremental_dir / 'Reports', incremental_dir / 'Results', incremental_dir / 'ledger.db')
+    writeCSVReport(incremental_dir / 'Reports' / 'first.csv', first_export)
+    processLedgerTxIDs(incremental_dir)
+    writeCSVReport(incremental_dir / 'Reports' / 'second.csv', second_export)
+    incremental_ids = processLedgerTxIDs(incremental_dir)
+
+    single_dir = tmp_path / 'single'
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.init(single_dir / 'Reports', single_dir / 'Results', single_dir / 'ledger.db')
+    writeCSVReport(single_dir / 'Reports' / 'second.csv', second_export)
+    single_ids = processLedgerTxIDs(single_dir)
+
+    assert len(single_ids) == len(rows)
+    assert incremental_ids == single_ids
+    assert sorted(formatReportTxIDs(single_dir / 'Results' / next(
+        name for name in os.listdir(single_dir / 'Results') if name.endswith('_Raw.csv')))) == single_ids
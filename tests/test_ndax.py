@@ -0,0 +1,50 @@
+import contextlib
+import io
+from datetime import datetime
+from itertools import permutations
+
+import pytest
+
+import formatCointracker as fc
+
+# The legs of a trade buying 0.01 BTC for 500 CAD with a 0.00002 BTC fee, a minute apart
+FEE_LEG = ['11', '500', '2021-02-01', '1:05 AM', 'Trade', 'BTC', 'CryptoCurrency', '-0.00002']
+RECEIVED_LEG = ['12', '500', '2021-02-01', '1:06 AM', 'Trade', 'BTC', 'CryptoCurrency', '0.01']
+SENT_LEG = ['13', '500', '2021-02-01', '1:07 AM', 'Trade', 'CAD', 'NationalCurrency', '-500']
+
+
+# Formats NDAX report rows, returning the fields of their transactions
+def formatNDAXTransactions(rows):
+    data = []
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.formatNDAXReport(data, dict(fc.NDAX_COLUMNS), iter(rows), lambda row: None, {})
+    return [(tx.tx_id, tx.date, tx.received_qty, tx.received_currency, tx.sent_qty, tx.sent_currency,
+        tx.fee_amount, tx.fee_currency) for tx in data]
+
+
+# The transactions formatted from the fee first orders before the legs were grouped by ref_id
+@pytest.mark.parametrize('legs, expected', [
+    ([FEE_LEG, RECEIVED_LEG, SENT_LEG], ('13', '02/01/2021 01:07:00', 0.01, 'BTC', 500.0, 'CAD', 2e-05, 'BTC')),
+    ([FEE_LEG, SENT_LEG, RECEIVED_LEG], ('12', '02/01/2021 01:06:00', 0.01, 'BTC', 500.0, 'CAD', 2e-05, 'BTC')),
+])
+def test_trade_matches_earlier_tx_ids(legs, expected):
+    assert formatNDAXTransactions(legs) == [expected]
+
+
+def test_trade_tx_id_and_date_come_from_its_last_leg_in_any_order():
+    for legs in permutations([FEE_LEG, RECEIVED_LEG, SENT_LEG]):
+        (tx,) = formatNDAXTransactions(legs)
+        assert tx[0] == legs[-1][0]
+        assert tx[1] == fc.formatNDAXDate(legs[-1][2], legs[-1][3])
+        assert tx[2:] == (0.01, 'BTC', 500.0, 'CAD', 2e-05, 'BTC')
+
+
+# 12 AM is the hour after midnight and 12 PM the hour after noon
+@pytest.mark.parametrize('raw_time, expected', [
+    ('12:05 AM', (datetime(2021, 2, 1, 0, 5), '02/01/2021 00:05:00')),
+    ('12:05 PM', (datetime(2021, 2, 1, 12, 5), '02/01/2021 12:05:00')),
+    ('1:05 AM', (datetime(2021, 2, 1, 1, 5), '02/01/2021 01:05:00')),
+    ('1:05 PM', (datetime(2021, 2, 1, 13, 5), '02/01/2021 13:05:00')),
+])
+def test_normalize_ndax_date_12_hour_times(raw_time, expected):
+    assert fc.normalizeNDAXDate('2021-02-01', raw_time) == expected
@@ -0,0 +1,57 @@
+import contextlib
+import io
+import shutil
+
+import pytest
+
+import formatCointracker as fc
+from generateReports import REPORT_TYPES, generateReport
+
+NUM_ROWS = 200
+
+
+# Creates a crypto directory with a report of each type, returning its reports, results and ledger paths
+def makeCryptoDir(crypto_dir, report_paths):
+    reports_path = crypto_dir / 'Reports'
+    results_path = crypto_dir / 'Results'
+    ledger_path = crypto_dir / 'ledger.db'
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.init(reports_path, results_path, ledger_path)
+    for report_path in report_paths:
+        shutil.copy(report_path, reports_path / report_path.name)
+    return reports_path, results_path, ledger_path
+
+
+# Processes the reports, returning the rows of the whole ledger
+def processLedgerRows(reports_path, results_path, ledger_path, pipeline):
+    with contextlib.redirect_stdout(io.StringIO()):
+        fc.processReports(reports_path, results_path, ledger_path, pipeline=pipeline)
+        return sorted(tx.toRow() for tx in fc.queryLedger(ledger_path))
+
+
+@pytest.fixture
+def report_paths(tmp_path, monkeypatch):
+    monkeypatch.delenv(fc.PRICES_ENV_VAR, raising=False)
+    (tmp_path / 'generated').mkdir()
+    return [generateReport(report_type, NUM_ROWS, tmp_path / 'generated') for report_type in REPORT_TYPES]
+
+
+@pytest.mark.parametrize('rerun_pipeline', [True, False])
+def test_pipeline_interrupted_before_the_ledger_recovers_its_reports(tmp_path, monkeypatch, report_paths,
+                                                                     rerun_pipeline):
+    expected = processLedgerRows(*makeCryptoDir(tmp_path / 'serial', report_paths), pipeline=False)
+
+    reports_path, results_path, ledger_path = makeCryptoDir(tmp_path / 'pipeline', report_paths)
+    with monkeypatch.context() as patch:
+        def interrupt(*args):
+            raise KeyboardInterrupt
+        patch.setattr(fc, 'updateMasterLedger', interrupt)
+        with pytest.raises(KeyboardInterrupt):
+            processLedgerRows(reports_path, results_path, ledger_path, pipeline=True)
+
+    # The reports were moved to the results, leaving only their journals to recover them from
+    assert not any(reports_path.iterdir())
+    assert len(list(results_path.glob('*' + fc.JOURNAL_SUFFIX))) == len(report_paths)
+
+    assert processLedgerRows(reports_path, results_path, ledger_path, rerun_pipeline) == expected
+    assert not list(results_path.glob('*' + fc.JOURNAL_SUFFIX))
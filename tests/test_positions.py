@@ -0,0 +1,43 @@
+import pytest
+
+import formatCointracker as fc
+
+
+# Returns a Master Ledger transaction with only the fields the positions use
+def makeTx(received_qty, received_currency, sent_qty, sent_currency, fee_amount=None, fee_currency=None,
+            cost_basis=None, cost_basis_units=None):
+    return fc.Transaction('02/01/2021 12:00:00', received_qty, received_currency, sent_qty, sent_currency,
+        fee_amount, fee_currency, cost_basis, cost_basis_units, 'Coinsquare', None)
+
+
+# Applies the transactions to a new PositionEngine, returning it
+def applyAll(transactions):
+    engine = fc.PositionEngine()
+    for tx in transactions:
+        engine.apply(tx)
+    return engine
+
+
+def test_valued_crypto_trade_realizes_gain_and_sets_received_acb():
+    engine = applyAll([
+        makeTx(1.0, 'BTC', 40000.0, 'CAD', cost_basis=40000.0, cost_basis_units='CAD/BTC'),
+        # 0.5 BTC traded for 10.1 ETH less a 0.1 ETH fee, the ETH being worth 2,500 CAD each
+        makeTx(10.1, 'ETH', 0.5, 'BTC', 0.1, 'ETH', cost_basis=2500.0, cost_basis_units='CAD/ETH'),
+    ])
+    btc = engine.positions['BTC']
+    eth = engine.positions['ETH']
+    assert btc.quantity == pytest.approx(0.5)
+    assert btc.acb == pytest.approx(20000.0)
+    assert btc.realized_gain == pytest.approx(25000.0 - 20000.0)
+    assert eth.quantity == pytest.approx(10.0)
+    assert eth.acb == pytest.approx(25000.0)
+
+
+def test_unvalued_crypto_trade_carries_acb_over():
+    engine = applyAll([
+        makeTx(1.0, 'BTC', 40000.0, 'CAD', cost_basis=40000.0, cost_basis_units='CAD/BTC'),
+        makeTx(10.1, 'ETH', 0.5, 'BTC', 0.1, 'ETH'),
+    ])
+    assert engine.positions['BTC'].realized_gain == 0.0
+    assert engine.positions['ETH'].quantity == pytest.approx(10.0)
+    assert engine.positions['ETH'].acb == pytest.approx(20000.0)
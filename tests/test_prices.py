@@ -0,0 +1,33 @@
+from datetime import datetime, timedelta
+
+import formatCointracker as fc
+
+
+# Writes a price file of rows under a header, returning its path
+def writePriceFile(path, header, rows):
+    path.write_text('\n'.join([header] + rows) + '\n', encoding='utf8')
+    return path
+
+
+def test_price_file_epoch_seconds_and_milliseconds(tmp_path):
+    price_path = writePriceFile(tmp_path / 'BTC-CAD.csv', 'timestamp,close', ['1612137600,42000', '1612224000000,43000'])
+    series = fc.readPriceFile(price_path)
+    assert series.timestamps == [datetime(2021, 2, 1), datetime(2021, 2, 2)]
+    assert series.prices == [42000.0, 43000.0]
+
+
+def test_price_file_timezone_aware_timestamps_are_naive_utc(tmp_path):
+    price_path = writePriceFile(tmp_path / 'BTC-CAD.csv', 'datetime,price',
+        ['2021-02-01T00:00:00Z,42000', '2021-02-01T00:00:00-05:00,42500'])
+    series = fc.readPriceFile(price_path)
+    assert series.timestamps == [datetime(2021, 2, 1), datetime(2021, 2, 1, 5)]
+    assert series.nearest(datetime(2021, 2, 1, 4), timedelta(hours=36)) == 42500.0
+
+
+def test_price_file_skips_unparseable_rows(tmp_path, capsys):
+    price_path = writePriceFile(tmp_path / 'BTC-CAD.csv', 'date,close',
+        ['2021-02-01,42000', 'not a date,43000', '2021-02-03,n/a', '2021-02-04,"44,000.50"'])
+    series = fc.readPriceFile(price_path)
+    assert series.timestamps == [datetime(2021, 2, 1, 12), datetime(2021, 2, 4, 12)]
+    assert series.prices == [42000.0, 44000.5]
+    assert 'Skipped 2 row(s) of BTC-CAD.csv' in capsys.readouterr().out
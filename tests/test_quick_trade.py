@@ -0,0 +1,131 @@
+import random
+from datetime import date, timedelta
+
+import pytest
+
+import formatCointracker as fc
+
+np = pytest.importorskip('numpy')
+
+# Days the generated trades are spread over, each of which has a price in the price files
+START_DATE = date(2021, 1, 1)
+NUM_DAYS = 28
+
+# Cryptos traded and their typical price range in CAD
+CRYPTO_PRICES = {'BTC': (30000, 60000), 'ETH': (1000, 4000), 'DOGE': (.01, .5)}
+
+
+# Returns a random amount of a currency as a report would write it
+def randomAmount(rng, currency, low, high):
+    decimals = 2 if currency == 'CAD' else 8
+    return f'{rng.uniform(low, high):,.{decimals}f}'
+
+
+# Generates seeded quick trade rows mixing buys, sells and crypto to crypto trades
+def makeQuickTradeRows(seed, num_rows):
+    rng = random.Random(seed)
+    rows = []
+    for _ in range(num_rows):
+        tx_date = (START_DATE + timedelta(days=rng.randrange(NUM_DAYS))).strftime('%d-%m-%y')
+        crypto = rng.choice(list(CRYPTO_PRICES))
+        trade = rng.choice(['buy', 'sell', 'crypto'])
+        if trade == 'buy':
+            rows.append([tx_date, 'CAD', randomAmount(rng, 'CAD', 10, 5000), crypto, randomAmount(rng, crypto, .001, 3)])
+        elif trade == 'sell':
+            rows.append([tx_date, crypto, randomAmount(rng, crypto, .001, 3), 'CAD', randomAmount(rng, 'CAD', 10, 5000)])
+        else:
+            other = rng.choice([currency for currency in CRYPTO_PRICES if currency != crypto])
+            rows.append([tx_date, crypto, randomAmount(rng, crypto, .001, 3), other, randomAmount(rng, other, .001, 3)])
+    return rows
+
+
+# Writes a daily CAD price file for each crypto
+def writePriceFiles(prices_dir):
+    rng = random.Random('prices')
+    for currency, (low, high) in CRYPTO_PRICES.items():
+        lines = ['date,close']
+        for day in range(NUM_DAYS):
+            lines.append(f'{(START_DATE + timedelta(days=day)).isoformat()},{rng.uniform(low, high)}')
+        (prices_dir / f'{currency}-CAD.csv').write_text('\n'.join(lines) + '\n')
+
+
+# Runs a quick trade formatter over rows, returning its written rows and ledger transactions
+def formatRows(formatter, rows):
+    data = []
+    written = []
+    formatter(data, dict(fc.QUICK_TRADE_COLUMNS), iter(rows), written.append, {})
+    return written, [tx.toRow() for tx in data]
+
+
+@pytest.fixture
+def prices(tmp_path, monkeypatch):
+    writePriceFiles(tmp_path)
+    monkeypatch.setenv(fc.PRICES_ENV_VAR, str(tmp_path))
+    return tmp_path
+
+
+@pytest.mark.parametrize('chunk_size', [fc.QUICK_TRADE_CHUNK_SIZE, 64])
+def test_vectorized_matches_rows(prices, monkeypatch, chunk_size):
+    monkeypatch.setattr(fc, 'QUICK_TRADE_CHUNK_SIZE', chunk_size)
+    rows = makeQuickTradeRows(2021, 1000)
+
+    written, data = formatRows(fc.formatQuickTradeReport, rows)
+    expected_written, expected_data = formatRows(fc.formatQuickTradeRows, rows)
+
+    assert written == expected_written
+    assert data == expected_data
+
+    # Every kind of trade was covered, and the crypto to crypto ones were valued in CAD
+    tx_types = {fc.getTradeType(row[3], row[1]) for row in rows}
+    assert tx_types == {fc.BUY_TX, fc.SELL_TX, fc.CRYPTO_TX}
+    assert all(row[7] is not None for row in data)
+
+
+def test_vectorized_matches_rows_without_prices(monkeypatch):
+    monkeypatch.delenv(fc.PRICES_ENV_VAR, raising=False)
+    rows = makeQuickTradeRows(7, 300)
+
+    assert formatRows(fc.formatQuickTradeReport, rows) == formatRows(fc.formatQuickTradeRows, rows)
+
+
+def test_large_eth_amounts_fall_back_to_python_integers(prices, monkeypatch):
+    monkeypatch.setattr(fc, 'QUICK_TRADE_CHUNK_SIZE', 50)
+    rng = random.Random(18)
+
+    # The first chunk fits in int64, the second holds ETH amounts with 18 decimals too large for it
+    rows = makeQuickTradeRows(3, 50)
+    for _ in range(50):
+        eth_amount = f'{rng.randrange(10, 1000)}.{rng.randrange(10 ** 18):018d}'
+        if rng.random() < .5:
+            rows.append(['15-01-21', 'CAD', randomAmount(rng, 'CAD', 10000, 90000), 'ETH', eth_amount])
+        else:
+            rows.append(['15-01-21', 'ETH', eth_amount, rng.choice(['CAD', 'BTC']), randomAmount(rng, 'BTC', 1, 5)])
+
+    small_chunk = [(fc.parseAmount(row[4], row[3]), row[3], fc.parseAmount(row[2], row[1]), row[1])
+        for row in rows[:50]]
+    large_chunk = [(fc.parseAmount(row[4], row[3]), row[3], fc.parseAmount(row[2], row[1]), row[1])
+        for row in rows[50:]]
+    assert fc.calcQuickTradeColumns(*map(list, zip(*small_chunk)))[2].dtype == np.int64
+    assert fc.calcQuickTradeColumns(*map(list, zip(*large_chunk)))[2].dtype == object
+
+    assert formatRows(fc.formatQuickTradeReport, rows) == formatRows(fc.formatQuickTradeRows, rows)
+
+
+def test_fees_and_cost_basis_are_rounded_half_to_even():
+    # Selling 0.00001225 BTC pays a 0.2% fee of 2.45 satoshis, which rounds to 2, and 0.00001275 BTC pays 2.55,
+    # which rounds to 3
+    received_qtys, fee_amounts, cost_bases = fc.calcQuickTradeColumns(
+        [100, 100], ['CAD', 'CAD'], [1225, 1275], ['BTC', 'BTC'])[1:]
+    assert fee_amounts.tolist() == [2, 3]
+    assert received_qtys.tolist() == [100, 100]
+    assert cost_bases.tolist() == [81632.653, 78431.373]
+
+
+def test_crypto_trade_cost_basis_is_exact():
+    # 0.1 BTC buys 0.1 ETH net of its fee, so the cost basis is the BTC price in CAD: the ties of 4.0045 and 0.1235
+    # round half to even, where the float division rounded them the other way
+    eth_fee = 5 * 10 ** 14
+    cost_bases = [fc.calcTxCostBasis(10 ** 17 + eth_fee, 'ETH', 10 ** 7, 'BTC', eth_fee, fc.CRYPTO_TX, price)
+        for price in (4.0045, 0.1235)]
+    assert [cost_basis["cost_basis"] for cost_basis in cost_bases] == [4.004, 0.124]
+    assert cost_bases[0]["cost_basis_units"] == 'CAD/ETH'